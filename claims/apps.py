@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ClaimsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'claims'
+
+    def ready(self):
+        from claims import profiling
+        connection_created.connect(profiling.install_query_hook)      #query timings of ProfilingMiddleware
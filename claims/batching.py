@@ -0,0 +1,12 @@
+#sizes shared by the modules that work through the claims tables a slice at a time
+
+#claims per UPDATE, keeps the IN (...) list under SQLite's parameter limit
+BATCH_SIZE = 500
+
+#rows fetched from the database at a time by the streamed exports and dumps
+CHUNK_SIZE = 2000
+
+#consecutive slices of a list, size items each
+def batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
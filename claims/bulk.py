@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.db.models import Case, CharField, F, Min, Q, TextField, Value, When
+from django.db.models.functions import Concat
+from claims import facets, fragments, mirrors, summary
+from claims.batching import batches
+from claims.models import Claim, ClaimDetail, ClaimStatus, Insurer
+
+#bulk edits of many claims at once, the same changes edit_claim makes to one claim
+#every batch is one UPDATE of the claims and one of their details, all inside a single transaction,
+#and the edited claims reach the JSON/CSV mirrors in one submit_many call
+
+#separators used when text is appended, same as edit_claim
+CPT_SEPARATOR = ','
+DENIAL_SEPARATOR = '. '
+
+#value of field after a change, appended with the separator or written over it
+#appending to an empty value just sets it, same as edit_claim
+def changed_text(field, text, append, separator, output_field):
+    if not append:
+        return Value(text)
+    return Case(
+        When(Q(**{f'{field}__isnull': True}) | Q(**{field: ''}), then=Value(text)),
+        default=Concat(F(field), Value(separator + text), output_field=output_field),
+        output_field=output_field,
+    )
+
+#pk of the first detail of each claim, the one edit_claim edits
+def first_detail_ids(claim_pks):
+    return ClaimDetail.objects.filter(claim_id__in=claim_pks).values('claim_id').annotate(first=Min('id')).values('first')
+
+#moves the claims changing group in the report summary, before the UPDATE changes their status or insurer
+def record_moves(claim_pks, claim_status, insurer, delta):
+    rows = list(
+        Claim.objects.filter(pk__in=claim_pks)
+        .values_list('claim_id', 'claim_status_id', 'insurer_id', 'claim_status__name', 'insurer__name', 'billed_amount', 'paid_amount')
+    )
+    moving = [
+        row for row in rows
+        if (claim_status and row[1] != claim_status.pk) or (insurer and row[2] != insurer.pk)
+    ]
+    flags = summary.flags_by_claim_id([row[0] for row in moving])
+    for claim_id, _, _, status, insurer_name, billed, paid in moving:
+        count = flags.get(claim_id, 0)
+        delta.remove_claim(status, insurer_name, billed, paid, count)
+        delta.add_claim(
+            claim_status.name if claim_status else status, insurer.name if insurer else insurer_name, billed, paid, count,
+        )
+    return len(moving)
+
+#applies one set of changes to every claim in claim_pks, returns the number of claims edited
+#status and insurer_name replace the claim's lookups, cpt_codes and denial_reason change the claim's first detail,
+#blank values are left unchanged
+def bulk_edit(claim_pks, status='', insurer_name='', cpt_codes='', cpt_append=False, denial_reason='', denial_append=False):
+    claim_pks = sorted(set(claim_pks))
+    if not claim_pks:
+        return 0
+
+    claim_changes = {}
+    detail_changes = {}
+    if cpt_codes:
+        detail_changes['cpt_codes'] = changed_text('cpt_codes', cpt_codes, cpt_append, CPT_SEPARATOR, CharField())
+    if denial_reason:
+        detail_changes['denial_reason'] = changed_text('denial_reason', denial_reason, denial_append, DENIAL_SEPARATOR, TextField())
+
+    delta = summary.SummaryDelta()
+    moved = 0
+    with transaction.atomic():
+        claim_status = ClaimStatus.objects.get_or_create(name=status)[0] if status else None
+        insurer = Insurer.objects.get_or_create(name=insurer_name)[0] if insurer_name else None
+        if claim_status:
+            claim_changes['claim_status'] = claim_status
+        if insurer:
+            claim_changes['insurer'] = insurer
+
+        for batch in batches(claim_pks):
+            if claim_changes:
+                moved += record_moves(batch, claim_status, insurer, delta)
+                Claim.objects.filter(pk__in=batch).update(       #no longer match the loaded file rows, cached fragments are rendered again
+                    row_hash='', version=fragments.NEXT_VERSION, **claim_changes,
+                )
+            if detail_changes:
+                ClaimDetail.objects.filter(pk__in=first_detail_ids(batch)).update(row_hash='', **detail_changes)
+                if not claim_changes:
+                    fragments.bump(batch)                   #the detail panel shows the first detail
+        delta.apply()
+
+    if moved:
+        facets.invalidate()                     #recounted on the next page load instead of adjusted claim by claim
+    submit_mirrors(claim_pks)
+    return len(claim_pks)
+
+#hands every edited claim and its first detail to the mirror write-back in a single call
+def submit_mirrors(claim_pks):
+    edits = []
+    for batch in batches(claim_pks):
+        claims = {claim.pk: claim for claim in Claim.objects.filter(pk__in=batch)}
+        details = {}
+        for detail in ClaimDetail.objects.filter(pk__in=first_detail_ids(batch)):
+            detail.claim = claims[detail.claim_id]          #mirror entries read claim.claim_id, no query per detail
+            details[detail.claim_id] = detail
+        edits.extend((claim, details.get(pk)) for pk, claim in claims.items())
+    mirrors.submit_many(edits)
@@ -0,0 +1,76 @@
+import os
+from django.conf import settings
+from claims import mirrors
+from claims.batching import CHUNK_SIZE
+from claims.mirrors import CLAIM_COLUMNS, CLAIM_FILE, DETAIL_COLUMNS, DETAIL_FILE
+from claims.models import Claim, ClaimDetail
+
+#full snapshot of the claim and detail tables in the data file layout, the database is the source of truth
+#rows are streamed with chunked iterators into temporary files that are renamed into place, so readers never see half a file
+
+#claim entries in claim id order, same shape as the journal entries (mirrors.claim_entry)
+def claim_items(counts, chunk_size=CHUNK_SIZE):
+    rows = (
+        Claim.objects.order_by('claim_id')
+        .values_list('claim_id', 'patient_name', 'billed_amount', 'paid_amount', 'claim_status__name', 'insurer__name', 'discharge_date')
+        .iterator(chunk_size=chunk_size)
+    )
+    for claim_id, *values in rows:
+        counts['claims'] += 1
+        yield dict(zip(CLAIM_COLUMNS, [claim_id] + [str(value) for value in values]))
+
+#detail entries in id order, same shape as mirrors.detail_entry
+def detail_items(counts, chunk_size=CHUNK_SIZE):
+    rows = (
+        ClaimDetail.objects.order_by('id')
+        .values_list('id', 'claim__claim_id', 'denial_reason', 'cpt_codes')
+        .iterator(chunk_size=chunk_size)
+    )
+    for detail_id, claim_id, denial_reason, cpt_codes in rows:
+        counts['details'] += 1
+        yield dict(zip(DETAIL_COLUMNS, (detail_id, claim_id, denial_reason or '', cpt_codes or '')))
+
+#the four data file paths, the configured mirror files unless out_dir is given
+def snapshot_paths(out_dir=None, compress=False):
+    if out_dir is None:
+        paths = {
+            'claim_json': settings.CLAIM_LIST_JSON,
+            'claim_csv': settings.CLAIM_LIST_CSV,
+            'detail_json': settings.CLAIM_DETAIL_JSON,
+            'detail_csv': settings.CLAIM_DETAIL_CSV,
+        }
+    else:
+        paths = {
+            'claim_json': os.path.join(out_dir, f'{CLAIM_FILE}.json'),
+            'claim_csv': os.path.join(out_dir, f'{CLAIM_FILE}.csv'),
+            'detail_json': os.path.join(out_dir, f'{DETAIL_FILE}.json'),
+            'detail_csv': os.path.join(out_dir, f'{DETAIL_FILE}.csv'),
+        }
+    suffix = '.gz' if compress else ''
+    return {key: f'{path}{suffix}' for key, path in paths.items()}
+
+#writes the claim and detail files in the requested formats ('json', 'csv'), returns ({'claims': n, 'details': n}, paths)
+#replacing the configured mirror files also empties the edit journal, its entries are already in the snapshot
+def dump(out_dir=None, formats=('json', 'csv'), compress=False, chunk_size=CHUNK_SIZE):
+    paths = snapshot_paths(out_dir, compress)
+    json_paths = {key: path for key, path in paths.items() if key.endswith('json') and 'json' in formats}
+    csv_paths = {key: path for key, path in paths.items() if key.endswith('csv') and 'csv' in formats}
+    replaces_mirrors = out_dir is None and not compress
+    counts = {'claims': 0, 'details': 0}
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    with mirrors.mirror_lock():                     #no compaction can patch the old files while they are replaced
+        mirrors.write_snapshot(
+            claim_items(counts, chunk_size), CLAIM_COLUMNS,
+            json_path=json_paths.get('claim_json'), csv_path=csv_paths.get('claim_csv'),
+            to_json=mirrors.json_claim, compress=compress,
+        )
+        mirrors.write_snapshot(
+            detail_items(counts, chunk_size), DETAIL_COLUMNS,
+            json_path=json_paths.get('detail_json'), csv_path=csv_paths.get('detail_csv'),
+            compress=compress,
+        )
+        if replaces_mirrors and json_paths and csv_paths:
+            open(settings.CLAIM_MIRROR_JOURNAL, 'w').close()
+    return counts, list(json_paths.values()) + list(csv_paths.values())
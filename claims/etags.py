@@ -0,0 +1,76 @@
+import hashlib
+from functools import cache, wraps
+from pathlib import Path
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from claims.models import Claim
+
+#ETags for the HTMX partials, built from claim versions (see claims.fragments) instead of the rendered HTML
+#versions never repeat for a pk, clear_table stores the highest one in the database and the next load starts above it,
+#so a browser holding an ETag from before a clear and reload never gets a false 304
+#the browser keeps each partial and revalidates it with If-None-Match, an unchanged one is answered with an empty 304
+#before anything is rendered, and htmx is handed the kept body as if it had been sent again
+
+#request headers the partials vary on, HX-Request keeps the table partial apart from the full page at the same URL,
+#Cookie keeps one user's copy (with their csrf token) from being revalidated for another
+VARY = ('HX-Request', 'Cookie')
+
+#files whose content decides the HTML of the partials, the claims app's code and templates
+APP_DIR = Path(__file__).resolve().parent
+RELEASE_FILES = ('**/*.py', '**/*.html')
+
+#salt used when CLAIM_ETAG_SALT is not set, a hash of SECRET_KEY and the release files, read once per process
+#the same in every server worker of a release, unlike a start time, so one worker's ETags are confirmed by another
+@cache
+def release_salt():
+    digest = hashlib.blake2b(settings.SECRET_KEY.encode(), digest_size=16)
+    for pattern in RELEASE_FILES:
+        for path in sorted(APP_DIR.glob(pattern)):
+            digest.update(str(path.relative_to(APP_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+#quoted ETag hashed from the release and the given parts
+def make_etag(*parts):
+    raw = repr((settings.CLAIM_ETAG_SALT or release_salt(),) + parts).encode()
+    return quote_etag(hashlib.blake2b(raw, digest_size=16).hexdigest())
+
+#the browser may store the response but must revalidate it on every request, nothing is shared between users
+def revalidate(response, etag=None):
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, VARY)
+    return response
+
+#ETag of a claim partial, the claim's version covers its details, notes and flags
+#None for an unknown pk so the view answers with its 404
+async def claim_etag(request, pk):
+    version = await Claim.objects.filter(pk=pk).values_list('version', flat=True).afirst()
+    if version is None:
+        return None
+    return make_etag(request.resolver_match.url_name, pk, version)
+
+#decorator for the async claim partial views, 304 while the claim's version is unchanged
+#does what django's condition() does, which cannot await the version lookup
+def claim_partial(view):
+    @wraps(view)
+    async def inner(request, pk):
+        etag = await claim_etag(request, pk)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, pk)
+        return revalidate(response, etag if request.method in ('GET', 'HEAD') else None)
+    return inner
+
+#ETag of a claims table page, the query string, the rows on the page with their versions and whether there are more pages
+def table_etag(request, page):
+    rows = [(claim.pk, claim.version) for claim in page]
+    number = getattr(page, 'number', None)            #offset pages only, an out of range page number gives the last page
+    return make_etag('table', request.GET.urlencode(), number, rows, page.has_previous(), page.has_next())
+
+#304 response for a table page the browser already has, otherwise None
+def table_not_modified(request, etag):
+    response = get_conditional_response(request, etag=etag)
+    return revalidate(response, etag) if response is not None else None
@@ -0,0 +1,83 @@
+import csv
+from django.db.models import OuterRef, Subquery
+from claims.batching import CHUNK_SIZE
+from claims.mirrors import json_array_chunks
+from claims.models import Claim, ClaimDetail
+
+#streamed downloads of the claims the home table shows, one row per claim with its first detail's CPT codes and denial reason
+#rows are read with iterator(chunk_size) as plain values, so memory stays flat and the first bytes leave before the last row is read
+
+#bytes of output collected before they are handed to the response
+BUFFER_SIZE = 64 * 1024
+
+#column names, claim columns as in claim_list_data followed by the detail columns of claim_detail_data
+COLUMNS = (
+    'id', 'patient_name', 'billed_amount', 'paid_amount', 'status', 'insurer_name', 'discharge_date',
+    'denial_reason', 'cpt_codes',
+)
+
+#file extension -> content type
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+#values of every claim matching filters in id order, the first detail of each claim is looked up by the claim fk index
+def export_rows(filters, chunk_size=CHUNK_SIZE):
+    first_detail = ClaimDetail.objects.filter(claim=OuterRef('pk')).order_by('id')
+    return (
+        Claim.objects.filter(filters)
+        .order_by('id')
+        .annotate(
+            denial_reason=Subquery(first_detail.values('denial_reason')[:1]),
+            cpt_codes=Subquery(first_detail.values('cpt_codes')[:1]),
+        )
+        .values_list(
+            'claim_id', 'patient_name', 'billed_amount', 'paid_amount', 'claim_status__name', 'insurer__name',
+            'discharge_date', 'denial_reason', 'cpt_codes',
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+#file-like object that hands back what csv.writer writes instead of storing it
+class Echo:
+    def write(self, value):
+        return value
+
+#pipe delimited CSV, same layout as the data files
+def csv_chunks(rows):
+    writer = csv.writer(Echo(), delimiter='|')
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+#JSON array of objects, amounts are numbers as in the data files
+def json_chunks(rows):
+    def items():
+        for row in rows:
+            item = dict(zip(COLUMNS, row))
+            item['billed_amount'] = float(item['billed_amount'])
+            item['paid_amount'] = float(item['paid_amount'])
+            item['discharge_date'] = str(item['discharge_date'])
+            yield item
+    return json_array_chunks(items())
+
+#joins small chunks into pieces of about BUFFER_SIZE so the response is not written one row at a time
+def buffered(chunks, size=BUFFER_SIZE):
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield ''.join(parts)
+
+#text chunks of the export in the given format ('csv' or 'json')
+def export_chunks(filters, file_format):
+    rows = export_rows(filters)
+    chunks = csv_chunks(rows) if file_format == 'csv' else json_chunks(rows)
+    return buffered(chunks)
@@ -0,0 +1,78 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.conf import settings
+from django.db.models import Count
+from claims import generations
+from claims.models import Claim, ClaimStatus, Insurer
+
+#cached insurer and status dropdown values with the number of claims for each
+#built once with one GROUP BY query per field, then kept current by edit_claim and recounted after bulk changes
+#the key holds the FACETS generation from the database, so a load or clear_table run in another process is seen by
+#every server process on its next page load, the timeout only bounds how stale another process's single edits can be
+FACETS_KEY = 'claims:facets:{generation}'
+
+#field name -> key of its value list in the facets dict
+FACET_FIELDS = {
+    'insurer_name': 'insurers',
+    'status': 'statuses',
+}
+
+#field name -> (claim fk, lookup model) the values are counted by
+FACET_LOOKUPS = {
+    'insurer_name': ('insurer', Insurer),
+    'status': ('claim_status', ClaimStatus),
+}
+
+#groups the claims table by each lookup id, returns {'insurers': [(name, count), ...], 'statuses': [...]}
+def build_facets():
+    facets = {}
+    for field, key in FACET_FIELDS.items():
+        fk, model = FACET_LOOKUPS[field]
+        names = dict(model.objects.values_list('id', 'name'))
+        counts = Claim.objects.order_by().values_list(f'{fk}_id').annotate(count=Count('id'))     #integer group by
+        facets[key] = sorted((names[pk], count) for pk, count in counts)
+    return facets
+
+#cache key of the current facets
+def facets_key():
+    return FACETS_KEY.format(generation=generations.get(generations.FACETS))
+
+#facets from the cache, rebuilt on a miss
+def get_facets():
+    key = facets_key()
+    facets = cache.get(key)
+    if facets is None:
+        facets = build_facets()
+        cache.set(key, facets, settings.CLAIM_FACETS_TIMEOUT)
+    return facets
+
+#get_facets for async views, a miss is rebuilt in a thread since the GROUP BY queries are sync
+async def aget_facets():
+    key = FACETS_KEY.format(generation=await generations.aget(generations.FACETS))
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = await sync_to_async(build_facets)()
+        await cache.aset(key, facets, settings.CLAIM_FACETS_TIMEOUT)
+    return facets
+
+#retires the cached facets of every server process, used after bulk changes such as load_claims and clear_table
+def invalidate():
+    generations.bump(generations.FACETS)
+
+#moves one claim from old values to new values, e.g. {'status': ('Denied', 'Paid')}, in this process's cached copy
+def adjust(changes):
+    key = facets_key()
+    facets = cache.get(key)
+    if facets is None:                  #nothing cached, the next read rebuilds it anyway
+        return
+
+    for field, (old, new) in changes.items():
+        if old == new:
+            continue
+        counts = dict(facets[FACET_FIELDS[field]])
+        counts[old] = counts.get(old, 0) - 1
+        if counts[old] <= 0:            #last claim with that value
+            del counts[old]
+        counts[new] = counts.get(new, 0) + 1
+        facets[FACET_FIELDS[field]] = sorted(counts.items())
+    cache.set(key, facets, settings.CLAIM_FACETS_TIMEOUT)
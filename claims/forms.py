@@ -1,5 +1,5 @@
 from django import forms
-from .models import Note, Claim
+from .models import Note, Claim, ClaimStatus, Insurer
 
 class NoteForm(forms.ModelForm):   #builds form based on existing fields
     class Meta:
@@ -22,6 +22,17 @@ class NoteForm(forms.ModelForm):   #builds form based on existing fields
 
 
 class EditClaimForm(forms.ModelForm):
+
+    # Status and insurer are typed as names, save() points the claim at the matching lookup rows
+    status = forms.CharField(
+        max_length=50,
+        widget=forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'})
+    )
+
+    insurer_name = forms.CharField(
+        max_length=255,
+        widget=forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'})
+    )
     
     # Extra fields for ClaimDetail
     cpt_codes = forms.CharField(
@@ -68,31 +79,105 @@ class EditClaimForm(forms.ModelForm):
     #everything here will overwrite always if the user changes the value
     class Meta:
         model = Claim
-        fields = ['patient_name', 'discharge_date', 'status', 'billed_amount', 'paid_amount', 'insurer_name']
+        fields = ['patient_name', 'discharge_date', 'billed_amount', 'paid_amount']
         widgets = {
             'patient_name': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
             'discharge_date': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
-            'status': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
             'billed_amount': forms.NumberInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
             'paid_amount': forms.NumberInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
-            'insurer_name': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded'}),
         }
 
+    #prefills the name fields from the claim's lookup rows
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['status'].initial = self.instance.status
+            self.fields['insurer_name'].initial = self.instance.insurer_name
+
+    #resolves the typed names to lookup rows, a name not seen before gets a new row
+    def save(self, commit=True):
+        self.instance.claim_status, _ = ClaimStatus.objects.get_or_create(name=self.cleaned_data['status'])
+        self.instance.insurer, _ = Insurer.objects.get_or_create(name=self.cleaned_data['insurer_name'])
+        return super().save(commit)
+
     #capitalizes every word for every character field, except denial reason where only first word is capitalized
     def clean(self):
-        cleaned_data = super().clean()      #get the forms cleaned data
+        return capitalize_fields(super().clean())
 
-        for field_name, value in cleaned_data.items():
-            if value and isinstance(value, str):  # only text fields
-                
-                if field_name == "denial_reason":
-                    
-                    #capitalize only the first letter
-                    cleaned_data[field_name] = value.capitalize()
-
-                else:
-                    
-                    #capitalize first letter of each word
-                    cleaned_data[field_name] = value.title()
-
-        return cleaned_data
\ No newline at end of file
+
+#capitalizes every word of the text values in cleaned_data, except denial reason where only first word is capitalized
+#fields limits it to the given field names
+def capitalize_fields(cleaned_data, fields=None):
+    for field_name, value in cleaned_data.items():
+        if value and isinstance(value, str) and (fields is None or field_name in fields):  # only text fields
+
+            if field_name == "denial_reason":
+
+                #capitalize only the first letter
+                cleaned_data[field_name] = value.capitalize()
+
+            else:
+
+                #capitalize first letter of each word
+                cleaned_data[field_name] = value.title()
+
+    return cleaned_data
+
+
+#list of claim pks posted by the table checkboxes, one value per checked box
+class ClaimIdsField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return [int(pk) for pk in value or []]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Invalid claim selection.")
+
+
+#same changes as EditClaimForm for many claims, applied to the checked rows or to every row matching the table filters
+#blank fields are left unchanged
+class BulkEditForm(forms.Form):
+
+    SCOPES = (
+        ('selected', 'Selected claims'),
+        ('filter', 'All claims matching the current search and filters'),
+    )
+
+    scope = forms.ChoiceField(choices=SCOPES, widget=forms.RadioSelect, initial='selected', label="Apply To")
+    claim_ids = ClaimIdsField(required=False)
+
+    #table search and filters the "filter" scope is resolved with
+    filter_q = forms.CharField(required=False, widget=forms.HiddenInput)
+    filter_insurer = forms.CharField(required=False, widget=forms.HiddenInput)
+    filter_status = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    status = forms.CharField(
+        required=False,
+        max_length=50,
+        widget=forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded', 'placeholder': 'New status'})
+    )
+
+    insurer_name = forms.CharField(
+        required=False,
+        max_length=255,
+        label="Insurer Name",
+        widget=forms.TextInput(attrs={'class': 'w-full px-3 py-2 border rounded', 'placeholder': 'New insurer'})
+    )
+
+    cpt_codes = EditClaimForm.base_fields['cpt_codes']
+    denial_reason = EditClaimForm.base_fields['denial_reason']
+    cpt_mode = EditClaimForm.base_fields['cpt_mode']
+    denial_mode = EditClaimForm.base_fields['denial_mode']
+
+    #fields capitalized like EditClaimForm, the filters and scope are kept as posted
+    CAPITALIZED = ('status', 'insurer_name', 'cpt_codes', 'denial_reason', 'cpt_mode', 'denial_mode')
+
+    def clean(self):
+        cleaned_data = capitalize_fields(super().clean(), self.CAPITALIZED)
+
+        if not any(cleaned_data.get(field) for field in ('status', 'insurer_name', 'cpt_codes', 'denial_reason')):
+            raise forms.ValidationError("Enter at least one change.")
+        if cleaned_data.get('scope') == 'selected' and not cleaned_data.get('claim_ids'):
+            raise forms.ValidationError("Select at least one claim in the table.")
+        return cleaned_data
@@ -0,0 +1,83 @@
+import os
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db.models import F, Max
+from claims import generations
+from claims.batching import batches
+from claims.models import Claim
+
+#rendered claim table rows and detail panels, cached by the {% cache %} tags of claims_table_body.html and claim_detail_partial.html
+#fragments are keyed on the claim pk and Claim.version, every write that changes what a fragment shows bumps the version,
+#so a cached copy is never stale and never needs deleting, old versions simply age out of the LRU cache
+#versions never repeat for a pk, even after clear_table reset the ids, see retire() and load_version()
+#the backend is the "fragments" entry of CACHES, chosen with CLAIM_FRAGMENT_CACHE in settings
+
+#CACHES alias the templates render through
+FRAGMENT_CACHE = 'fragments'
+
+#expression for the next version of a claim, usable inside a larger UPDATE
+NEXT_VERSION = F('version') + 1
+
+#marks the claims with the given pks as changed, their cached fragments are rendered again on the next request
+def bump(claim_pks):
+    claim_pks = list(claim_pks)
+    for batch in batches(claim_pks):
+        Claim.objects.filter(pk__in=batch).update(version=NEXT_VERSION)
+
+#version written to every claim a load touches, higher than any version in the table or retired by clear_table
+#one stamp for the whole load means the upserts set it in the same statement instead of bumping row by row
+def load_version():
+    latest = Claim.objects.aggregate(latest=Max('version'))['latest'] or 0
+    return max(latest, generations.get(generations.CLAIM_VERSIONS)) + 1
+
+#records the highest version in use before the claims are deleted, their pks are handed out again by the next load
+#and the fragments and ETags other server processes hold for them must not match the new claims
+def retire():
+    latest = Claim.objects.aggregate(latest=Max('version'))['latest']
+    if latest:
+        generations.raise_to(generations.CLAIM_VERSIONS, latest)
+
+#marks every claim as changed, used when their details, notes or flags are deleted in bulk (clear_table)
+def bump_all():
+    Claim.objects.update(version=NEXT_VERSION)
+
+#sets claims to a load version, skipping those already at it so a full load rewrites nothing twice
+def stamp(claim_pks, version):
+    claim_pks = list(claim_pks)
+    for batch in batches(claim_pks):
+        Claim.objects.filter(pk__in=batch).exclude(version=version).update(version=version)
+
+#drops every cached fragment, a local memory cache only clears in the process that calls this
+#never needed for correctness, versions already keep old fragments from being served
+def invalidate():
+    caches[FRAGMENT_CACHE].clear()
+
+#file cache that evicts the least recently used entries when full instead of a random sample
+#a hit touches the file's mtime, the cull deletes the oldest mtimes first
+class LRUFileBasedCache(FileBasedCache):
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except OSError:                 #deleted or culled by another process in between
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        if len(filelist) < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+
+        def mtime(fname):
+            try:
+                return os.path.getmtime(fname)
+            except OSError:
+                return 0
+
+        filelist.sort(key=mtime)
+        for fname in filelist[:len(filelist) // self._cull_frequency]:
+            self._delete(fname)
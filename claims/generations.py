@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models import F
+from claims.models import Generation
+
+#named counters stored in the database that only ever go up
+#caches held in one server process cannot be cleared from a management command running in another, so data that
+#load_claims or clear_table replace is instead keyed on a value read from here, which every process sees change
+
+#highest claim version handed out before clear_table deleted the claims, loads start above it (claims.fragments)
+#so a reused pk never gets a version its cached fragments and ETags were built for
+CLAIM_VERSIONS = 'claim_versions'
+
+#bumped whenever the claims are changed in bulk (load_claims, clear_table, bulk edits), part of the facet cache key (claims.facets)
+FACETS = 'facets'
+
+#current value of a counter, 0 until it is first set
+def get(name):
+    return Generation.objects.filter(name=name).values_list('value', flat=True).first() or 0
+
+#get for async views
+async def aget(name):
+    return await Generation.objects.filter(name=name).values_list('value', flat=True).afirst() or 0
+
+#adds one to a counter
+def bump(name):
+    with transaction.atomic():
+        Generation.objects.get_or_create(name=name)
+        Generation.objects.filter(name=name).update(value=F('value') + 1)
+
+#raises a counter to at least value, never lowers it
+def raise_to(name, value):
+    with transaction.atomic():
+        Generation.objects.get_or_create(name=name)
+        Generation.objects.filter(name=name, value__lt=value).update(value=value)
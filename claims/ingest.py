@@ -0,0 +1,245 @@
+import multiprocessing
+import os
+from django.db import connections
+from claims import fragments, summary
+from claims.models import Claim, ClaimDetail, ClaimStatus, IngestManifest, Insurer
+from claims.parsers import file_sha256, parse_worker, STOP, FILE_DONE, WORKER_ERROR
+
+#columns rewritten when a claim_id already exists, claim_id itself is the conflict target
+CLAIM_UPDATE_FIELDS = ['patient_name', 'billed_amount', 'paid_amount', 'claim_status', 'insurer', 'discharge_date', 'row_hash', 'version']
+
+#columns rewritten when a detail id already exists
+DETAIL_UPDATE_FIELDS = ['claim', 'denial_reason', 'cpt_codes', 'row_hash']
+
+#raised by the writer when a parse worker fails
+class IngestError(Exception):
+    pass
+
+#keeps only the last row for each key, one upsert statement cannot touch the same row twice on Postgres
+def last_per_key(rows, key):
+    return list({key(row): row for row in rows}.values())
+
+#in-memory name -> id map for one lookup table, names not seen before are inserted once per batch
+class InternMap:
+
+    def __init__(self, model):
+        self.model = model
+        self.ids = dict(model.objects.values_list('name', 'id'))
+
+    #ids for every name in names, missing names are created with one INSERT and read back with one SELECT
+    def resolve(self, names):
+        missing = set(names) - self.ids.keys()
+        if missing:
+            self.model.objects.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+            self.ids.update(self.model.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.ids
+
+    def __getitem__(self, name):
+        return self.resolve([name])[name]
+
+#intern maps for the insurer and status lookup tables, one per load so ids never outlive the transaction that made them
+class Lookups:
+
+    def __init__(self):
+        self.insurers = InternMap(Insurer)
+        self.statuses = InternMap(ClaimStatus)
+
+    #replaces the status and insurer names of coerced claim values with lookup ids
+    def claim_fields(self, values):
+        insurer_ids = self.insurers.resolve({v['insurer_name'] for v in values})
+        status_ids = self.statuses.resolve({v['status'] for v in values})
+        rows = []
+        for v in values:
+            row = {key: value for key, value in v.items() if key not in ('status', 'insurer_name')}
+            row['insurer_id'] = insurer_ids[v['insurer_name']]
+            row['claim_status_id'] = status_ids[v['status']]
+            rows.append(row)
+        return rows
+
+#writes one batch of coerced claim values with a single INSERT ... ON CONFLICT(claim_id) DO UPDATE
+#every written claim gets the load's version (fragments.load_version), so its cached fragments are rendered again
+def write_claims(values, lookups, version):
+    values = last_per_key(values, lambda v: v['claim_id'])
+    objs = [Claim(**row, version=version) for row in lookups.claim_fields(values)]
+    Claim.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['claim_id'],
+        update_fields=CLAIM_UPDATE_FIELDS,
+    )
+    return len(objs)
+
+#builds ClaimDetail objects for a batch, resolving file claim ids to Claim pks with one lookup query
+#returns (objects, list of claim ids that had no matching claim)
+def resolve_details(values):
+    claim_ids = {v['claim_id'] for v in values}
+    pk_by_claim_id = dict(
+        Claim.objects.filter(claim_id__in=claim_ids).values_list('claim_id', 'id')     #in-memory claim_id -> pk map for this batch
+    )
+
+    objs = []
+    missing = []
+    for v in last_per_key(values, lambda v: v['id']):
+        claim_pk = pk_by_claim_id.get(v['claim_id'])
+        if claim_pk is None:                                                            #no matching claim id case
+            missing.append(v['claim_id'])
+            continue
+        objs.append(ClaimDetail(
+            id=v['id'],
+            claim_id=claim_pk,
+            denial_reason=v['denial_reason'],
+            cpt_codes=v['cpt_codes'],
+            row_hash=v['row_hash'],
+        ))
+    return objs, missing
+
+#upserts detail objects with a single INSERT ... ON CONFLICT(id) DO UPDATE
+def upsert_details(objs):
+    ClaimDetail.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['id'],
+        update_fields=DETAIL_UPDATE_FIELDS,
+    )
+    return len(objs)
+
+#writes one batch of coerced detail values, returns (rows written, list of claim ids that had no matching claim)
+#claims of the written details are moved to the load's version unless the claim phase already did
+def write_details(values, version):
+    objs, missing = resolve_details(values)
+    fragments.stamp({obj.claim_id for obj in objs}, version)
+    return upsert_details(objs), missing
+
+#reads the fingerprint from either coerced values or a model object
+def row_hash(row):
+    return row['row_hash'] if isinstance(row, dict) else row.row_hash
+
+#splits rows into changed and unchanged by comparing each fingerprint with the stored one
+#counts is a Counter that gets inserted/updated/unchanged added to it
+def changed_rows(rows, stored_hashes, key, counts):
+    changed = []
+    for row in rows:
+        stored = stored_hashes.get(key(row))
+        if stored is None:
+            counts['inserted'] += 1
+        elif stored != row_hash(row):
+            counts['updated'] += 1
+        else:
+            counts['unchanged'] += 1
+            continue
+        changed.append(row)
+    return changed
+
+#delta version of write_claims, only rows whose fingerprint differs from the stored one are written
+#when a SummaryDelta is given, the report groups of every written row are moved from the stored values to the new ones
+def write_claims_delta(values, lookups, counts, version, delta=None):
+    values = last_per_key(values, lambda v: v['claim_id'])
+    stored = {
+        claim_id: rest
+        for claim_id, *rest in Claim.objects.filter(claim_id__in=[v['claim_id'] for v in values]).values_list(
+            'claim_id', 'row_hash', 'claim_status__name', 'insurer__name', 'billed_amount', 'paid_amount',
+        )
+    }
+    stored_hashes = {claim_id: rest[0] for claim_id, rest in stored.items()}
+    changed = changed_rows(values, stored_hashes, lambda v: v['claim_id'], counts)
+    if delta is not None and changed:
+        summarize_claims(changed, stored, delta)
+    return write_claims(changed, lookups, version) if changed else 0
+
+#records summary changes for rows about to be upserted, stored maps claim_id to (hash, status, insurer, billed, paid)
+def summarize_claims(rows, stored, delta):
+    moved = [
+        v['claim_id'] for v in rows
+        if v['claim_id'] in stored and tuple(stored[v['claim_id']][1:3]) != (v['status'], v['insurer_name'])
+    ]
+    flags = summary.flags_by_claim_id(moved) if moved else {}       #flags follow a claim into its new group
+    for v in rows:
+        flag_count = flags.get(v['claim_id'], 0)
+        if v['claim_id'] in stored:
+            _, status, insurer_name, billed, paid = stored[v['claim_id']]
+            delta.remove_claim(status, insurer_name, billed, paid, flag_count)
+        delta.add_claim(v['status'], v['insurer_name'], v['billed_amount'], v['paid_amount'], flag_count)
+
+#delta version of write_details, only rows whose fingerprint differs from the stored one are written
+def write_details_delta(values, counts, version):
+    objs, missing = resolve_details(values)
+    stored_hashes = dict(
+        ClaimDetail.objects.filter(id__in=[obj.id for obj in objs]).values_list('id', 'row_hash')
+    )
+    changed = changed_rows(objs, stored_hashes, lambda obj: obj.id, counts)
+    if not changed:
+        return 0, missing
+    fragments.stamp({obj.claim_id for obj in changed}, version)
+    return upsert_details(changed), missing
+
+#splits files into those that changed since the last delta load and those that can be skipped
+#returns (changed files, skipped files, manifest values to save once the changed files are loaded)
+def changed_files(file_paths):
+    changed = []
+    skipped = []
+    pending = []
+    for file_path in file_paths:
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        manifest = IngestManifest.objects.filter(path=path).first()
+
+        if manifest and manifest.size == stat.st_size and manifest.mtime == stat.st_mtime:     #size and mtime match, no need to hash
+            skipped.append(file_path)
+            continue
+
+        sha256 = file_sha256(path)
+        entry = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+        if manifest and manifest.sha256 == sha256:                     #touched but identical content
+            skipped.append(file_path)
+        else:
+            changed.append(file_path)
+        pending.append(entry)
+    return changed, skipped, pending
+
+#saves manifest entries returned by changed_files
+def record_manifest(entries):
+    for entry in entries:
+        IngestManifest.objects.update_or_create(path=entry['path'], defaults=entry)
+
+#pool of parse processes feeding coerced batches to the single writer (the calling process) through a bounded queue
+#files are submitted in phases so every claim shard is written before any detail shard is resolved against it
+class ParsePool:
+
+    def __init__(self, workers, batch_size, queue_size=None):
+        ctx = multiprocessing.get_context()
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue(maxsize=queue_size or workers * 2)        #bounds how many parsed batches can wait for the writer
+        self.processes = [
+            ctx.Process(target=parse_worker, args=(self.tasks, self.results, batch_size), daemon=True)
+            for _ in range(workers)
+        ]
+
+    def __enter__(self):
+        connections.close_all()             #forked children must not share the parent's database connection
+        for process in self.processes:
+            process.start()
+        return self
+
+    def __exit__(self, *exc):
+        for _ in self.processes:
+            self.tasks.put(STOP)
+        if exc[0] is not None:              #writer failed, workers may be blocked on a full queue
+            for process in self.processes:
+                process.terminate()
+        for process in self.processes:
+            process.join()
+
+    #parses every file of one kind in parallel and yields coerced batches in completion order until all files are done
+    def run_phase(self, file_paths, kind):
+        for file_path in file_paths:
+            self.tasks.put((file_path, kind))
+
+        remaining = len(file_paths)
+        while remaining:
+            message, payload = self.results.get()
+            if message == FILE_DONE:
+                remaining -= 1
+            elif message == WORKER_ERROR:
+                raise IngestError(payload)
+            else:
+                yield payload
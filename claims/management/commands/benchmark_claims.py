@@ -0,0 +1,182 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from claims import mirrors, profiling, synthetic, views
+from claims.models import Claim
+from claims.pagination import AFTER, KeysetPaginator
+
+class Command(BaseCommand):
+    help = 'Times load_claims, the home table, admin_dashboard, edit_claim and clear_table on synthetic data in a throwaway database, printing JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of synthetic claims to load')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data')
+        parser.add_argument('--repeat', type=int, default=20, help='Samples per request benchmark')
+        parser.add_argument('--workers', type=int, default=1, help='Parse processes used by load_claims')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be at least 1')
+
+        tmp_dir = tempfile.mkdtemp(prefix='claims-benchmark-')
+        try:
+            data_dir = os.path.join(tmp_dir, 'data')
+            start = time.perf_counter()
+            synthetic.write_dataset(data_dir, options['rows'], options['seed'])
+            generate_seconds = time.perf_counter() - start
+
+            #edits are mirrored into the synthetic files, never into data/
+            with override_settings(**self.mirror_settings(tmp_dir, data_dir)):
+                results = self.run_in_test_database(tmp_dir, data_dir, options)
+            results['generate_files'] = {'seconds': round(generate_seconds, 3)}
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'rows': options['rows'],
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'workers': options['workers'],
+            'database': connection.vendor,
+            'pagination': settings.CLAIMS_PAGINATION,
+            'mirror_sync': settings.CLAIM_MIRROR_SYNC,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    #data file and journal settings pointing into the temporary folder
+    def mirror_settings(self, tmp_dir, data_dir):
+        return {
+            'CLAIM_LIST_JSON': os.path.join(data_dir, f'{synthetic.CLAIM_FILE}.json'),
+            'CLAIM_LIST_CSV': os.path.join(data_dir, f'{synthetic.CLAIM_FILE}.csv'),
+            'CLAIM_DETAIL_JSON': os.path.join(data_dir, f'{synthetic.DETAIL_FILE}.json'),
+            'CLAIM_DETAIL_CSV': os.path.join(data_dir, f'{synthetic.DETAIL_FILE}.csv'),
+            'CLAIM_MIRROR_JOURNAL': os.path.join(tmp_dir, 'mirror_journal.jsonl'),
+        }
+
+    #creates a test database the same way the test runner does, runs every benchmark in it and drops it
+    def run_in_test_database(self, tmp_dir, data_dir, options):
+        setup_test_environment(debug=False)
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'benchmark.sqlite3')    #on disk like a real deployment, not in memory
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            cache.clear()
+            return self.run_benchmarks(data_dir, options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run_benchmarks(self, data_dir, options):
+        results = {}
+        repeat = options['repeat']
+
+        load_args = [data_dir, '--bulk'] + (['--workers', str(options['workers'])] if options['workers'] > 1 else [])
+        results['load_claims'] = self.time_command('load_claims', *load_args, rows=options['rows'])
+        results['load_claims_delta_unchanged'] = self.time_command('load_claims', data_dir, '--delta', rows=options['rows'])
+
+        user = User.objects.create_user(username='benchmark', password='benchmark', is_staff=True)
+        client = Client()
+        client.force_login(user)
+        htmx = {'HX-Request': 'true'}
+
+        results['home_full_page'] = self.time_request(client, '/', {}, {}, repeat)
+        results['home_first_page'] = self.time_request(client, '/', {}, htmx, repeat)
+        results['home_search'] = self.time_request(client, '/', {'q': synthetic.LAST_NAMES[0]}, htmx, repeat)
+        results['home_filter'] = self.time_request(
+            client, '/', {'insurer': synthetic.INSURERS[0], 'status': synthetic.STATUSES[1]}, htmx, repeat,
+        )
+        results['home_deep_page'] = self.time_request(client, '/', self.middle_page(), htmx, repeat)
+        results['admin_dashboard'] = self.time_request(client, '/admin-dashboard/', {}, {}, repeat)
+        results['edit_claim'] = self.time_edits(client, repeat)
+
+        start = time.perf_counter()
+        mirrors.sync_worker.flush()                 #pending edits reach the synthetic files before they are deleted
+        mirrors.compact()
+        results['mirror_flush'] = {'seconds': round(time.perf_counter() - start, 3)}
+
+        try:
+            results['clear_table'] = self.time_command('clear_table', 'claims.Claim', rows=options['rows'])
+        except Exception as e:                       #clear_table resets the sequence with SQLite specific SQL
+            results['clear_table'] = {'error': str(e)}
+        return results
+
+    #runs a management command once with its output discarded
+    def time_command(self, name, *args, rows):
+        start = time.perf_counter()
+        call_command(name, *args, stdout=StringIO(), stderr=StringIO())
+        seconds = time.perf_counter() - start
+        return {'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds) if seconds else None}
+
+    #GET parameters of a page in the middle of the unfiltered table
+    def middle_page(self):
+        total = Claim.objects.count()
+        if settings.CLAIMS_PAGINATION == 'keyset':
+            middle = Claim.objects.order_by('id')[total // 2]
+            return {'cursor': KeysetPaginator(Claim.objects.all(), views.CLAIMS_PER_PAGE).encode(AFTER, middle)}
+        return {'page': max(1, total // views.CLAIMS_PER_PAGE // 2)}
+
+    #the first request is also used to count queries, timing samples run without query capture
+    def time_request(self, client, path, params, headers, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path, params, headers=headers)
+        query_count = len(queries)                  #read now, the next request resets the query log
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            client.get(path, params, headers=headers)
+            samples.append(time.perf_counter() - start)
+        return dict(profiling.latency_summary(samples), status=response.status_code, queries=query_count)
+
+    #posts an unchanged edit to a different claim for every sample
+    def time_edits(self, client, repeat):
+        claims = list(Claim.objects.order_by('id')[:repeat])
+        samples = []
+        status = None
+        for claim in claims:
+            detail = claim.details.first()
+            data = {
+                'patient_name': claim.patient_name,
+                'discharge_date': claim.discharge_date.isoformat(),
+                'status': claim.status,
+                'billed_amount': str(claim.billed_amount),
+                'paid_amount': str(claim.paid_amount),
+                'insurer_name': claim.insurer_name,
+                'cpt_codes': detail.cpt_codes if detail else '',
+                'denial_reason': detail.denial_reason if detail else '',
+                'cpt_mode': 'overwrite',
+                'denial_mode': 'overwrite',
+            }
+            start = time.perf_counter()
+            response = client.post(f'/claim/{claim.pk}/edit/', data)
+            samples.append(time.perf_counter() - start)
+            status = response.status_code
+        return dict(profiling.latency_summary(samples), status=status)
@@ -0,0 +1,174 @@
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from claims import profiling
+from claims.models import Claim
+
+#gunicorn serving profiles of gunicorn.conf.py, compared under the same load
+PROFILES = ('wsgi', 'asgi')
+
+#user the load is sent as, created for the run and deleted afterwards
+USERNAME = 'benchmark-serving'
+
+class Command(BaseCommand):
+    help = 'Starts gunicorn with the WSGI and the ASGI (uvicorn worker) profile in turn and sends both the same concurrent HTMX traffic, printing JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests sent to each profile')
+        parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight at once, like that many reviewers clicking')
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes of each profile')
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES), help='Profiles to run')
+        parser.add_argument('--query-delay-ms', type=float, default=0, help='Latency added to every query, stands in for a database on another host')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the claims the panel requests pick')
+        parser.add_argument('--startup-timeout', type=float, default=30, help='Seconds to wait for a server to answer')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['workers'] < 1:
+            raise CommandError('--requests, --concurrency and --workers must be at least 1')
+        claim_pks = list(Claim.objects.order_by('id').values_list('id', flat=True)[:1000])
+        if not claim_pks:
+            raise CommandError('No claims in the database, run load_claims or generate_claims first.')
+
+        paths = self.request_paths(claim_pks, options['requests'], options['seed'])
+        user = User.objects.create_user(username=USERNAME, password=None)
+        client = Client()
+        try:
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            results = {
+                profile: self.run_profile(profile, paths, cookie, options)
+                for profile in options['profiles']
+            }
+        finally:
+            client.logout()                             #deletes the session
+            user.delete()
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'workers': options['workers'],
+            'query_delay_ms': options['query_delay_ms'],
+            'database': connection.vendor,
+            'claims': Claim.objects.count(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    #the traffic of reviewers working through the table: table pages and the panels of random claims
+    def request_paths(self, claim_pks, count, seed):
+        rng = random.Random(seed)
+        paths = []
+        for i in range(count):
+            kind = i % 4
+            if kind == 0:
+                paths.append('/')
+            elif kind == 1:
+                paths.append('/?status=Denied')
+            elif kind == 2:
+                paths.append(f'/claim/{rng.choice(claim_pks)}/panel/')
+            else:
+                paths.append(f'/claim/{rng.choice(claim_pks)}/details/')
+        return paths
+
+    #starts gunicorn with one profile, sends the load and stops it
+    def run_profile(self, profile, paths, cookie, options):
+        port = self.free_port()
+        env = dict(
+            os.environ,
+            CLAIM_SERVER=profile,
+            WEB_CONCURRENCY=str(options['workers']),
+            CLAIM_QUERY_DELAY_MS=str(options['query_delay_ms']),      #see post_worker_init in gunicorn.conf.py
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        with tempfile.TemporaryFile() as log:           #a pipe nobody reads could fill up and stall the server
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+                 '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+                cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+            )
+            try:
+                self.wait_until_up(server, log, base_url, options['startup_timeout'])
+                return self.send_load(base_url, paths, cookie, options['concurrency'])
+            finally:
+                server.send_signal(signal.SIGTERM)
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+    #port nothing is listening on
+    def free_port(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    #polls the login page until the server answers
+    def wait_until_up(self, server, log, base_url, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'gunicorn exited: {log.read().decode(errors="replace")[-2000:]}')
+            try:
+                urllib.request.urlopen(base_url + '/login/', timeout=1).close()
+                return
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.2)
+        raise CommandError(f'gunicorn did not answer within {timeout}s')
+
+    #sends every path with concurrency requests in flight, returns latency, throughput and status counts
+    def send_load(self, base_url, paths, cookie, concurrency):
+        headers = {'Cookie': cookie, 'HX-Request': 'true'}
+
+        def fetch(path):
+            request = urllib.request.Request(base_url + path, headers=headers)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(fetch, paths))
+        seconds = time.perf_counter() - start
+
+        statuses = {}
+        for _, status in timings:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return dict(
+            profiling.latency_summary([sample for sample, _ in timings]),
+            seconds=round(seconds, 3),
+            requests_per_sec=round(len(paths) / seconds, 1),
+            statuses=statuses,
+        )
@@ -0,0 +1,167 @@
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Exists, OuterRef
+from claims import fragments, profiling, sqlite
+from claims.models import Claim, ClaimDetail, ClaimStatus, Note, SystemFlag
+from claims.search import claim_filters
+from claims.views import CLAIMS_PER_PAGE, NOTES_WITH_AUTHORS
+
+#Django's default SQLite connection and the CLAIM_SQLITE_TUNING profile
+PROFILES = ('default', 'tuned')
+
+class Command(BaseCommand):
+    help = 'Runs concurrent table reads and claim edits against copies of the SQLite database with the default and the tuned connection settings, printing JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5, help='Seconds each profile runs')
+        parser.add_argument('--readers', type=int, default=8, help='Threads loading table pages and claim panels')
+        parser.add_argument('--writers', type=int, default=2, help='Threads editing claims')
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES), help='Profiles to run')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the claims the threads pick')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sqlite compares SQLite settings, the configured database is not SQLite')
+        if options['duration'] <= 0 or options['readers'] < 0 or options['writers'] < 0:
+            raise CommandError('--duration must be positive and --readers and --writers at least 0')
+        claim_pks = list(Claim.objects.order_by('id').values_list('id', flat=True)[:1000])
+        if not claim_pks:
+            raise CommandError('No claims in the database, run load_claims or generate_claims first.')
+        statuses = list(ClaimStatus.objects.values_list('name', flat=True))
+
+        tmp_dir = tempfile.mkdtemp(prefix='claims-sqlite-benchmark-')
+        try:
+            results = {
+                profile: self.run_profile(profile, tmp_dir, claim_pks, statuses, options)
+                for profile in options['profiles']
+            }
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'duration': options['duration'],
+            'readers': options['readers'],
+            'writers': options['writers'],
+            'claims': Claim.objects.count(),
+            'sqlite': sqlite3.sqlite_version,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    #copies the database, runs the reader and writer threads on the copy with the profile's settings for the duration
+    def run_profile(self, profile, tmp_dir, claim_pks, statuses, options):
+        name = self.copy_database(f'{tmp_dir}/{profile}.sqlite3')
+        alias = f'benchmark_{profile}'
+        connections.settings[alias] = sqlite.profile_settings(connection.settings_dict, name, profile == 'tuned')
+        stop = threading.Event()
+        results = []
+        threads = [
+            threading.Thread(target=self.worker, args=(kind, alias, claim_pks, statuses, options['seed'] * 1000 + i, stop, results))
+            for i, kind in enumerate(['read'] * options['readers'] + ['write'] * options['writers'])
+        ]
+        try:
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(options['duration'])
+            stop.set()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+        finally:
+            stop.set()
+            del connections.settings[alias]
+
+        errors = [error for _, _, _, error in results if error]
+        if errors:
+            raise CommandError(f'{profile} profile failed: {errors[0]}')
+        with sqlite3.connect(name) as db:
+            journal_mode = db.execute('PRAGMA journal_mode').fetchone()[0]
+        report = {'journal_mode': journal_mode, 'seconds': round(seconds, 3)}
+        for kind in ('read', 'write'):
+            samples = [sample for result_kind, result_samples, _, _ in results if result_kind == kind for sample in result_samples]
+            report[f'{kind}s'] = dict(
+                profiling.latency_summary(samples) if samples else {'samples': 0},
+                per_sec=round(len(samples) / seconds, 1),
+                locked=sum(locked for result_kind, _, locked, _ in results if result_kind == kind),
+            )
+        return report
+
+    #copy of the configured database in rollback journal mode, the mode of a database Django created with its defaults
+    def copy_database(self, name):
+        with sqlite3.connect(connection.settings_dict['NAME']) as source, sqlite3.connect(name) as target:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode=DELETE')
+        return name
+
+    #one thread, loops until stop is set, every loop is one request: a read or an edit
+    #"database is locked" is counted instead of retried, it is the error a reviewer would see
+    def worker(self, kind, alias, claim_pks, statuses, seed, stop, results):
+        rng = random.Random(seed)
+        samples = []
+        locked = 0
+        error = None
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    if kind == 'read':
+                        self.read(alias, rng, claim_pks, statuses)
+                    else:
+                        self.write(alias, rng, claim_pks)
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    locked += 1
+                else:
+                    samples.append(time.perf_counter() - start)
+                connections[alias].close_if_unusable_or_obsolete()     #as at the end of a request, closes unless CONN_MAX_AGE keeps it
+        except Exception as e:
+            error = e
+        finally:
+            connections[alias].close()
+            results.append((kind, samples, locked, error))
+
+    #a table page from a random position with a status filter, then a claim's panel, the queries of home and claim_panel
+    def read(self, alias, rng, claim_pks, statuses):
+        page = (
+            Claim.objects.using(alias)
+            .filter(claim_filters(status=rng.choice(statuses)), pk__gt=rng.choice(claim_pks))
+            .order_by('id')
+            .annotate(
+                has_flags=Exists(SystemFlag.objects.filter(claim=OuterRef('pk'))),
+                has_notes=Exists(Note.objects.filter(claim=OuterRef('pk'))),
+            )
+        )
+        list(page[:CLAIMS_PER_PAGE + 1])
+        Claim.objects.using(alias).prefetch_related('details', NOTES_WITH_AUTHORS, 'flags').get(pk=rng.choice(claim_pks))
+
+    #a claim edit in a transaction, reading the claim before writing it and its detail like edit_claim does
+    def write(self, alias, rng, claim_pks):
+        pk = rng.choice(claim_pks)
+        with transaction.atomic(using=alias):
+            claim = Claim.objects.using(alias).get(pk=pk)
+            Claim.objects.using(alias).filter(pk=pk).update(
+                paid_amount=claim.paid_amount, row_hash='', version=fragments.NEXT_VERSION,
+            )
+            ClaimDetail.objects.using(alias).filter(claim_id=pk).update(row_hash='')
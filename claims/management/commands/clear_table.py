@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.db import connection
 from django.apps import apps
+from claims.models import Claim, ClaimDetail, IngestManifest, Note, SystemFlag
+from claims import facets, fragments, summary
 
 class Command(BaseCommand):
     help = 'Clears all rows from a table and resets its auto-increment ID'
@@ -17,9 +19,29 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR('Invalid model. Use format: app_label.ModelName'))
             return
 
+        # Claim versions in use are kept so the reloaded claims, which get the same ids, never reuse them
+        if model is Claim:
+            fragments.retire()
+
         # Delete all rows
         model.objects.all().delete()
 
+        # Forget which files were loaded so the next load_claims --delta reloads them
+        if model in (Claim, ClaimDetail):
+            IngestManifest.objects.all().delete()
+
+        # Cached insurer/status dropdowns no longer match the table
+        if model is Claim:
+            facets.invalidate()
+
+        # Cached table rows and detail panels of the remaining claims show the deleted rows
+        if model in (ClaimDetail, Note, SystemFlag):
+            fragments.bump_all()
+
+        # Report totals are recounted from the rows that are left
+        if model in (Claim, SystemFlag):
+            summary.rebuild()
+
         # Reset auto-increment
         table_name = model._meta.db_table
         with connection.cursor() as cursor:
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from claims import mirrors
+
+class Command(BaseCommand):
+    help = 'Applies pending claim edits from the mirror journal to the JSON and CSV data files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep running and drain the journal every this many seconds')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            applied = mirrors.compact()
+            if applied or not interval:
+                self.stdout.write(self.style.SUCCESS(f'{applied} journal entries written to the data files.'))
+            if not interval:
+                return
+            time.sleep(interval)
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from claims import dump
+from claims.batching import CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = 'Regenerates claim_list_data and claim_detail_data (JSON and pipe delimited CSV) from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', nargs='?', help='Folder to write to (defaults to replacing the data files in settings)')
+        parser.add_argument('--format', choices=['json', 'csv', 'both'], default='both', help='File formats to write')
+        parser.add_argument('--gzip', action='store_true', help='Write gzip compressed .gz files')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        formats = ('json', 'csv') if options['format'] == 'both' else (options['format'],)
+        start = time.perf_counter()
+        counts, paths = dump.dump(options['out_dir'], formats, options['gzip'], options['chunk_size'])
+        seconds = time.perf_counter() - start
+
+        for path in paths:
+            self.stdout.write(f'Wrote {path}')
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['claims']} claims and {counts['details']} details written in {seconds:.2f}s."
+        ))
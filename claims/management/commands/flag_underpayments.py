@@ -0,0 +1,44 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from claims import underpayment
+
+class Command(BaseCommand):
+    help = 'Checks every claim against the underpayment rules and creates or clears the rule SystemFlags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', help='JSON file with the rules to use instead of CLAIM_UNDERPAYMENT_RULES')
+        parser.add_argument('--min-ratio', type=float, help='Default paid/billed threshold, overrides the rules')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+        parser.add_argument('--batch-size', type=int, default=underpayment.BATCH_SIZE, help='Claims read per query')
+        parser.add_argument('--interval', type=float, help='Keep running and check the claims every this many seconds')
+
+    def handle(self, *args, **options):
+        rules = self.load_rules(options)
+        while True:
+            start = time.perf_counter()
+            result = underpayment.flag_underpayments(rules, dry_run=options['dry_run'], batch_size=options['batch_size'])
+            seconds = time.perf_counter() - start
+
+            prefix = 'Dry run: would have ' if options['dry_run'] else ''
+            self.stdout.write(self.style.SUCCESS(
+                f'Checked {result.checked} claims in {seconds:.2f}s, {result.flagged} below their threshold. '
+                f'{prefix}{result.created} flags created, {result.deleted} cleared.'
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    #rules from settings or --rules, with --min-ratio applied on top
+    def load_rules(self, options):
+        try:
+            if options['rules']:
+                with open(options['rules'], encoding='utf-8') as f:
+                    values = json.load(f)
+            else:
+                values = dict(underpayment.Rules.from_settings().__dict__)
+            if options['min_ratio'] is not None:
+                values['min_ratio'] = options['min_ratio']
+            return underpayment.Rules.from_dict(values)
+        except (OSError, ValueError, TypeError) as e:
+            raise CommandError(f'Invalid underpayment rules: {e}')
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from claims import synthetic
+
+class Command(BaseCommand):
+    help = 'Writes synthetic claim_list_data and claim_detail_data files (JSON and pipe CSV) for load and benchmark runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('out_dir', help='Folder to write the files to, e.g. data/synthetic')
+        parser.add_argument('--rows', type=int, default=10000, help='Number of claims (and details) to generate')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed always writes the same files')
+        parser.add_argument('--format', choices=['json', 'csv', 'both'], default='both', help='File formats to write')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1:
+            raise CommandError('--rows must be at least 1')
+        formats = ('json', 'csv') if options['format'] == 'both' else (options['format'],)
+
+        start = time.perf_counter()
+        paths = synthetic.write_dataset(options['out_dir'], options['rows'], options['seed'], formats)
+        elapsed = time.perf_counter() - start
+
+        for path in paths:
+            self.stdout.write(path)
+        self.stdout.write(self.style.SUCCESS(f"{options['rows']} claims written to {len(paths)} files in {elapsed:.2f}s"))
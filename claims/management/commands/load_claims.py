@@ -1,8 +1,13 @@
-import json
-import csv
+import glob
 import os
-from django.core.management.base import BaseCommand
+import time
+from collections import Counter
+from itertools import chain
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from claims.models import Claim, ClaimDetail
+from claims import facets, fragments, ingest, mirrors, sqlite, summary
+from claims.parsers import iter_rows, iter_value_batches
 
 class Command(BaseCommand):
     help = "Load claims and claim details from JSON or CSV files automatically"
@@ -10,34 +15,91 @@ class Command(BaseCommand):
     #data stored in this folder
     DATA_DIR = 'data'
 
+    #shard files are recognised by these names, e.g. claim_list_data_aetna.json or 2024-05/claim_detail_data.csv
+    CLAIM_FILE_NAME = 'claim_list_data'
+    DETAIL_FILE_NAME = 'claim_detail_data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Files, directories or glob patterns of shard files (defaults to the data folder)')
+        parser.add_argument('--bulk', action='store_true', help='Write rows with batched bulk upserts inside one transaction')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk statement when --bulk is used')
+        parser.add_argument('--workers', type=int, default=1, help='Parse shard files in this many processes (implies --bulk)')
+        parser.add_argument('--delta', action='store_true', help='Skip unchanged files and only write rows whose content changed (implies --bulk)')
+
     def handle(self, *args, **kwargs):
-        # find existing file with .json or .csv
-        def find_file(base_name):
-            for ext in ['.json', '.csv']:
-                file_path = os.path.join(self.DATA_DIR, base_name + ext)
-                if os.path.exists(file_path):
-                    return file_path
-            return None
-
-        #loads JSON or CSV, will always choose json over csv based on loop logic
-        def load_file(file_path):
-            if file_path.endswith('.json'):
-                with open(file_path, 'r') as f:
-                    return json.load(f)
-            elif file_path.endswith('.csv'):
-                with open(file_path, 'r', newline='') as f:
-                    return list(csv.DictReader(f, delimiter='|'))   #files uses pipe delimiters
-            else:
-                return []
+        # pending edits must reach the data files first, otherwise reloading them would undo those edits
+        applied = mirrors.compact()
+        if applied:
+            self.stdout.write(f"Applied {applied} pending edits to the data files.")
+
+        claim_files, detail_files = self.find_files(kwargs['paths'] or [self.DATA_DIR])
 
-        # Find and load claim list
-        claim_file = find_file('claim_list_data')
         #error case
-        if not claim_file:
+        if not claim_files:
             self.stdout.write(self.style.ERROR("No claim_list_data file found."))
             return
-        claims_data = load_file(claim_file)
+        found_details = bool(detail_files)
+
+        #delta mode skips files whose manifest entry still matches and only writes rows whose fingerprint changed
+        counts = Counter() if kwargs['delta'] else None
+        manifest = []
+        if kwargs['delta']:
+            claim_files, skipped_claims, claim_manifest = ingest.changed_files(claim_files)
+            detail_files, skipped_details, detail_manifest = ingest.changed_files(detail_files)
+            manifest = claim_manifest + detail_manifest
+            counts['skipped files'] = len(skipped_claims) + len(skipped_details)
+
+        start = time.perf_counter()
+        if kwargs['workers'] > 1:                   #applies the bulk-load pragmas itself, once its workers are forked
+            rows = self.load_parallel(claim_files, detail_files, kwargs['batch_size'], kwargs['workers'], counts, manifest)
+        else:
+            with sqlite.bulk_load():                #only with CLAIM_SQLITE_TUNING, see claims.sqlite
+                if kwargs['bulk'] or kwargs['delta']:
+                    rows = self.load_bulk(claim_files, detail_files, kwargs['batch_size'], counts, manifest)
+                else:
+                    claims_data = chain.from_iterable(iter_rows(f) for f in claim_files)       #rows are streamed one shard after another
+                    details_data = chain.from_iterable(iter_rows(f) for f in detail_files) if found_details else None
+                    rows = self.load_rows(claims_data, details_data)
+                    summary.rebuild()
+        elapsed = time.perf_counter() - start
+        facets.invalidate()                         #insurer/status dropdowns are recounted on the next page load
+
+        if not found_details:
+            self.stdout.write(self.style.WARNING("No claim_detail_data file found. Skipping details."))
+            return
+
+        self.stdout.write(self.style.SUCCESS("Claims and details loaded successfully!"))
+        self.stdout.write(f"{rows} rows from {len(claim_files) + len(detail_files)} files in {elapsed:.2f}s ({rows / elapsed if elapsed else rows:.0f} rows/sec)")
+        if counts is not None:
+            self.stdout.write(
+                f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+                f"{counts['skipped files']} unchanged files skipped"
+            )
+
+    #expands paths into sorted lists of claim and detail shard files
+    #json is always chosen over csv when both exist for the same shard
+    def find_files(self, paths):
+        shards = {}
+        for path in paths:
+            matches = glob.glob(os.path.join(path, '*')) if os.path.isdir(path) else glob.glob(path)
+            if not matches:
+                raise CommandError(f"No files match {path}")
+            for file_path in matches:
+                stem, ext = os.path.splitext(file_path)
+                if ext not in ('.json', '.csv'):
+                    continue
+                if ext == '.json' or stem not in shards:
+                    shards[stem] = file_path
 
+        claim_files = sorted(f for stem, f in shards.items() if self.CLAIM_FILE_NAME in os.path.basename(stem))
+        detail_files = sorted(f for stem, f in shards.items() if self.DETAIL_FILE_NAME in os.path.basename(stem))
+        return claim_files, detail_files
+
+    #original path, one update_or_create per row, returns number of rows processed
+    def load_rows(self, claims_data, details_data):
+        rows = 0
+        lookups = ingest.Lookups()
+        version = fragments.load_version()              #cached rows and panels of every loaded claim are rendered again
         for item in claims_data:
             # Convert numeric fields from CSV if necessary
             billed_amount = float(item['billed_amount'])
@@ -49,33 +111,92 @@ class Command(BaseCommand):
                     'patient_name': item['patient_name'],
                     'billed_amount': billed_amount,
                     'paid_amount': paid_amount,
-                    'status': item['status'],
-                    'insurer_name': item['insurer_name'],
+                    'claim_status_id': lookups.statuses[item['status']],
+                    'insurer_id': lookups.insurers[item['insurer_name']],
                     'discharge_date': item['discharge_date'],
+                    'row_hash': '',                         #no fingerprint on this path, the next delta load rewrites the row
+                    'version': version,
                 }
             )
+            rows += 1
 
-        # Find and load claim details
-        detail_file = find_file('claim_detail_data')
-        if not detail_file:
-            self.stdout.write(self.style.WARNING("No claim_detail_data file found. Skipping details."))
-            return
-        details_data = load_file(detail_file)
+        if details_data is None:
+            return rows
 
+        detail_claims = set()                           #claims of the loaded details, their panels change too
         for item in details_data:
             try:
                 claim = Claim.objects.get(claim_id=int(item['claim_id'])) #finds matching claim from id in claims table
+                detail_claims.add(claim.pk)
                 ClaimDetail.objects.update_or_create(
                     id=int(item['id']),
                     defaults={
                         'claim': claim,
                         'denial_reason': item['denial_reason'],
                         'cpt_codes': item['cpt_codes'],
+                        'row_hash': '',
                     }
                 )
+                rows += 1
             except Claim.DoesNotExist:                          #no matching claim id case
                 self.stdout.write(self.style.WARNING(
                     f"Claim ID {item['claim_id']} not found. Skipping."
                 ))
+        fragments.stamp(list(detail_claims), version)  #batched, claims written above already have the version
+        return rows
 
-        self.stdout.write(self.style.SUCCESS("Claims and details loaded successfully!"))
+    #bulk path, a few statements per batch and a single transaction for the whole load
+    #rows are streamed and coerced one batch at a time, so only one batch is in memory
+    def load_bulk(self, claim_files, detail_files, batch_size, counts, manifest):
+        def run_phase(file_paths, kind):
+            for file_path in file_paths:
+                yield from iter_value_batches(file_path, kind, batch_size)
+
+        with transaction.atomic():
+            return self.write_phases(run_phase, claim_files, detail_files, counts, manifest)
+
+    #parallel path, shard files are parsed and coerced in worker processes while this process is the only writer
+    #the pool closes the connections before it forks, so the bulk-load pragmas are applied to the one opened after it
+    def load_parallel(self, claim_files, detail_files, batch_size, workers, counts, manifest):
+        try:
+            with ingest.ParsePool(workers, batch_size) as pool, sqlite.bulk_load(), transaction.atomic():
+                return self.write_phases(pool.run_phase, claim_files, detail_files, counts, manifest)
+        except ingest.IngestError as e:
+            raise CommandError(f"Failed to parse shard {e}")
+
+    #writes every claim batch and then every detail batch, claims are all written before any detail is resolved
+    #counts is None for a full load, otherwise a Counter of inserted/updated/unchanged rows for a delta load
+    #returns number of rows processed
+    def write_phases(self, run_phase, claim_files, detail_files, counts, manifest):
+        rows = 0
+        delta = summary.SummaryDelta()              #report changes of a delta load, applied in the same transaction
+        lookups = ingest.Lookups()                  #insurer and status names are resolved to ids in memory
+        version = fragments.load_version()          #every claim written gets it, see claims.fragments
+        for batch in run_phase(claim_files, 'claims'):
+            if counts is None:
+                ingest.write_claims(batch, lookups, version)
+            else:
+                ingest.write_claims_delta(batch, lookups, counts, version, delta)
+            rows += len(batch)
+
+        for batch in run_phase(detail_files, 'details'):
+            if counts is None:
+                _, missing = ingest.write_details(batch, version)
+            else:
+                _, missing = ingest.write_details_delta(batch, counts, version)
+            rows += len(batch) - len(missing)
+            self.warn_missing(missing)
+
+        if counts is None:
+            summary.rebuild()                       #a full load rewrites every row, one grouped scan is cheaper than tracking each one
+        else:
+            delta.apply()
+        ingest.record_manifest(manifest)            #only saved once the files are fully loaded
+        return rows
+
+    #no matching claim id case
+    def warn_missing(self, missing):
+        for claim_id in missing:
+            self.stdout.write(self.style.WARNING(
+                f"Claim ID {claim_id} not found. Skipping."
+            ))
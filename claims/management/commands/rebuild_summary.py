@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from claims import summary
+
+class Command(BaseCommand):
+    help = 'Rebuilds the pre-aggregated report rows from the claims and flags tables, or checks them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only compare the stored rows with the live tables, exit with an error on any difference')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            groups = summary.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Summary rebuilt with {groups} status/insurer groups.'))
+
+        mismatches = summary.mismatches()
+        for (status, insurer_name), stored, live in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'{status} / {insurer_name}: stored {self.describe(stored)}, actual {self.describe(live)}'
+            ))
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} summary groups do not match the claims table, run rebuild_summary to fix them.')
+        self.stdout.write(self.style.SUCCESS('Summary matches the claims and flags tables.'))
+
+    #claims, billed, paid and flags of one group as text
+    def describe(self, values):
+        if values is None:
+            return 'missing'
+        claims, billed, paid, flags = values
+        return f'{claims} claims, billed {billed}, paid {paid}, {flags} flags'
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0010_note_created_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('loaded_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='row_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='claimdetail',
+            name='row_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+
+#SQLite: FTS5 index over the searchable claim columns, kept in sync with claims_claim by triggers
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE claims_claim_fts USING fts5(
+        patient_name, status, insurer_name,
+        content='claims_claim', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER claims_claim_fts_ai AFTER INSERT ON claims_claim BEGIN
+        INSERT INTO claims_claim_fts(rowid, patient_name, status, insurer_name)
+        VALUES (new.id, new.patient_name, new.status, new.insurer_name);
+    END""",
+    """CREATE TRIGGER claims_claim_fts_ad AFTER DELETE ON claims_claim BEGIN
+        INSERT INTO claims_claim_fts(claims_claim_fts, rowid, patient_name, status, insurer_name)
+        VALUES ('delete', old.id, old.patient_name, old.status, old.insurer_name);
+    END""",
+    """CREATE TRIGGER claims_claim_fts_au AFTER UPDATE OF patient_name, status, insurer_name ON claims_claim BEGIN
+        INSERT INTO claims_claim_fts(claims_claim_fts, rowid, patient_name, status, insurer_name)
+        VALUES ('delete', old.id, old.patient_name, old.status, old.insurer_name);
+        INSERT INTO claims_claim_fts(rowid, patient_name, status, insurer_name)
+        VALUES (new.id, new.patient_name, new.status, new.insurer_name);
+    END""",
+    "INSERT INTO claims_claim_fts(claims_claim_fts) VALUES ('rebuild')",         #index rows that were loaded before this migration
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS claims_claim_fts_au",
+    "DROP TRIGGER IF EXISTS claims_claim_fts_ad",
+    "DROP TRIGGER IF EXISTS claims_claim_fts_ai",
+    "DROP TABLE IF EXISTS claims_claim_fts",
+]
+
+#Postgres: trigram GIN indexes on the exact expression Django's icontains lookup compiles to, UPPER(col::text) LIKE UPPER('%q%')
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS claims_claim_patient_trgm ON claims_claim USING gin (UPPER(patient_name::text) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS claims_claim_status_trgm ON claims_claim USING gin (UPPER(status::text) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS claims_claim_insurer_trgm ON claims_claim USING gin (UPPER(insurer_name::text) gin_trgm_ops)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS claims_claim_insurer_trgm",
+    "DROP INDEX IF EXISTS claims_claim_status_trgm",
+    "DROP INDEX IF EXISTS claims_claim_patient_trgm",
+]
+
+#whether this SQLite build has the FTS5 module, without it the index is not created and search stays on the plain LIKE path
+def fts5_available(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+#runs the statements for the current database, a failure fails the migration instead of leaving a half built index
+def run_statements(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        if fts5_available(schema_editor):
+            run_statements(schema_editor, SQLITE_FORWARD)
+        else:
+            print("\n  SQLite was built without FTS5, claim search falls back to LIKE")
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_FORWARD)
+
+def reverse(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'postgresql':
+        run_statements(schema_editor, POSTGRES_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0011_ingest_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, reverse),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:13
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+#fills the summary from the claims and flags already in the database
+def populate_summary(apps, schema_editor):
+    Claim = apps.get_model('claims', 'Claim')
+    SystemFlag = apps.get_model('claims', 'SystemFlag')
+    ClaimSummary = apps.get_model('claims', 'ClaimSummary')
+
+    groups = {}
+    for status, insurer_name, count, billed, paid in (
+        Claim.objects.order_by().values_list('status', 'insurer_name')
+        .annotate(count=Count('id'), billed=Sum('billed_amount'), paid=Sum('paid_amount'))
+    ):
+        groups[(status, insurer_name)] = ClaimSummary(
+            status=status, insurer_name=insurer_name,
+            claim_count=count, billed_total=billed or 0, paid_total=paid or 0,
+        )
+    for status, insurer_name, count in (
+        SystemFlag.objects.order_by().values_list('claim__status', 'claim__insurer_name').annotate(count=Count('id'))
+    ):
+        groups.setdefault(
+            (status, insurer_name), ClaimSummary(status=status, insurer_name=insurer_name)
+        ).flag_count = count
+    ClaimSummary.objects.bulk_create(groups.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0012_claim_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaimSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=50)),
+                ('insurer_name', models.CharField(max_length=255)),
+                ('claim_count', models.IntegerField(default=0)),
+                ('billed_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('paid_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('flag_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('status', 'insurer_name'), name='claim_summary_group')],
+            },
+        ),
+        migrations.RunPython(populate_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,152 @@
+import importlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+#search index of migration 0012, it reads the status and insurer_name columns this migration removes
+search_index_0012 = importlib.import_module('claims.migrations.0012_claim_search_index')
+
+#SQLite: FTS5 table holding its own copy of the searchable text, the names are looked up when a claim is written
+#a lookup rename rewrites the text of every claim that uses it
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE claims_claim_fts USING fts5(
+        patient_name, status, insurer_name, prefix='2 3'
+    )""",
+    """CREATE TRIGGER claims_claim_fts_ai AFTER INSERT ON claims_claim BEGIN
+        INSERT INTO claims_claim_fts(rowid, patient_name, status, insurer_name) VALUES (
+            new.id, new.patient_name,
+            (SELECT name FROM claims_claimstatus WHERE id = new.claim_status_id),
+            (SELECT name FROM claims_insurer WHERE id = new.insurer_id)
+        );
+    END""",
+    """CREATE TRIGGER claims_claim_fts_ad AFTER DELETE ON claims_claim BEGIN
+        DELETE FROM claims_claim_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER claims_claim_fts_au AFTER UPDATE OF patient_name, claim_status_id, insurer_id ON claims_claim BEGIN
+        UPDATE claims_claim_fts SET
+            patient_name = new.patient_name,
+            status = (SELECT name FROM claims_claimstatus WHERE id = new.claim_status_id),
+            insurer_name = (SELECT name FROM claims_insurer WHERE id = new.insurer_id)
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER claims_claimstatus_fts_au AFTER UPDATE OF name ON claims_claimstatus BEGIN
+        UPDATE claims_claim_fts SET status = new.name
+        WHERE rowid IN (SELECT id FROM claims_claim WHERE claim_status_id = new.id);
+    END""",
+    """CREATE TRIGGER claims_insurer_fts_au AFTER UPDATE OF name ON claims_insurer BEGIN
+        UPDATE claims_claim_fts SET insurer_name = new.name
+        WHERE rowid IN (SELECT id FROM claims_claim WHERE insurer_id = new.id);
+    END""",
+    """INSERT INTO claims_claim_fts(rowid, patient_name, status, insurer_name)
+        SELECT c.id, c.patient_name, s.name, i.name
+        FROM claims_claim c
+        JOIN claims_claimstatus s ON s.id = c.claim_status_id
+        JOIN claims_insurer i ON i.id = c.insurer_id""",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS claims_insurer_fts_au",
+    "DROP TRIGGER IF EXISTS claims_claimstatus_fts_au",
+] + search_index_0012.SQLITE_REVERSE
+
+#drops the 0012 index before its columns go away, Postgres drops the column indexes together with the columns
+def drop_old_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        search_index_0012.run_statements(schema_editor, search_index_0012.SQLITE_REVERSE)
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite' and search_index_0012.fts5_available(schema_editor):
+        search_index_0012.run_statements(schema_editor, SQLITE_FORWARD)
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        search_index_0012.run_statements(schema_editor, SQLITE_REVERSE)
+
+#one lookup row per distinct name, then one UPDATE per name to point the claims at it
+def names_to_lookups(apps, schema_editor):
+    Claim = apps.get_model('claims', 'Claim')
+    Insurer = apps.get_model('claims', 'Insurer')
+    ClaimStatus = apps.get_model('claims', 'ClaimStatus')
+
+    for name in Claim.objects.order_by().values_list('insurer_name', flat=True).distinct():
+        insurer = Insurer.objects.create(name=name)
+        Claim.objects.filter(insurer_name=name).update(insurer=insurer)
+    for name in Claim.objects.order_by().values_list('status', flat=True).distinct():
+        status = ClaimStatus.objects.create(name=name)
+        Claim.objects.filter(status=name).update(claim_status=status)
+
+def lookups_to_names(apps, schema_editor):
+    Claim = apps.get_model('claims', 'Claim')
+    Insurer = apps.get_model('claims', 'Insurer')
+    ClaimStatus = apps.get_model('claims', 'ClaimStatus')
+
+    for insurer in Insurer.objects.all():
+        Claim.objects.filter(insurer=insurer).update(insurer_name=insurer.name)
+    for status in ClaimStatus.objects.all():
+        Claim.objects.filter(claim_status=status).update(status=status.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0013_claim_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_old_search_index, search_index_0012.forward),
+        migrations.CreateModel(
+            name='ClaimStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Insurer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='claim_status',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.claimstatus'),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='insurer',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.insurer'),
+        ),
+        #nullable while both representations exist, so unapplying can re-add the columns before refilling them
+        migrations.AlterField(
+            model_name='claim',
+            name='insurer_name',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='claim',
+            name='status',
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.RunPython(names_to_lookups, lookups_to_names),
+        migrations.RemoveField(
+            model_name='claim',
+            name='insurer_name',
+        ),
+        migrations.RemoveField(
+            model_name='claim',
+            name='status',
+        ),
+        migrations.AlterField(
+            model_name='claim',
+            name='claim_status',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.claimstatus'),
+        ),
+        migrations.AlterField(
+            model_name='claim',
+            name='insurer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.insurer'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:19
+
+import django.db.models.deletion
+import importlib
+
+from django.db import migrations, models
+
+#search index of migration 0014, SQLite rebuilds claims_claim for the fk changes below and that drops its triggers
+search_index_0014 = importlib.import_module('claims.migrations.0014_claim_lookups')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0014_claim_lookups'),
+    ]
+
+    operations = [
+        migrations.RunPython(search_index_0014.drop_search_index, search_index_0014.create_search_index),
+        migrations.AlterField(
+            model_name='claim',
+            name='claim_status',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.claimstatus'),
+        ),
+        migrations.AlterField(
+            model_name='claim',
+            name='insurer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='claims', to='claims.insurer'),
+        ),
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['insurer', 'id'], name='claim_insurer_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['claim_status', 'id'], name='claim_status_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['claim_status', 'insurer', 'id'], include=('billed_amount', 'paid_amount'), name='claim_status_insurer_idx'),
+        ),
+        migrations.RunPython(search_index_0014.create_search_index, search_index_0014.drop_search_index),
+    ]
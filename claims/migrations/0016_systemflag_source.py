@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0015_claim_access_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemflag',
+            name='source',
+            field=models.CharField(choices=[('manual', 'Manual'), ('rule', 'Underpayment rule')], default='manual', max_length=10),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:45
+
+import importlib
+
+from django.db import migrations, models
+
+#search index of migration 0014, SQLite rebuilds claims_claim to add a column with a default and that drops its triggers
+search_index_0014 = importlib.import_module('claims.migrations.0014_claim_lookups')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0016_systemflag_source'),
+    ]
+
+    operations = [
+        migrations.RunPython(search_index_0014.drop_search_index, search_index_0014.create_search_index),
+        migrations.AddField(
+            model_name='claim',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(search_index_0014.create_search_index, search_index_0014.drop_search_index),
+    ]
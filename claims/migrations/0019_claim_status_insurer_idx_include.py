@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+#the report's amounts as non-key columns of the status/insurer index, so its GROUP BY reads only the index
+#Postgres only, SQLite has no INCLUDE and a model index with include made every system check warn (models.W040)
+COVERING_INDEX = (
+    'CREATE INDEX claim_status_insurer_idx ON claims_claim (claim_status_id, insurer_id, id) '
+    'INCLUDE (billed_amount, paid_amount)'
+)
+
+#migration 0015 already created it with INCLUDE on Postgres, it is rebuilt so the index no longer depends on the model state
+def create_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS claim_status_insurer_idx')
+        schema_editor.execute(COVERING_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('claims', '0018_generation'),
+    ]
+
+    operations = [
+        #the model index loses include, on SQLite the index in the database never had it
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(model_name='claim', name='claim_status_insurer_idx'),
+                migrations.AddIndex(
+                    model_name='claim',
+                    index=models.Index(fields=['claim_status', 'insurer', 'id'], name='claim_status_insurer_idx'),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_covering_index, migrations.RunPython.noop),      #the state before this migration has the INCLUDE too
+    ]
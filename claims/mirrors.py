@@ -0,0 +1,326 @@
+import atexit
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+import textwrap
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from claims.parsers import iter_json_array
+
+try:
+    import fcntl
+except ImportError:         #windows, only threads of this process are serialized
+    fcntl = None
+
+#file name stems of the data files, load_claims looks for these
+CLAIM_FILE = 'claim_list_data'
+DETAIL_FILE = 'claim_detail_data'
+
+#column order of the data files
+CLAIM_COLUMNS = ('id', 'patient_name', 'billed_amount', 'paid_amount', 'status', 'insurer_name', 'discharge_date')
+DETAIL_COLUMNS = ('id', 'claim_id', 'denial_reason', 'cpt_codes')
+
+#write-back store for the data/ mirror files
+#an edit appends one line to an append-only journal instead of rewriting the files, so it only touches O(1) bytes
+#the journal is compacted into the JSON and CSV mirrors once it grows past CLAIM_MIRROR_COMPACT_BYTES,
+#when load_claims runs, or with the compact_mirrors management command
+#with CLAIM_MIRROR_SYNC = "thread" edits are handed to a background worker instead, see MirrorSyncWorker
+
+logger = logging.getLogger(__name__)
+
+_thread_lock = threading.Lock()
+
+#serializes journal appends and compaction between threads and between processes
+@contextmanager
+def mirror_lock():
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(str(settings.CLAIM_MIRROR_JOURNAL) + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+#journal representation of a claim, amounts stay strings so no precision is lost before they reach the files
+def claim_entry(claim):
+    return {
+        'id': claim.claim_id,                               #not Django PK, actual claim id
+        'patient_name': str(claim.patient_name),
+        'billed_amount': str(claim.billed_amount),
+        'paid_amount': str(claim.paid_amount),
+        'status': str(claim.status),
+        'insurer_name': str(claim.insurer_name),
+        'discharge_date': str(claim.discharge_date),
+    }
+
+#journal representation of a claim detail
+def detail_entry(claim_detail):
+    return {
+        'id': claim_detail.id,
+        'claim_id': claim_detail.claim.claim_id,
+        'denial_reason': str(claim_detail.denial_reason),
+        'cpt_codes': str(claim_detail.cpt_codes),
+    }
+
+#journal entry for an edited claim and its detail
+def edit_entry(claim, claim_detail=None):
+    return {
+        'claim': claim_entry(claim),
+        'detail': detail_entry(claim_detail) if claim_detail else None,
+    }
+
+#appends journal entries with a single write, then compacts if forced or once the journal is large enough
+def append_entries(entries, compact_now=False):
+    lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+    with mirror_lock():
+        with open(settings.CLAIM_MIRROR_JOURNAL, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            size = f.tell()
+        if compact_now or size >= settings.CLAIM_MIRROR_COMPACT_BYTES:
+            _compact()
+
+#appends edited claims (and their details) to the journal on the calling thread
+#edits is a list of (claim, claim_detail or None) pairs
+def record_many(edits):
+    append_entries([edit_entry(claim, claim_detail) for claim, claim_detail in edits])
+
+#records a single edit on the calling thread
+def record(claim, claim_detail=None):
+    record_many([(claim, claim_detail)])
+
+#hands edits to the write-back path chosen by CLAIM_MIRROR_SYNC and returns without touching the files in thread mode
+def submit_many(edits):
+    if settings.CLAIM_MIRROR_SYNC == 'thread':
+        for claim, claim_detail in edits:
+            sync_worker.submit(edit_entry(claim, claim_detail))     #entries are captured now, later changes to the objects do not leak in
+    else:
+        record_many(edits)
+
+#submits a single edit
+def submit(claim, claim_detail=None):
+    submit_many([(claim, claim_detail)])
+
+#applies every pending journal entry to the mirror files, returns the number of entries applied
+def compact():
+    with mirror_lock():
+        return _compact()
+
+#compaction body, the caller must hold mirror_lock
+def _compact():
+    try:
+        with open(settings.CLAIM_MIRROR_JOURNAL, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return 0
+    if not entries:
+        return 0
+
+    #later edits of the same claim win, so each file is rewritten once however many edits are pending
+    claims = {}
+    details = {}
+    for entry in entries:
+        claims[entry['claim']['id']] = entry['claim']
+        if entry['detail']:
+            details[entry['detail']['claim_id']] = entry['detail']
+
+    rewrite_json(settings.CLAIM_LIST_JSON, 'id', claims, json_claim)
+    rewrite_csv(settings.CLAIM_LIST_CSV, 'id', claims, csv_row)
+    rewrite_json(settings.CLAIM_DETAIL_JSON, 'claim_id', details, dict)
+    rewrite_csv(settings.CLAIM_DETAIL_CSV, 'claim_id', details, csv_row)
+
+    #only emptied once every file is replaced, replaying the same entries after a crash is harmless
+    open(settings.CLAIM_MIRROR_JOURNAL, 'w').close()
+    return len(entries)
+
+#JSON claim values, amounts are numbers in the json files
+def json_claim(entry):
+    return dict(entry, billed_amount=float(entry['billed_amount']), paid_amount=float(entry['paid_amount']))
+
+#CSV values, everything is a string
+def csv_row(entry):
+    return {key: str(value) for key, value in entry.items()}
+
+#yields a JSON array formatted exactly like json.dump(items, f, indent=2) as text chunks, one item at a time
+def json_array_chunks(items):
+    empty = True
+    yield '['
+    for item in items:
+        yield ('\n' if empty else ',\n') + textwrap.indent(json.dumps(item, indent=2), '  ')
+        empty = False
+    yield ']' if empty else '\n]'
+
+#writes items as a JSON array formatted exactly like json.dump(items, f, indent=2), one item at a time
+def write_json_array(f, items):
+    for chunk in json_array_chunks(items):
+        f.write(chunk)
+
+#permissions for a file written over path, those of the file it replaces or rw-r--r-- for a new one
+#(mkstemp creates its files readable by the owner only)
+def file_mode(path):
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        return 0o644
+
+#writes to a temporary file next to path and renames it over path once complete, gzip compressed with compress=True
+@contextmanager
+def atomic_write(path, newline=None, compress=False):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        if compress:
+            with open(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8', newline=newline) as f:
+                yield f
+        else:
+            with open(fd, 'w', encoding='utf-8', newline=newline) as f:
+                yield f
+        os.chmod(tmp_path, file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+#writes items (dicts keyed by columns) to a JSON file and/or a pipe delimited CSV file in a single pass over items
+#each file is written atomically, to_json converts an item for the JSON file (amounts are numbers there)
+def write_snapshot(items, columns, json_path=None, csv_path=None, to_json=dict, compress=False):
+    with ExitStack() as stack:
+        if csv_path:
+            csv_file = stack.enter_context(atomic_write(csv_path, newline='', compress=compress))
+            writer = csv.DictWriter(csv_file, fieldnames=columns, delimiter='|')
+            writer.writeheader()
+
+            #writes every item to the csv file on its way to the json file
+            def tee(items):
+                for item in items:
+                    writer.writerow(item)
+                    yield item
+            items = tee(items)
+
+        if json_path:
+            json_file = stack.enter_context(atomic_write(json_path, compress=compress))
+            write_json_array(json_file, (to_json(item) for item in items))
+        else:
+            for _ in items:
+                pass
+
+#streams a JSON mirror into a new file, replacing items whose key has a pending change and appending the ones never seen
+#will only write if the file exists
+def rewrite_json(path, key, changes, to_item):
+    if not changes or not os.path.exists(path):
+        return
+    pending = dict(changes)
+
+    def items(f):
+        for item in iter_json_array(f):
+            change = pending.pop(item.get(key), None)
+            if change is not None:
+                item.update(to_item(change))
+            yield item
+        for change in pending.values():             #claims that were never in the file
+            yield to_item(change)
+
+    with open(path, 'r', encoding='utf-8') as src, atomic_write(path) as dst:
+        write_json_array(dst, items(src))
+
+#streams a pipe delimited CSV mirror into a new file, same replacement rules as rewrite_json
+def rewrite_csv(path, key, changes, to_row):
+    if not changes or not os.path.exists(path):
+        return
+    pending = dict(changes)
+
+    with open(path, 'r', encoding='utf-8', newline='') as src, atomic_write(path, newline='') as dst:
+        reader = csv.DictReader(src, delimiter='|')                 # the csv files use pipe delimiter
+        writer = csv.DictWriter(dst, fieldnames=reader.fieldnames, delimiter='|', extrasaction='ignore')
+        writer.writeheader()
+        for row in reader:
+            change = pending.pop(int(row[key]), None)
+            if change is not None:
+                row.update(to_row(change))
+            writer.writerow(row)
+        for change in pending.values():             #claims that were never in the file
+            writer.writerow(to_row(change))
+
+#background thread that coalesces edits in memory and flushes them once per CLAIM_MIRROR_FLUSH_INTERVAL seconds
+#a burst of edits to any number of claims costs one journal append and one rewrite of each mirror file
+#pending edits live only in this process until flushed, they are flushed on interpreter exit as well
+class MirrorSyncWorker:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}                   #claim id -> latest journal entry
+        self.oldest_pending = None          #monotonic time of the oldest unflushed edit
+        self.thread = None
+        self.flushes = 0
+        self.last_flush_at = None
+        self.last_flush_lag = None          #seconds between the oldest edit of the last flush and the files being written
+
+    #queues a journal entry, a newer edit of the same claim replaces the older one
+    def submit(self, entry):
+        with self.lock:
+            key = entry['claim']['id']
+            previous = self.pending.get(key)
+            if entry['detail'] is None and previous:            #keep a detail change that is still waiting
+                entry = dict(entry, detail=previous['detail'])
+            self.pending[key] = entry
+            if self.oldest_pending is None:
+                self.oldest_pending = time.monotonic()
+            if self.thread is None or not self.thread.is_alive():      #started lazily so forked server workers each get their own thread
+                self.thread = threading.Thread(target=self.run, name='mirror-sync', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.CLAIM_MIRROR_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Mirror sync flush failed, edits will be retried")
+
+    #writes every pending edit to the journal and compacts it into the files, returns number of claims flushed
+    def flush(self):
+        with self.lock:
+            entries = list(self.pending.values())
+            oldest = self.oldest_pending
+            self.pending = {}
+            self.oldest_pending = None
+        if not entries:
+            return 0
+
+        try:
+            append_entries(entries, compact_now=True)
+        except Exception:
+            with self.lock:                 #put them back unless a newer edit of the same claim arrived meanwhile
+                for entry in entries:
+                    self.pending.setdefault(entry['claim']['id'], entry)
+                if self.oldest_pending is None or oldest < self.oldest_pending:
+                    self.oldest_pending = oldest
+            raise
+
+        with self.lock:
+            self.flushes += 1
+            self.last_flush_at = time.time()
+            self.last_flush_lag = time.monotonic() - oldest
+        return len(entries)
+
+    #queue depth and flush lag for the status endpoint
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': len(self.pending),
+                'oldest_pending_seconds': round(time.monotonic() - self.oldest_pending, 3) if self.oldest_pending else None,
+                'flushes': self.flushes,
+                'last_flush_at': self.last_flush_at,
+                'last_flush_lag_seconds': round(self.last_flush_lag, 3) if self.last_flush_lag is not None else None,
+                'flush_interval_seconds': settings.CLAIM_MIRROR_FLUSH_INTERVAL,
+            }
+
+sync_worker = MirrorSyncWorker()
+atexit.register(sync_worker.flush)
@@ -1,15 +1,58 @@
 # Create your models here.
 from django.db import models
 from django.contrib.auth.models import User
+#Lookup table for insurer names, claims point to it with a small integer fk instead of repeating the name
+class Insurer(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+#Lookup table for claim statuses (Paid, Denied, Under Review, ...)
+class ClaimStatus(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+#claims always come with their insurer and status names, both are a join on a tiny table
+class ClaimManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().select_related('insurer', 'claim_status')
+
 #Table schema for claim list
 class Claim(models.Model):
     claim_id = models.IntegerField(unique=True)          
     patient_name = models.CharField(max_length=255)
     billed_amount = models.DecimalField(max_digits=15, decimal_places=2)
     paid_amount = models.DecimalField(max_digits=15, decimal_places=2)
-    status = models.CharField(max_length=50)
-    insurer_name = models.CharField(max_length=255)
+    claim_status = models.ForeignKey(ClaimStatus, on_delete=models.PROTECT, related_name="claims", db_index=False)   #integer fk, indexed by the composites below
+    insurer = models.ForeignKey(Insurer, on_delete=models.PROTECT, related_name="claims", db_index=False)
     discharge_date = models.DateField()
+    row_hash = models.CharField(max_length=40, blank=True, default="")    #fingerprint of the file row last loaded, blank once edited in the app
+    version = models.PositiveIntegerField(default=1)     #bumped by every edit, note, flag or load, keys the cached rendered fragments
+
+    objects = ClaimManager()
+
+    #indexes follow the home table and report queries, every filter is an equality on the leading columns and rows come back in id order
+    class Meta:
+        indexes = [
+            models.Index(fields=['insurer', 'id'], name='claim_insurer_page_idx'),             #insurer filter, pages ordered by id
+            models.Index(fields=['claim_status', 'id'], name='claim_status_page_idx'),         #status filter, pages ordered by id
+            models.Index(                                                                       #both filters, and the report GROUP BY status, insurer
+                fields=['claim_status', 'insurer', 'id'],                                      #migration 0019 adds the amounts as INCLUDE columns on Postgres
+                name='claim_status_insurer_idx',
+            ),
+        ]
+
+    #names as they were before the lookup tables, used by templates, the data file mirror and the report
+    @property
+    def status(self):
+        return self.claim_status.name
+
+    @property
+    def insurer_name(self):
+        return self.insurer.name
 
     def __str__(self):
         return f"Claim {self.claim_id} - {self.patient_name}"
@@ -19,6 +62,7 @@ class ClaimDetail(models.Model):
     claim = models.ForeignKey(Claim, on_delete=models.CASCADE, related_name="details") #links this table to the matching claim in the "claims.claim" table. The FK will be a auto generated incremental number starting from 1
     denial_reason = models.TextField(blank=True, null=True)
     cpt_codes = models.CharField(max_length=255)  # Storing comma-separated codes
+    row_hash = models.CharField(max_length=40, blank=True, default="")    #fingerprint of the file row last loaded, blank once edited in the app
 
     def __str__(self):
         return f"Details for Claim {self.claim.claim_id}"
@@ -35,9 +79,55 @@ class Note(models.Model):
 
 #Table shema for claim flags, also linked to Claim
 class SystemFlag(models.Model):
+    MANUAL = "manual"       #set with the flag button
+    RULE = "rule"           #set and cleared by the flag_underpayments command
+    SOURCES = [(MANUAL, "Manual"), (RULE, "Underpayment rule")]
+
+    #message of flags set with the flag button
+    MANUAL_MESSAGE = "Potential underpayment detected - review recommended."
+
     claim = models.ForeignKey(Claim, on_delete=models.CASCADE, related_name="flags")
     message = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
+    source = models.CharField(max_length=10, choices=SOURCES, default=MANUAL)
 
     def __str__(self):
         return f"{self.claim.id} - {self.message}"
+
+#Table schema for files already ingested by load_claims --delta, unchanged files are skipped on the next run
+class IngestManifest(models.Model):
+    path = models.CharField(max_length=1024, unique=True)     #absolute path of the loaded file
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    sha256 = models.CharField(max_length=64)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.sha256[:12]})"
+
+#Table schema for the pre-aggregated report, one row per (status, insurer) pair
+#kept current by load_claims, edit_claim, add_flag/remove_flag and clear_table, rebuilt with the rebuild_summary command
+class ClaimSummary(models.Model):
+    status = models.CharField(max_length=50)
+    insurer_name = models.CharField(max_length=255)
+    claim_count = models.IntegerField(default=0)
+    billed_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    paid_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    flag_count = models.IntegerField(default=0)          #flags on the claims of this group
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['status', 'insurer_name'], name='claim_summary_group'),
+        ]
+
+    def __str__(self):
+        return f"{self.status} / {self.insurer_name}: {self.claim_count}"
+
+#Table schema for named counters that only ever go up, kept in the database so every server process and management command sees the same value
+#see claims.generations
+class Generation(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
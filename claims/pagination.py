@@ -0,0 +1,134 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from functools import reduce
+from operator import or_
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+#cursor (keyset) pagination, each page is fetched with WHERE (sort columns) > (last row seen) ... LIMIT n
+#so page N costs the same index range scan as page 1 and no COUNT(*) is needed
+
+#cursor directions: rows after a row (next page), rows before a row (previous page), rows from a row onwards (reload the same page)
+AFTER = 'a'
+BEFORE = 'b'
+AT = 'f'
+
+#one page of rows, has the attributes the table template uses from Django's Page
+class KeysetPage(Sequence):
+
+    def __init__(self, object_list, has_next, has_previous, paginator):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.paginator = paginator
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    #token for the page after this one
+    def next_cursor(self):
+        return self.paginator.encode(AFTER, self.object_list[-1]) if self.has_next_page else ''
+
+    #token for the page before this one
+    def previous_cursor(self):
+        return self.paginator.encode(BEFORE, self.object_list[0]) if self.has_previous_page else ''
+
+    #token that reloads this page starting from its first row, used to refresh the table after an edit
+    def current_cursor(self):
+        return self.paginator.encode(AT, self.object_list[0]) if self.object_list and self.has_previous_page else ''
+
+class KeysetPaginator:
+
+    #ordering is a list of field names, prefix with "-" for descending, id is appended as a tie breaker so every row has a unique position
+    def __init__(self, queryset, per_page, ordering=('id',)):
+        ordering = list(ordering)
+        if 'id' not in ordering and '-id' not in ordering:
+            ordering.append('id')
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    #token holding the direction and the sort values of a row
+    def encode(self, direction, row):
+        values = [getattr(row, field) for field in self.fields]
+        values = [v if isinstance(v, (int, str)) else str(v) for v in values]      #dates and decimals travel as strings
+        raw = json.dumps([direction] + values, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    #returns (direction, values) from a token, or (None, None) if the token is missing or invalid
+    def decode(self, cursor):
+        if not cursor:
+            return None, None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, *values = json.loads(raw)
+            if direction not in (AFTER, BEFORE, AT) or len(values) != len(self.fields):
+                return None, None
+            model = self.queryset.model
+            values = [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            return None, None
+        return direction, values
+
+    #filter selecting rows strictly after (or from, when inclusive) the given sort values, in the order of self.ordering
+    #the reverse flag selects rows before them instead
+    def keyset_filter(self, values, reverse=False, inclusive=False):
+        clauses = []
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = {self.fields[j]: values[j] for j in range(i)}
+            clauses.append(Q(**equal, **{f'{self.fields[i]}__{lookup}': values[i]}))
+        if inclusive:
+            clauses.append(Q(**dict(zip(self.fields, values))))
+        return reduce(or_, clauses)
+
+    #page for a cursor token, an empty or invalid token gives the first page
+    def get_page(self, cursor):
+        direction, query = self.page_query(cursor)
+        page = self.build_page(direction, list(query))
+        return page if page is not None else self.get_page(None)
+
+    #get_page for async views, the rows are read with the async ORM
+    async def aget_page(self, cursor):
+        direction, query = self.page_query(cursor)
+        page = self.build_page(direction, [row async for row in query])
+        return page if page is not None else await self.aget_page(None)
+
+    #(cursor direction, unevaluated query for the page's rows), one extra row tells whether there is another page
+    def page_query(self, cursor):
+        direction, values = self.decode(cursor)
+        queryset = self.queryset
+        ordering = self.ordering
+
+        if direction == BEFORE:
+            queryset = queryset.filter(self.keyset_filter(values, reverse=True))
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in ordering]     #walk backwards from the cursor
+        elif direction in (AFTER, AT):
+            queryset = queryset.filter(self.keyset_filter(values, inclusive=direction == AT))
+        return direction, queryset.order_by(*ordering)[:self.per_page + 1]
+
+    #page from the rows page_query returned, None for a stale cursor, e.g. the rows around it were deleted
+    def build_page(self, direction, rows):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if not rows and direction is not None:
+            return None
+
+        if direction == BEFORE:
+            rows.reverse()
+            return KeysetPage(rows, has_next=True, has_previous=has_more, paginator=self)
+        return KeysetPage(rows, has_next=has_more, has_previous=direction is not None, paginator=self)
@@ -0,0 +1,176 @@
+import csv
+import hashlib
+import json
+import traceback
+from datetime import date
+from decimal import Decimal
+
+#characters read from disk per refill when scanning a JSON array
+READ_SIZE = 64 * 1024
+
+#whitespace allowed between JSON tokens
+JSON_WHITESPACE = ' \t\n\r'
+
+#characters that can follow a complete array element
+JSON_ELEMENT_END = JSON_WHITESPACE + ',]'
+
+#lazily yields each element of a top-level JSON array, only the current read buffer is kept in memory
+def iter_json_array(f, read_size=READ_SIZE):
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    #drops the consumed part of the buffer and appends the next chunk, returns False once the file is exhausted
+    def refill():
+        nonlocal buf, pos, eof
+        chunk = f.read(read_size)
+        buf = buf[pos:] + chunk
+        pos = 0
+        if not chunk:
+            eof = True
+        return bool(chunk)
+
+    #advances past whitespace and returns the next character, or '' at end of file
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not refill():
+                return ''
+
+    if next_char() != '[':
+        raise ValueError("Expected a JSON array at the top level of the file")
+    pos += 1
+
+    if next_char() == ']':          #empty array case
+        return
+
+    while True:
+        next_char()
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+            #a number cut at the buffer edge still decodes, "12345." gives 12345, so a number only counts once
+            #the character after it is in the buffer and ends the element, strings, objects and arrays end with their closing quote or bracket
+            is_number = isinstance(item, (int, float)) and not isinstance(item, bool)
+            incomplete = not eof and (end == len(buf) or (is_number and buf[end] not in JSON_ELEMENT_END))
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            incomplete = True
+
+        if incomplete:
+            refill()
+            continue
+
+        pos = end
+        yield item
+
+        separator = next_char()
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+
+#lazily yields one dict per row of a pipe delimited CSV file
+def iter_csv_rows(f):
+    yield from csv.DictReader(f, delimiter='|')     #files uses pipe delimiters
+
+#streams rows from a .json or .csv file without loading the whole file, the file is closed once the generator finishes
+def iter_rows(file_path):
+    if file_path.endswith('.json'):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from iter_json_array(f)
+    elif file_path.endswith('.csv'):
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            yield from iter_csv_rows(f)
+
+#splits any iterable into lists of at most size items
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+#content fingerprint of coerced field values, identical rows hash the same whether they came from JSON or CSV
+def row_fingerprint(values):
+    content = '\x1f'.join(f"{key}={values[key]}" for key in sorted(values))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+#converts a raw row (JSON values or CSV strings) into Claim field values plus its fingerprint
+def claim_values(item):
+    values = {
+        'claim_id': int(item['id']),
+        'patient_name': item['patient_name'],
+        'billed_amount': Decimal(str(item['billed_amount'])),      #str() first so JSON floats keep their printed digits
+        'paid_amount': Decimal(str(item['paid_amount'])),
+        'status': item['status'],
+        'insurer_name': item['insurer_name'],
+        'discharge_date': date.fromisoformat(str(item['discharge_date'])),
+    }
+    values['row_hash'] = row_fingerprint(values)
+    return values
+
+#converts a raw row into ClaimDetail field values plus its fingerprint, claim_id is still the file's claim id and not the Claim pk
+def detail_values(item):
+    values = {
+        'id': int(item['id']),
+        'claim_id': int(item['claim_id']),
+        'denial_reason': item['denial_reason'],
+        'cpt_codes': item['cpt_codes'],
+    }
+    values['row_hash'] = row_fingerprint(values)
+    return values
+
+#returns the sha256 hex digest of a file, read in blocks so large files are not loaded whole
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+#coercion function for each kind of shard file
+COERCERS = {
+    'claims': claim_values,
+    'details': detail_values,
+}
+
+#streams a file and yields lists of coerced field values, at most batch_size per list
+def iter_value_batches(file_path, kind, batch_size):
+    coerce = COERCERS[kind]
+    for batch in batched(iter_rows(file_path), batch_size):
+        yield [coerce(item) for item in batch]
+
+#task that shuts a parse worker down
+STOP = 'stop'
+
+#messages a parse worker puts on the result queue besides (BATCH, batch) tuples
+BATCH = 'batch'
+FILE_DONE = 'done'
+WORKER_ERROR = 'error'
+
+#process pool worker, parses (file_path, kind) tasks into coerced batches until it receives STOP
+#every finished file is acknowledged with FILE_DONE so the writer knows when a phase is complete
+#this module has no Django imports so it is safe to run under the spawn start method
+def parse_worker(tasks, results, batch_size):
+    while True:
+        task = tasks.get()
+        if task == STOP:
+            return
+
+        file_path, kind = task
+        try:
+            for batch in iter_value_batches(file_path, kind, batch_size):
+                results.put((BATCH, batch))         #blocks while the writer is behind, the queue is bounded
+        except Exception:
+            results.put((WORKER_ERROR, f"{file_path}:\n{traceback.format_exc()}"))
+        results.put((FILE_DONE, file_path))
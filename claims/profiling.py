@@ -0,0 +1,280 @@
+import logging
+import statistics
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from collections import Counter
+from contextvars import ContextVar
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+from django.utils.functional import empty
+
+#lightweight request profiling that stays on in production
+#ProfilingMiddleware times every request, counts and times its queries and the template rendering, and keeps
+#per-view (url name) histograms for this server process, shown to staff at /profiling/stats/
+#a request that runs the same SQL CLAIM_PROFILING_REPEAT_LIMIT or more times is counted as a suspected N+1
+
+logger = logging.getLogger(__name__)
+
+#characters of a repeated statement written to the log, the full text is on the stats endpoint
+LOGGED_SQL_LENGTH = 200
+
+#upper bounds of the latency histogram buckets in milliseconds, the last bucket takes everything above
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+#profile of the request being handled by this thread or task, None outside a profiled request
+current_profile = ContextVar('claims_request_profile', default=None)
+
+#execute_wrapper of every database connection, records the query into the profile of the request running it
+#under ASGI the views query through sync_to_async on other threads with their own connections, the context var
+#is carried across to them, so the hook is installed on each connection as it opens instead of around the request
+def record_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile.record_query(execute, sql, params, many, context)
+
+#connection_created receiver (claims.apps), the hook stays on the connection object for the life of its thread
+#inserted first, execute_wrapper() blocks pop the last wrapper when they exit
+def install_query_hook(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+#measurements of a single request
+class RequestProfile:
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0             #templates rendered from inside another template are already timed
+        self.statements = Counter()         #sql text before parameters -> times run
+
+    #execute_wrapper hook, one call per query on every connection
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_seconds += time.perf_counter() - start
+            self.query_count += 1
+            self.statements[sql] += 1
+
+    #statements run at least `limit` times, most repeated first
+    def repeated_statements(self, limit):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= limit]
+
+    #Server-Timing header value, durations in milliseconds
+    def server_timing(self, total_seconds):
+        return ', '.join([
+            f'total;dur={total_seconds * 1000:.1f}',
+            f'db;dur={self.query_seconds * 1000:.1f};desc="{self.query_count} queries"',
+            f'tpl;dur={self.template_seconds * 1000:.1f}',
+        ])
+
+#running totals for one view
+class ViewStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.repeated_requests = 0          #requests with a suspected N+1
+        self.last_repeated = None           #(sql, count) of the most repeated statement of the latest such request
+
+    def add(self, seconds, profile, repeated):
+        ms = seconds * 1000
+        self.requests += 1
+        self.buckets[next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))] += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.queries += profile.query_count
+        self.max_queries = max(self.max_queries, profile.query_count)
+        self.query_seconds += profile.query_seconds
+        self.template_seconds += profile.template_seconds
+        if repeated:
+            self.repeated_requests += 1
+            self.last_repeated = repeated[0]
+
+    #upper bound of the bucket holding the given fraction of requests, None when it falls in the open last bucket
+    def percentile_ms(self, fraction):
+        rank = fraction * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        n = self.requests
+        return {
+            'requests': n,
+            'mean_ms': round(self.total_seconds / n * 1000, 2),
+            'p50_ms_at_most': self.percentile_ms(0.5),
+            'p95_ms_at_most': self.percentile_ms(0.95),
+            'max_ms': round(self.max_seconds * 1000, 2),
+            'histogram_ms': {
+                **{f'<={bound}': count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                f'>{LATENCY_BUCKETS_MS[-1]}': self.buckets[-1],
+            },
+            'mean_queries': round(self.queries / n, 2),
+            'max_queries': self.max_queries,
+            'mean_db_ms': round(self.query_seconds / n * 1000, 2),
+            'mean_template_ms': round(self.template_seconds / n * 1000, 2),
+            'suspected_n_plus_one': self.repeated_requests,
+            'last_repeated_sql': (
+                {'sql': self.last_repeated[0], 'count': self.last_repeated[1]} if self.last_repeated else None
+            ),
+        }
+
+#per-view stats of this server process
+class ProfileStore:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.started_at = time.time()
+
+    def record(self, view_name, seconds, profile, repeated):
+        with self.lock:
+            self.views.setdefault(view_name, ViewStats()).add(seconds, profile, repeated)
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.started_at = time.time()
+
+    #stats for the status endpoint, slowest views (by mean) first
+    def stats(self):
+        with self.lock:
+            views = {name: view.as_dict() for name, view in self.views.items()}
+            started_at = self.started_at
+        return {
+            'since': started_at,
+            'repeat_limit': settings.CLAIM_PROFILING_REPEAT_LIMIT,
+            'views': dict(sorted(views.items(), key=lambda item: item[1]['mean_ms'], reverse=True)),
+        }
+
+store = ProfileStore()
+
+#latency statistics in milliseconds of a list of samples in seconds, used by the benchmark commands
+def latency_summary(samples):
+    ms = sorted(sample * 1000 for sample in samples)
+    return {
+        'samples': len(ms),
+        'min_ms': round(ms[0], 2),
+        'median_ms': round(statistics.median(ms), 2),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 2),
+        'max_ms': round(ms[-1], 2),
+        'mean_ms': round(statistics.fmean(ms), 2),
+    }
+
+#name stats are kept under, the url name when the request resolved to one
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match._func_path
+
+#the user of the request if the request already loaded it, None otherwise, so the profiler never queries for it
+#async views behind login_required load it with request.auser(), which caches it apart from the lazy request.user
+def loaded_user(request):
+    user = getattr(request, '_acached_user', None)
+    if user is not None:
+        return user
+    user = getattr(request, 'user', None)
+    user = getattr(user, '_wrapped', user)              #the SimpleLazyObject of AuthenticationMiddleware, empty until first read
+    return None if user is empty else user
+
+#profiles every request when CLAIM_PROFILING is on, must be first in MIDDLEWARE so it sees the whole request
+#sync and async capable, under ASGI the async views are awaited directly instead of each request holding a thread
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.CLAIM_PROFILING:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        seconds = time.perf_counter() - start
+        return self.report(request, response, profile, seconds, loaded_user(request))
+
+    async def __acall__(self, request):
+        if not settings.CLAIM_PROFILING:
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        seconds = time.perf_counter() - start
+        return self.report(request, response, profile, seconds, loaded_user(request))
+
+    #adds the request to the per-view stats and the Server-Timing header for staff
+    def report(self, request, response, profile, seconds, user):
+        name = view_name(request)
+        repeated = profile.repeated_statements(settings.CLAIM_PROFILING_REPEAT_LIMIT)
+        if repeated:
+            sql, count = repeated[0]
+            #debug level, intentional batch loops (bulk edits, rule scans) repeat statements too
+            logger.debug("Suspected N+1 in %s: same query run %d times: %s", name, count, sql[:LOGGED_SQL_LENGTH])
+        store.record(name, seconds, profile, repeated)
+
+        if settings.DEBUG or (user is not None and user.is_staff):     #timings are not shown to regular users
+            response['Server-Timing'] = profile.server_timing(seconds)
+        return response
+
+#template wrapper that adds its render time to the current request profile
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        profile = current_profile.get()
+        if profile is None:
+            return self.template.render(context, request)
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_seconds += time.perf_counter() - start
+
+#Django template backend whose templates report their render time to ProfilingMiddleware
+class TimedDjangoTemplates(DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
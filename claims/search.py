@@ -0,0 +1,62 @@
+import re
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from claims.models import ClaimStatus, Insurer
+
+#FTS5 table created by migration 0014 on SQLite (when the build has FTS5), triggers keep it in sync with claims_claim and the lookup tables
+FTS_TABLE = 'claims_claim_fts'
+
+_fts_available = None
+
+#whether the FTS5 table exists on the current database, checked once per process
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+#turns free text into an FTS5 query where every word must match the start of a word, e.g. "jo smi" -> "jo"* "smi"*
+def fts_query(search_query):
+    words = re.findall(r'\w+', search_query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+#filter for the text part of the home search over patient name, status and insurer
+#SQLite uses the FTS5 index with prefix matching, elsewhere it is icontains: on Postgres the patient name has a trigram
+#GIN index (migration 0012), the matching status and insurer ids are read from their small lookup tables first so
+#every branch of the OR is a condition on claims_claim alone, which the planner can serve from an index each
+def text_search(search_query):
+    if fts_available():
+        match = fts_query(search_query)
+        if match:
+            return Q(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+
+    status_ids = list(ClaimStatus.objects.filter(name__icontains=search_query).values_list('id', flat=True))
+    insurer_ids = list(Insurer.objects.filter(name__icontains=search_query).values_list('id', flat=True))
+    return (
+        Q(patient_name__icontains=search_query) |
+        Q(claim_status_id__in=status_ids) |
+        Q(insurer_id__in=insurer_ids)
+    )
+
+#combined filter of the home table for the q, insurer and status request parameters, shared by every view that
+#works on "the claims currently shown" so they always agree with the table
+def claim_filters(search_query="", insurer="", status=""):
+    filters = Q()  # start empty
+
+    #search by text fields, served by the full-text index (prefix match on each word)
+    if search_query:
+        text_filters = text_search(search_query)
+        #search by exact digit claim id
+        if search_query.isdigit():
+            text_filters |= Q(claim_id=int(search_query))
+        filters &= text_filters
+
+    # filter by selected insurer
+    if insurer:
+        filters &= Q(insurer__name=insurer)      #unique name index finds the insurer id, the fk index finds its claims
+
+    # filter by selected status
+    if status:
+        filters &= Q(claim_status__name=status)
+    return filters
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+
+#opt-in SQLite tuning, see CLAIM_SQLITE_TUNING in settings
+#the connection pragmas, IMMEDIATE transactions and kept connections are set up by DATABASES itself,
+#this module has the database settings of both profiles (for benchmark_sqlite) and the pragmas of a load_claims run
+
+#pragmas of a load, commits are not synced to disk and the page cache is large enough for the index builds
+#journal_mode stays as it is, WAL is persistent in the file and cannot change inside a transaction anyway
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -256 * 1024,          #KiB
+    'temp_store': 'MEMORY',
+}
+
+#database settings of a SQLite file, with the tuning profile or with Django's defaults
+#base is a configured settings dict (connection.settings_dict) the other keys are copied from
+def profile_settings(base, name, tuned):
+    database = dict(base, NAME=name, OPTIONS={}, CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+    if tuned:
+        database.update(
+            OPTIONS=settings.CLAIM_SQLITE_OPTIONS,
+            CONN_MAX_AGE=settings.CLAIM_SQLITE_CONN_MAX_AGE,
+            CONN_HEALTH_CHECKS=True,
+        )
+    return database
+
+#current value of a pragma
+def read_pragma(name, conn=connection):
+    with conn.cursor() as cursor:
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+#sets pragmas, names and values come from the dicts above and never from user input
+def write_pragmas(pragmas, conn=connection):
+    with conn.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+
+#applies BULK_LOAD_PRAGMAS for the duration of a load and restores the connection's own values afterwards
+#then checkpoints the WAL so it does not stay at the size of the load, and lets SQLite refresh its planner statistics
+#does nothing unless the tuning profile is on, or inside a transaction where the sync level cannot change
+@contextmanager
+def bulk_load(conn=connection):
+    if conn.vendor != 'sqlite' or not settings.CLAIM_SQLITE_TUNING or conn.in_atomic_block:
+        yield
+        return
+
+    saved = {name: read_pragma(name, conn) for name in BULK_LOAD_PRAGMAS}
+    write_pragmas(BULK_LOAD_PRAGMAS, conn)
+    try:
+        yield
+    finally:
+        write_pragmas(saved, conn)
+        with conn.cursor() as cursor:
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            cursor.execute('PRAGMA optimize')
@@ -0,0 +1,99 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal
+from claims import summary
+
+#report KPIs for the admin dashboard
+#every figure comes from the pre-aggregated summary rows (one per status and insurer pair), folded in python
+#so the report costs the same whatever the size of the claims table
+
+#statuses with their own percentage on the report
+PAID = 'Paid'
+DENIED = 'Denied'
+
+#percentage rounded to one decimal, 0 when there is nothing to divide by
+def percentage(part, whole):
+    return round(part / whole * 100, 1) if whole else 0.0
+
+#average of a summed amount, None when there are no claims (same as Avg over an empty table)
+def average(total, count):
+    return total / count if count else None
+
+@dataclass(frozen=True)
+class DashboardStats:
+    total_claims: int = 0
+    total_flags: int = 0
+    billed_total: Decimal = Decimal('0')
+    paid_total: Decimal = Decimal('0')
+    status_counts: dict = field(default_factory=dict)      #status -> number of claims, sorted by status
+    insurer_counts: dict = field(default_factory=dict)     #insurer name -> number of claims, sorted by name
+
+    @property
+    def paid_claims(self):
+        return self.status_counts.get(PAID, 0)
+
+    @property
+    def denied_claims(self):
+        return self.status_counts.get(DENIED, 0)
+
+    @property
+    def paid_percentage(self):
+        return percentage(self.paid_claims, self.total_claims)
+
+    @property
+    def denied_percentage(self):
+        return percentage(self.denied_claims, self.total_claims)
+
+    @property
+    def avg_billed(self):
+        return average(self.billed_total, self.total_claims)
+
+    @property
+    def avg_paid(self):
+        return average(self.paid_total, self.total_claims)
+
+    #values used by admin_dashboard.html
+    def as_context(self):
+        return {
+            'total_claims': self.total_claims,
+            'paid_percentage': self.paid_percentage,
+            'denied_percentage': self.denied_percentage,
+            'avg_billed': self.avg_billed,
+            'avg_paid': self.avg_paid,
+            'total_flags': self.total_flags,
+            'status_labels': list(self.status_counts),
+            'status_counts': list(self.status_counts.values()),
+            'insurer_labels': list(self.insurer_counts),
+            'insurer_counts': list(self.insurer_counts.values()),
+        }
+
+#folds {(status, insurer): (claims, billed sum, paid sum, flags)} groups into a DashboardStats
+def fold_groups(groups):
+    status_counts = Counter()
+    insurer_counts = Counter()
+    billed_total = Decimal('0')
+    paid_total = Decimal('0')
+    total_flags = 0
+    for (status, insurer_name), (count, billed, paid, flags) in groups.items():
+        if count:
+            status_counts[status] += count
+            insurer_counts[insurer_name] += count
+        billed_total += billed or 0
+        paid_total += paid or 0
+        total_flags += flags
+    return DashboardStats(
+        total_claims=sum(status_counts.values()),
+        total_flags=total_flags,
+        billed_total=billed_total,
+        paid_total=paid_total,
+        status_counts=dict(sorted(status_counts.items())),
+        insurer_counts=dict(sorted(insurer_counts.items())),
+    )
+
+#report from the stored summary rows
+def dashboard_stats():
+    return fold_groups(summary.stored_groups())
+
+#report computed from the claim and flag tables, one grouped scan of each
+def live_dashboard_stats():
+    return fold_groups(summary.live_groups())
@@ -0,0 +1,163 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from claims.models import Claim, ClaimStatus, ClaimSummary, Insurer, SystemFlag
+
+#pre-aggregated report rows, one per (status, insurer) pair
+#writers record what they changed in a SummaryDelta and apply it, so the report never rescans the claims table
+#bulk rewrites (full loads, clear_table) rebuild it with one grouped scan instead
+
+#amounts are compared at the precision they are stored with
+CENTS = Decimal('0.01')
+
+#group key of a claim
+def group_of(claim):
+    return (claim.status, claim.insurer_name)
+
+#amounts of a claim as they were before an edit, taken before the form copies the posted values onto it
+def snapshot(claim):
+    return (claim.status, claim.insurer_name, claim.billed_amount, claim.paid_amount)
+
+#accumulates per-group changes, [claims, billed, paid, flags] for each (status, insurer) key
+class SummaryDelta:
+
+    def __init__(self):
+        self.groups = defaultdict(lambda: [0, Decimal('0'), Decimal('0'), 0])
+
+    def __bool__(self):
+        return any(any(change) for change in self.groups.values())
+
+    #adds (sign=1) or removes (sign=-1) one claim and its flags from a group
+    def add_claim(self, status, insurer_name, billed, paid, flags=0, sign=1):
+        change = self.groups[(status, insurer_name)]
+        change[0] += sign
+        change[1] += Decimal(billed) * sign
+        change[2] += Decimal(paid) * sign
+        change[3] += flags * sign
+
+    def remove_claim(self, status, insurer_name, billed, paid, flags=0):
+        self.add_claim(status, insurer_name, billed, paid, flags, sign=-1)
+
+    def add_flags(self, status, insurer_name, flags):
+        self.groups[(status, insurer_name)][3] += flags
+
+    #writes the changes with one UPDATE ... SET col = col + delta per touched group, creating groups seen for the first time
+    def apply(self):
+        with transaction.atomic():
+            for (status, insurer_name), (claims, billed, paid, flags) in self.groups.items():
+                if not (claims or billed or paid or flags):
+                    continue
+                group = ClaimSummary.objects.filter(status=status, insurer_name=insurer_name)
+                increment = dict(
+                    claim_count=F('claim_count') + claims,
+                    billed_total=F('billed_total') + billed,
+                    paid_total=F('paid_total') + paid,
+                    flag_count=F('flag_count') + flags,
+                )
+                if group.update(**increment):
+                    continue
+                try:
+                    with transaction.atomic():              #savepoint, another writer may create the group first
+                        ClaimSummary.objects.create(
+                            status=status, insurer_name=insurer_name,
+                            claim_count=claims, billed_total=billed, paid_total=paid, flag_count=flags,
+                        )
+                except IntegrityError:
+                    group.update(**increment)
+
+            #groups whose last claim moved away
+            touched = list(self.groups)
+            for status, insurer_name in touched:
+                ClaimSummary.objects.filter(
+                    status=status, insurer_name=insurer_name, claim_count__lte=0, flag_count__lte=0,
+                ).delete()
+        self.groups.clear()
+
+#moves an edited claim from the group it was in (before = snapshot(claim)) to its current one
+def record_edit(before, claim):
+    status, insurer_name, billed, paid = before
+    moved = (status, insurer_name) != group_of(claim)
+    flags = claim.flags.count() if moved else 0             #flags only change group when the claim does
+    delta = SummaryDelta()
+    delta.remove_claim(status, insurer_name, billed, paid, flags)
+    delta.add_claim(claim.status, claim.insurer_name, claim.billed_amount, claim.paid_amount, flags)
+    delta.apply()
+
+#adds (or with a negative number removes) flags on one claim
+def record_flags(claim, flags):
+    if not flags:
+        return
+    delta = SummaryDelta()
+    delta.add_flags(claim.status, claim.insurer_name, flags)
+    delta.apply()
+
+#number of flags per claim_id for the given claim ids
+def flags_by_claim_id(claim_ids):
+    return dict(
+        SystemFlag.objects.filter(claim__claim_id__in=claim_ids)
+        .values_list('claim__claim_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+#summary rows computed from the live tables, {(status, insurer): (claims, billed, paid, flags)}
+#one grouped scan of claims and one of flags, a join would repeat each claim's amounts once per flag
+#both group by the lookup ids, names are filled in from the lookup tables afterwards
+def live_groups():
+    statuses = dict(ClaimStatus.objects.values_list('id', 'name'))
+    insurers = dict(Insurer.objects.values_list('id', 'name'))
+    groups = {
+        (statuses[status_id], insurers[insurer_id]): [count, billed or Decimal('0'), paid or Decimal('0'), 0]
+        for status_id, insurer_id, count, billed, paid in (
+            Claim.objects.order_by()
+            .values_list('claim_status_id', 'insurer_id')
+            .annotate(count=Count('id'), billed=Sum('billed_amount'), paid=Sum('paid_amount'))
+        )
+    }
+    flag_groups = (
+        SystemFlag.objects.order_by()
+        .values_list('claim__claim_status_id', 'claim__insurer_id')
+        .annotate(count=Count('id'))
+    )
+    for status_id, insurer_id, count in flag_groups:
+        key = (statuses[status_id], insurers[insurer_id])
+        groups.setdefault(key, [0, Decimal('0'), Decimal('0'), 0])[3] = count
+    return {key: tuple(values) for key, values in groups.items()}
+
+#summary rows as stored, same shape as live_groups
+def stored_groups():
+    return {
+        (status, insurer_name): (claims, billed, paid, flags)
+        for status, insurer_name, claims, billed, paid, flags in ClaimSummary.objects.values_list(
+            'status', 'insurer_name', 'claim_count', 'billed_total', 'paid_total', 'flag_count',
+        )
+    }
+
+#replaces every summary row with freshly computed ones, returns the number of groups
+def rebuild():
+    groups = live_groups()
+    with transaction.atomic():
+        ClaimSummary.objects.all().delete()
+        ClaimSummary.objects.bulk_create([
+            ClaimSummary(
+                status=status, insurer_name=insurer_name,
+                claim_count=claims, billed_total=billed, paid_total=paid, flag_count=flags,
+            )
+            for (status, insurer_name), (claims, billed, paid, flags) in groups.items()
+        ])
+    return len(groups)
+
+#list of (group, stored values, live values) for every group where the summary disagrees with the tables
+def mismatches():
+    def normalize(values):
+        claims, billed, paid, flags = values
+        return (claims, Decimal(billed).quantize(CENTS), Decimal(paid).quantize(CENTS), flags)
+
+    stored = {key: normalize(values) for key, values in stored_groups().items()}
+    live = {key: normalize(values) for key, values in live_groups().items()}
+    return [
+        (key, stored.get(key), live.get(key))
+        for key in sorted(stored.keys() | live.keys())
+        if stored.get(key) != live.get(key)
+    ]
@@ -0,0 +1,116 @@
+import os
+import random
+from datetime import date, timedelta
+from claims.mirrors import CLAIM_COLUMNS, CLAIM_FILE, DETAIL_COLUMNS, DETAIL_FILE, write_snapshot
+
+#synthetic claim and detail rows shaped like the files in data/, for load and benchmark runs at any scale
+#the distributions below were measured on the shipped 6.2k claim files
+
+#first claim id, the shipped files start at 30001
+FIRST_CLAIM_ID = 30001
+
+#insurer shares, roughly even in the shipped data
+INSURERS = ('Aetna', 'Blue Cross', 'Cigna', 'United Healthcare', 'Self Funded Inc.')
+INSURER_WEIGHTS = (20, 20, 20, 20, 20)
+
+#status shares and the paid/billed ratio range each status is drawn from
+STATUSES = ('Paid', 'Denied', 'Under Review')
+STATUS_WEIGHTS = (20.7, 15.2, 64.1)
+PAID_RATIOS = {
+    'Paid': (0.80, 1.00),
+    'Denied': (0.0, 0.15),
+    'Under Review': (0.15, 0.80),
+}
+
+#billed amounts are uniform over this range in the shipped data
+BILLED_RANGE = (1000.00, 1000000.00)
+
+#paid claims carry 'N/A', the others one of these reasons
+PAID_DENIAL_REASON = 'N/A'
+DENIAL_REASONS = (
+    'Policy terminated before service date',
+    'Experimental/investigational procedure',
+    'Insufficient documentation',
+    'Coding error / modifier missing',
+    'Authorization not obtained',
+    'Duplicate claim submission',
+    'Invalid patient information',
+    'Out-of-network provider',
+    'Claim filed too late',
+    'Service not covered under plan',
+)
+
+#CPT codes with relative frequencies, office visits and common labs dominate
+CPT_CODES = (
+    ('80053', 918), ('99213', 800), ('99203', 796), ('99204', 766), ('99214', 755),
+    ('81002', 733), ('99215', 689), ('36415', 604), ('82270', 369), ('85025', 341),
+    ('93000', 300), ('71046', 280), ('90834', 260), ('90837', 240), ('82947', 230),
+    ('99406', 200), ('97110', 190), ('97140', 170), ('73030', 150), ('99285', 140),
+    ('99284', 130), ('87086', 120), ('80061', 110), ('84443', 100), ('83036', 95),
+    ('70450', 80), ('74177', 70), ('45378', 60), ('29881', 40), ('27447', 30),
+)
+
+#number of CPT codes on a claim, 2 and 3 are the most common
+CPT_COUNTS = (1, 2, 3, 4)
+CPT_COUNT_WEIGHTS = (10, 39, 40, 11)
+
+#discharge dates are spread over this range
+DISCHARGE_START = date(2021, 8, 5)
+DISCHARGE_DAYS = 1460
+
+FIRST_NAMES = (
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Andrew', 'Annette', 'Virginia', 'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark',
+)
+LAST_NAMES = (
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Rhodes', 'Hunt',
+)
+
+#yields (claim, detail) dict pairs, the same seed always gives the same rows
+def generate(rows, seed=0, first_claim_id=FIRST_CLAIM_ID):
+    rng = random.Random(seed)
+    codes = [code for code, _ in CPT_CODES]
+    code_weights = [weight for _, weight in CPT_CODES]
+
+    for n in range(rows):
+        status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+        low, high = PAID_RATIOS[status]
+        billed = round(rng.uniform(*BILLED_RANGE), 2)
+        claim_id = first_claim_id + n
+
+        claim = {
+            'id': claim_id,
+            'patient_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'billed_amount': billed,
+            'paid_amount': round(billed * rng.uniform(low, high), 2),
+            'status': status,
+            'insurer_name': rng.choices(INSURERS, INSURER_WEIGHTS)[0],
+            'discharge_date': (DISCHARGE_START + timedelta(days=rng.randrange(DISCHARGE_DAYS))).isoformat(),
+        }
+        count = rng.choices(CPT_COUNTS, CPT_COUNT_WEIGHTS)[0]
+        detail = {
+            'id': n + 1,
+            'claim_id': claim_id,
+            'denial_reason': PAID_DENIAL_REASON if status == 'Paid' else rng.choice(DENIAL_REASONS),
+            'cpt_codes': ','.join(rng.choices(codes, code_weights, k=count)),
+        }
+        yield claim, detail
+
+#writes one kind of file (0 = claims, 1 = details) in every requested format from a single pass over the generator
+def write_kind(out_dir, name, columns, part, rows, seed, formats):
+    json_path = os.path.join(out_dir, f'{name}.json') if 'json' in formats else None
+    csv_path = os.path.join(out_dir, f'{name}.csv') if 'csv' in formats else None
+    write_snapshot((pair[part] for pair in generate(rows, seed)), columns, json_path=json_path, csv_path=csv_path)
+    return [path for path in (csv_path, json_path) if path]
+
+#writes claim_list_data and claim_detail_data in the requested formats ('json', 'csv'), returns the file paths
+#rows are streamed, so memory stays flat at any scale
+def write_dataset(out_dir, rows, seed=0, formats=('json', 'csv')):
+    os.makedirs(out_dir, exist_ok=True)
+    return (
+        write_kind(out_dir, CLAIM_FILE, CLAIM_COLUMNS, 0, rows, seed, formats) +
+        write_kind(out_dir, DETAIL_FILE, DETAIL_COLUMNS, 1, rows, seed, formats)
+    )
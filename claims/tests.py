@@ -1,3 +1,1714 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+from contextlib import redirect_stdout
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.functional import SimpleLazyObject
+
+from claims import bulk, dump, etags, export, facets, fragments, ingest, mirrors, pagination, parsers, profiling, search, sqlite, stats, summary, underpayment, views
+from claims.forms import EditClaimForm
+from claims.models import Claim, ClaimDetail, ClaimStatus, ClaimSummary, Insurer, Note, SystemFlag
+
+
+
+#claim rows in the layout of the data files, values override the defaults of every row
+def claim_rows(claim_ids, **values):
+    return [
+        {"id": i, "patient_name": f"Patient {i}", "billed_amount": 100.0, "paid_amount": 50.0,
+         "status": "Paid", "insurer_name": "Aetna", "discharge_date": "2024-01-01", **values}
+        for i in claim_ids
+    ]
+
+#one detail row per claim, with the claim's id as its own
+def detail_rows(claim_ids):
+    return [{"id": i, "claim_id": i, "denial_reason": "", "cpt_codes": "99213"} for i in claim_ids]
+
+#writes rows as a JSON data file into directory
+def write_data_file(directory, name, rows):
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        json.dump(rows, f)
+
+#a reviewer and claim 7 (Denied, Aetna) with one detail, shared by the cache, ETag and partial view tests
+class ClaimFixtureTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw", first_name="Ada", last_name="Lovelace")
+        cls.denied = ClaimStatus.objects.create(name="Denied")
+        cls.aetna = Insurer.objects.create(name="Aetna")
+        cls.claim = Claim.objects.create(
+            claim_id=7,
+            patient_name="Patient 7",
+            billed_amount=Decimal("100.00"),
+            paid_amount=Decimal("10.00"),
+            claim_status=cls.denied,
+            insurer=cls.aetna,
+            discharge_date=date(2024, 1, 1),
+        )
+        ClaimDetail.objects.create(claim=cls.claim, cpt_codes="99213", denial_reason="Late filing")
+
+#the streaming JSON array reader gives the same elements as json.loads wherever the read buffer splits the file
+class JsonArrayParserTests(TestCase):
+
+    def parse(self, text, read_size):
+        return list(parsers.iter_json_array(StringIO(text), read_size))
+
+    def assert_every_split(self, text):
+        for read_size in range(1, len(text) + 1):
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self.parse(text, read_size), json.loads(text))
+
+    def test_numbers(self):
+        self.assert_every_split('[12345.678, -0.5, 1e5, 2.5E-3, 0, 98765]')
+
+    def test_number_split_after_the_point(self):
+        self.assertEqual(self.parse('[12345.678]', 7), [12345.678])        #first read ends with "12345."
+
+    def test_strings_and_escapes(self):
+        self.assert_every_split('["plain", "quote \\" inside", "back\\\\slash", "\\u00e9t\\u00e9", "tab\\t"]')
+
+    def test_objects_literals_and_whitespace(self):
+        self.assert_every_split('[ {"id": 1, "paid": 12.5, "ok": true, "note": null} ,\n\t{"id": 2, "codes": [1, 2]}\r\n]')
+
+    def test_empty_array(self):
+        self.assertEqual(self.parse(' [ ] ', 1), [])
+
+    def test_invalid_documents(self):
+        for text in ('{"id": 1}', '[1 2]', '[1,'):
+            with self.subTest(text=text), self.assertRaises(ValueError):       #JSONDecodeError is a ValueError
+                self.parse(text, 2)
+
+
+#load_claims --delta skips files the manifest has seen and writes only rows whose fingerprint changed
+@mock.patch("claims.mirrors.compact", return_value=0)          #the data folder's journal is not touched
+class DeltaLoadTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = tmp_dir.name
+        self.claims = [
+            {"id": i, "patient_name": f"Patient {i}", "billed_amount": 100.0, "paid_amount": 50.0,
+             "status": "Paid", "insurer_name": "Aetna", "discharge_date": "2024-01-01"}
+            for i in (1, 2, 3)
+        ]
+        self.write("claim_list_data.json", self.claims)
+        self.write("claim_detail_data.json", [{"id": 1, "claim_id": 1, "denial_reason": "", "cpt_codes": "99213"}])
+
+    #writes a data file with a later mtime each time, so the manifest sees the change even within one clock tick
+    def write(self, name, rows):
+        path = os.path.join(self.dir, name)
+        mtime = os.stat(path).st_mtime + 10 if os.path.exists(path) else None
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+
+    def load(self):
+        out = StringIO()
+        call_command("load_claims", self.dir, "--delta", stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_files_are_skipped(self, compact):
+        self.assertIn("4 inserted, 0 updated, 0 unchanged, 0 unchanged files skipped", self.load())
+        self.assertIn("0 inserted, 0 updated, 0 unchanged, 2 unchanged files skipped", self.load())
+
+        path = os.path.join(self.dir, "claim_list_data.json")
+        os.utime(path, (os.stat(path).st_mtime + 10,) * 2)                    #touched, same content
+        self.assertIn("2 unchanged files skipped", self.load())
+
+    def test_counts_of_changed_rows(self, compact):
+        self.load()
+        self.claims[1]["paid_amount"] = 75.0
+        self.claims.append(dict(self.claims[0], id=4, patient_name="Patient 4"))
+        self.write("claim_list_data.json", self.claims)
+        self.assertIn("1 inserted, 1 updated, 2 unchanged, 1 unchanged files skipped", self.load())
+        self.assertEqual(Claim.objects.get(claim_id=2).paid_amount, Decimal("75.00"))
+        self.assertEqual(Claim.objects.count(), 4)
+
+    def test_summary_follows_status_and_insurer_changes(self, compact):
+        self.load()
+        SystemFlag.objects.create(claim=Claim.objects.get(claim_id=1), message="Check payment")
+        summary.rebuild()
+        self.claims[0].update(status="Denied", insurer_name="Cigna", paid_amount=0.0)
+        self.write("claim_list_data.json", self.claims)
+        self.load()
+
+        groups = summary.stored_groups()
+        self.assertEqual(groups, summary.live_groups())
+        self.assertEqual(groups[("Denied", "Cigna")], (1, Decimal("100.00"), Decimal("0.00"), 1))
+        self.assertEqual(groups[("Paid", "Aetna")][0], 2)
+        self.assertEqual(groups[("Paid", "Aetna")][3], 0)                    #the flag moved with its claim
+
+
+#edits reach the data files through the journal: appended, compacted into the JSON and CSV mirrors, or flushed by the worker
+class MirrorJournalTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.paths = {
+            name: os.path.join(tmp_dir.name, file_name)
+            for name, file_name in (
+                ("CLAIM_LIST_JSON", "claim_list_data.json"), ("CLAIM_LIST_CSV", "claim_list_data.csv"),
+                ("CLAIM_DETAIL_JSON", "claim_detail_data.json"), ("CLAIM_DETAIL_CSV", "claim_detail_data.csv"),
+                ("CLAIM_MIRROR_JOURNAL", "mirror_journal.jsonl"),
+            )
+        }
+        files = self.settings(**self.paths, CLAIM_MIRROR_COMPACT_BYTES=1024 * 1024)
+        files.enable()
+        self.addCleanup(files.disable)
+
+        rows = [
+            {"id": i, "patient_name": f"Patient {i}", "billed_amount": "100.00", "paid_amount": "50.00",
+             "status": "Paid", "insurer_name": "Aetna", "discharge_date": "2024-01-01"}
+            for i in (1, 2)
+        ]
+        mirrors.write_snapshot(rows, mirrors.CLAIM_COLUMNS, self.paths["CLAIM_LIST_JSON"], self.paths["CLAIM_LIST_CSV"], mirrors.json_claim)
+        details = [{"id": 1, "claim_id": 1, "denial_reason": "", "cpt_codes": "99213"}]
+        mirrors.write_snapshot(details, mirrors.DETAIL_COLUMNS, self.paths["CLAIM_DETAIL_JSON"], self.paths["CLAIM_DETAIL_CSV"])
+
+    #an unsaved claim, the journal only reads its fields
+    def claim(self, claim_id, paid_amount="50.00", status="Paid"):
+        return Claim(
+            claim_id=claim_id, patient_name=f"Patient {claim_id}", billed_amount=Decimal("100.00"),
+            paid_amount=Decimal(paid_amount), claim_status=ClaimStatus(name=status), insurer=Insurer(name="Aetna"),
+            discharge_date=date(2024, 1, 1),
+        )
+
+    def json_rows(self, name):
+        with open(self.paths[name], encoding="utf-8") as f:
+            return {row["claim_id" if "DETAIL" in name else "id"]: row for row in json.load(f)}
+
+    def csv_rows(self, name):
+        with open(self.paths[name], encoding="utf-8", newline="") as f:
+            return {int(row["claim_id" if "DETAIL" in name else "id"]): row for row in csv.DictReader(f, delimiter="|")}
+
+    def journal_lines(self):
+        with open(self.paths["CLAIM_MIRROR_JOURNAL"], encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_append_leaves_the_files_until_compacted(self):
+        mirrors.record(self.claim(1, paid_amount="75.00"))
+        mirrors.record(self.claim(2, status="Denied"))
+
+        self.assertEqual(len(self.journal_lines()), 2)
+        self.assertEqual(json.loads(self.journal_lines()[0])["claim"]["paid_amount"], "75.00")
+        self.assertEqual(self.json_rows("CLAIM_LIST_JSON")[1]["paid_amount"], 50.0)
+
+    def test_compact_applies_the_latest_edit_of_each_claim(self):
+        mirrors.record(self.claim(1, paid_amount="60.00"))
+        claim = self.claim(1, paid_amount="75.00")
+        mirrors.record(claim, ClaimDetail(id=1, claim=claim, denial_reason="Late", cpt_codes="99214"))
+        mirrors.record(self.claim(3, status="Denied"))                      #never in the files
+
+        self.assertEqual(mirrors.compact(), 3)
+        self.assertEqual(self.journal_lines(), [])
+
+        claims = self.json_rows("CLAIM_LIST_JSON")
+        self.assertEqual(list(claims), [1, 2, 3])
+        self.assertEqual(claims[1]["paid_amount"], 75.0)
+        self.assertEqual(claims[3]["status"], "Denied")
+        rows = self.csv_rows("CLAIM_LIST_CSV")
+        self.assertEqual(rows[1]["paid_amount"], "75.00")
+        self.assertEqual(rows[3]["status"], "Denied")
+        self.assertEqual(self.json_rows("CLAIM_DETAIL_JSON")[1]["cpt_codes"], "99214")
+        self.assertEqual(self.csv_rows("CLAIM_DETAIL_CSV")[1]["denial_reason"], "Late")
+
+        self.assertEqual(mirrors.compact(), 0)                              #nothing pending
+
+    def test_replayed_journal_gives_the_same_files(self):
+        entry = mirrors.edit_entry(self.claim(1, paid_amount="75.00"))
+        mirrors.append_entries([entry], compact_now=True)
+        with open(self.paths["CLAIM_LIST_JSON"], encoding="utf-8") as f:
+            compacted = f.read()
+
+        mirrors.append_entries([entry], compact_now=True)                   #as after a crash before the journal was emptied
+        with open(self.paths["CLAIM_LIST_JSON"], encoding="utf-8") as f:
+            self.assertEqual(f.read(), compacted)
+
+    def test_append_compacts_past_the_size_limit(self):
+        with self.settings(CLAIM_MIRROR_COMPACT_BYTES=1):
+            mirrors.record(self.claim(2, paid_amount="80.00"))
+        self.assertEqual(self.journal_lines(), [])
+        self.assertEqual(self.json_rows("CLAIM_LIST_JSON")[2]["paid_amount"], 80.0)
+
+    def worker(self):
+        worker = mirrors.MirrorSyncWorker()
+        worker.thread = mock.Mock(**{"is_alive.return_value": True})     #no flush thread, the test flushes
+        return worker
+
+    def test_worker_flush_coalesces_edits(self):
+        worker = self.worker()
+        claim = self.claim(1, paid_amount="60.00")
+        worker.submit(mirrors.edit_entry(claim, ClaimDetail(id=1, claim=claim, denial_reason="Late", cpt_codes="99214")))
+        worker.submit(mirrors.edit_entry(self.claim(1, paid_amount="75.00")))     #no detail, the pending one is kept
+        worker.submit(mirrors.edit_entry(self.claim(2, status="Denied")))
+        self.assertEqual(worker.stats()["queue_depth"], 2)
+        self.assertEqual(self.json_rows("CLAIM_LIST_JSON")[1]["paid_amount"], 50.0)
+
+        self.assertEqual(worker.flush(), 2)
+        self.assertEqual(self.journal_lines(), [])
+        self.assertEqual(self.json_rows("CLAIM_LIST_JSON")[1]["paid_amount"], 75.0)
+        self.assertEqual(self.csv_rows("CLAIM_LIST_CSV")[2]["status"], "Denied")
+        self.assertEqual(self.json_rows("CLAIM_DETAIL_JSON")[1]["cpt_codes"], "99214")
+
+        stats = worker.stats()
+        self.assertEqual((stats["queue_depth"], stats["flushes"]), (0, 1))
+        self.assertIsNotNone(stats["last_flush_lag_seconds"])
+        self.assertEqual(worker.flush(), 0)
+
+    def test_failed_flush_keeps_the_edits(self):
+        worker = self.worker()
+        worker.submit(mirrors.edit_entry(self.claim(1, paid_amount="60.00")))
+        with mock.patch("claims.mirrors.append_entries", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                worker.flush()
+        worker.submit(mirrors.edit_entry(self.claim(2, status="Denied")))
+        self.assertEqual(worker.stats()["queue_depth"], 2)
+        self.assertEqual(worker.stats()["flushes"], 0)
+
+        self.assertEqual(worker.flush(), 2)
+        self.assertEqual(self.json_rows("CLAIM_LIST_JSON")[1]["paid_amount"], 60.0)
+
+
+#home search goes through the FTS5 index on SQLite, its triggers keep it in step with every write to the claims and lookups
+@skipUnless(connection.vendor == "sqlite", "SQLite full-text search")
+class FullTextSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.denied = ClaimStatus.objects.create(name="Denied")
+        cls.paid = ClaimStatus.objects.create(name="Paid")
+        cls.aetna = Insurer.objects.create(name="Aetna")
+        cls.cigna = Insurer.objects.create(name="Cigna")
+        cls.virginia = cls.create_claim(1, "Virginia Rhodes", cls.denied, cls.aetna)
+        cls.andrew = cls.create_claim(2, "Andrew Hunt", cls.paid, cls.cigna)
+
+    @classmethod
+    def create_claim(cls, claim_id, patient_name, status, insurer):
+        return Claim.objects.create(
+            claim_id=claim_id, patient_name=patient_name, billed_amount=Decimal("100.00"), paid_amount=Decimal("0.00"),
+            claim_status=status, insurer=insurer, discharge_date=date(2024, 1, 1),
+        )
+
+    def found(self, search_query):
+        return set(Claim.objects.filter(search.claim_filters(search_query)).values_list("claim_id", flat=True))
+
+    def indexed(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT patient_name, status, insurer_name FROM {search.FTS_TABLE} WHERE rowid = %s", [pk])
+            return cursor.fetchone()
+
+    def test_index_is_used(self):
+        self.assertTrue(search.fts_available())
+        with CaptureQueriesContext(connection) as queries:
+            self.found("vir")
+        self.assertIn(f"{search.FTS_TABLE} MATCH", queries[-1]["sql"])
+
+    def test_fts_query(self):
+        self.assertEqual(search.fts_query("jo smi"), '"jo"* "smi"*')
+        self.assertEqual(search.fts_query('"; DROP'), '"DROP"*')                #only word characters reach MATCH
+        self.assertEqual(search.fts_query("--"), "")
+
+    def test_prefix_of_every_word_matches(self):
+        self.assertEqual(self.found("vir rho"), {1})
+        self.assertEqual(self.found("Rhodes"), {1})
+        self.assertEqual(self.found("den"), {1})                              #status
+        self.assertEqual(self.found("cig"), {2})                              #insurer
+        self.assertEqual(self.found("vir hunt"), set())
+        self.assertEqual(self.found("odes"), set())                           #not the start of a word
+
+    def test_claim_id_or_text(self):
+        self.assertEqual(self.found("2"), {2})
+
+    def test_punctuation_only_falls_back_to_like(self):
+        self.assertEqual(self.found("-"), set())
+
+    #without FTS each branch of the OR is on claims_claim alone, the names are resolved to ids beforehand
+    def test_like_fallback_resolves_lookup_ids(self):
+        with mock.patch.object(search, "_fts_available", False):
+            self.assertEqual(self.found("rhod"), {1})
+            self.assertEqual(self.found("ENI"), {1})                            #inside a status name
+            self.assertEqual(self.found("igna"), {2})
+            self.assertEqual(self.found("nothing"), set())
+            with CaptureQueriesContext(connection) as queries:
+                self.found("a")
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn("JOIN", queries[-1]["sql"])
+
+    def test_insert_trigger(self):
+        claim = self.create_claim(3, "Monica Smith", self.paid, self.aetna)
+        self.assertEqual(self.indexed(claim.pk), ("Monica Smith", "Paid", "Aetna"))
+        self.assertEqual(self.found("mon smi"), {3})
+
+    def test_update_trigger(self):
+        Claim.objects.filter(pk=self.virginia.pk).update(patient_name="Virginia Stone", claim_status=self.paid, insurer=self.cigna)
+        self.assertEqual(self.indexed(self.virginia.pk), ("Virginia Stone", "Paid", "Cigna"))
+        self.assertEqual(self.found("rhodes"), set())
+        self.assertEqual(self.found("stone"), {1})
+        self.assertEqual(self.found("cigna"), {1, 2})
+
+    def test_lookup_rename_triggers(self):
+        ClaimStatus.objects.filter(pk=self.denied.pk).update(name="Rejected")
+        Insurer.objects.filter(pk=self.cigna.pk).update(name="Humana")
+        self.assertEqual(self.indexed(self.virginia.pk)[1], "Rejected")
+        self.assertEqual(self.indexed(self.andrew.pk)[2], "Humana")
+        self.assertEqual(self.found("rej"), {1})
+        self.assertEqual(self.found("cigna"), set())
+
+    def test_delete_trigger(self):
+        Claim.objects.filter(pk=self.virginia.pk).delete()
+        self.assertIsNone(self.indexed(self.virginia.pk))
+        self.assertEqual(self.found("virginia"), set())
+
+
+#cursor tokens round trip the sort values of a row, bad tokens give the first page and the edges of a result have no links
+class KeysetPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        denied = ClaimStatus.objects.create(name="Denied")
+        paid = ClaimStatus.objects.create(name="Paid")
+        aetna = Insurer.objects.create(name="Aetna")
+        for i in range(1, 12):
+            Claim.objects.create(
+                claim_id=i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.00") if i % 3 else Decimal("250.50"),
+                paid_amount=Decimal("0.00"),
+                claim_status=denied if i % 2 else paid,                    #odd claims are denied
+                insurer=aetna,
+                discharge_date=date(2024, 1, i),
+            )
+
+    def paginator(self, per_page=2, ordering=("id",), **filters):
+        queryset = Claim.objects.filter(search.claim_filters(**filters))
+        return pagination.KeysetPaginator(queryset, per_page, ordering=ordering)
+
+    def claim_ids(self, page):
+        return [claim.claim_id for claim in page]
+
+    #claim ids of every page reached by following next links from the first page
+    def walk(self, paginator):
+        pages = []
+        page = paginator.get_page("")
+        while True:
+            pages.append(self.claim_ids(page))
+            if not page.has_next():
+                return pages
+            page = paginator.get_page(page.next_cursor())
+
+    def test_cursor_round_trip(self):
+        paginator = self.paginator(ordering=["-discharge_date", "billed_amount"])
+        self.assertEqual(paginator.fields, ["discharge_date", "billed_amount", "id"])
+        claim = Claim.objects.get(claim_id=3)
+
+        cursor = paginator.encode(pagination.AFTER, claim)
+        self.assertRegex(cursor, r"^[A-Za-z0-9_-]+$")                          #fits a query string as is
+        self.assertEqual(paginator.decode(cursor), (pagination.AFTER, [date(2024, 1, 3), Decimal("250.50"), claim.pk]))
+
+    def test_invalid_cursors(self):
+        paginator = self.paginator()
+        valid = paginator.encode(pagination.AFTER, Claim.objects.get(claim_id=3))
+
+        def token(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+        for cursor in (
+            "", "not a cursor!", valid[:-3], token({"a": 1}), token(5), token([]),
+            token(["x", 3]),                        #unknown direction
+            token([pagination.AFTER, 3, 4]),        #more values than sort fields
+            token([pagination.AFTER, "three"]),     #not an id
+        ):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(paginator.decode(cursor), (None, None))
+                page = paginator.get_page(cursor)
+                self.assertEqual(self.claim_ids(page), [1, 2])
+                self.assertFalse(page.has_previous())
+
+    def test_tampered_cursor_values_are_only_a_position(self):
+        paginator = self.paginator(status="Denied")
+        cursor = base64.urlsafe_b64encode(json.dumps([pagination.AFTER, 0]).encode()).decode().rstrip("=")
+        self.assertEqual(self.claim_ids(paginator.get_page(cursor)), [1, 3])  #the filter still applies
+
+    def test_next_through_a_filtered_result(self):
+        self.assertEqual(self.walk(self.paginator(status="Denied")), [[1, 3], [5, 7], [9, 11]])
+        self.assertEqual(self.walk(self.paginator(status="Paid", per_page=5)), [[2, 4, 6, 8, 10]])
+
+    def test_edges_of_a_filtered_result(self):
+        paginator = self.paginator(status="Denied")
+        first = paginator.get_page("")
+        self.assertFalse(first.has_previous())
+        self.assertEqual((first.previous_cursor(), first.current_cursor()), ("", ""))
+
+        last = paginator.get_page(paginator.get_page(first.next_cursor()).next_cursor())
+        self.assertEqual(self.claim_ids(last), [9, 11])
+        self.assertFalse(last.has_next())
+        self.assertEqual(last.next_cursor(), "")
+        self.assertTrue(last.has_previous())
+
+    def test_previous_pages(self):
+        paginator = self.paginator(status="Denied")
+        last = paginator.get_page(paginator.encode(pagination.AFTER, Claim.objects.get(claim_id=7)))
+        self.assertEqual(self.claim_ids(last), [9, 11])
+
+        middle = paginator.get_page(last.previous_cursor())
+        self.assertEqual(self.claim_ids(middle), [5, 7])
+        self.assertTrue(middle.has_next() and middle.has_previous())
+
+        first = paginator.get_page(middle.previous_cursor())
+        self.assertEqual(self.claim_ids(first), [1, 3])
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+
+    def test_current_cursor_reloads_the_page(self):
+        paginator = self.paginator(status="Denied")
+        middle = paginator.get_page(paginator.get_page("").next_cursor())
+        self.assertEqual(self.claim_ids(paginator.get_page(middle.current_cursor())), [5, 7])
+
+    def test_stale_cursor_gives_the_first_page(self):
+        paginator = self.paginator(status="Denied")
+        cursor = paginator.encode(pagination.BEFORE, Claim.objects.get(claim_id=1))   #nothing before the first row
+        self.assertEqual(self.claim_ids(paginator.get_page(cursor)), [1, 3])
+
+        cursor = paginator.encode(pagination.AT, Claim.objects.get(claim_id=11))
+        Claim.objects.filter(claim_id=11).delete()
+        self.assertEqual(self.claim_ids(paginator.get_page(cursor)), [1, 3])
+
+    def test_descending_order_with_ties(self):
+        pages = self.walk(self.paginator(per_page=3, ordering=["-billed_amount"]))
+        self.assertEqual(pages, [[3, 6, 9], [1, 2, 4], [5, 7, 8], [10, 11]])      #equal amounts in id order
+
+    async def test_async_pages_match(self):
+        paginator = self.paginator(status="Denied")
+        first = await paginator.aget_page("")
+        self.assertEqual(self.claim_ids(first), [1, 3])
+        self.assertEqual(self.claim_ids(await paginator.aget_page(first.next_cursor())), [5, 7])
+        self.assertEqual(self.claim_ids(await paginator.aget_page("garbage")), [1, 3])
+
+
+#migration 0014 turns the status and insurer name columns into one lookup row per distinct name
+class LookupMigrationTests(TransactionTestCase):
+
+    before = [("claims", "0013_claim_summary")]
+    after = [("claims", "0014_claim_lookups")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_names_become_lookup_rows(self):
+        old_apps = self.migrate(self.before)
+        OldClaim = old_apps.get_model("claims", "Claim")
+        for claim_id, status, insurer_name in ((1, "Denied", "Aetna"), (2, "Paid", "Aetna"), (3, "Denied", "Cigna")):
+            OldClaim.objects.create(
+                claim_id=claim_id, patient_name=f"Patient {claim_id}", billed_amount=Decimal("100.00"),
+                paid_amount=Decimal("0.00"), status=status, insurer_name=insurer_name, discharge_date=date(2024, 1, 1),
+            )
+
+        new_apps = self.migrate(self.after)
+        NewClaim = new_apps.get_model("claims", "Claim")
+        self.assertEqual(sorted(new_apps.get_model("claims", "ClaimStatus").objects.values_list("name", flat=True)), ["Denied", "Paid"])
+        self.assertEqual(sorted(new_apps.get_model("claims", "Insurer").objects.values_list("name", flat=True)), ["Aetna", "Cigna"])
+        self.assertEqual(
+            list(NewClaim.objects.order_by("claim_id").values_list("claim_id", "claim_status__name", "insurer__name")),
+            [(1, "Denied", "Aetna"), (2, "Paid", "Aetna"), (3, "Denied", "Cigna")],
+        )
+
+
+#the claim form takes status and insurer as typed names and points the claim at their lookup rows
+class EditClaimFormTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.aetna = Insurer.objects.create(name="Aetna")
+        cls.claim = Claim.objects.create(
+            claim_id=1, patient_name="Patient 1", billed_amount=Decimal("100.00"), paid_amount=Decimal("0.00"),
+            claim_status=ClaimStatus.objects.create(name="Denied"), insurer=cls.aetna, discharge_date=date(2024, 1, 1),
+        )
+
+    def save(self, **changes):
+        data = {
+            "patient_name": "Patient 1", "discharge_date": "2024-01-01", "status": "Denied", "insurer_name": "Aetna",
+            "billed_amount": "100.00", "paid_amount": "0.00", **changes,
+        }
+        form = EditClaimForm(data, instance=Claim.objects.get(pk=self.claim.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def test_initial_names(self):
+        form = EditClaimForm(instance=self.claim)
+        self.assertEqual((form.fields["status"].initial, form.fields["insurer_name"].initial), ("Denied", "Aetna"))
+
+    def test_known_insurer_reuses_its_row(self):
+        Insurer.objects.create(name="Cigna")
+        claim = self.save(insurer_name="cigna")                                #capitalized like every name field
+        self.assertEqual(claim.insurer.name, "Cigna")
+        self.assertEqual(Insurer.objects.count(), 2)
+
+    def test_unknown_insurer_gets_a_new_row(self):
+        claim = self.save(insurer_name="Humana", status="Under Review")
+        self.assertEqual(Insurer.objects.count(), 2)
+        self.assertEqual(Claim.objects.get(pk=self.claim.pk).insurer, Insurer.objects.get(name="Humana"))
+        self.assertEqual(claim.claim_status, ClaimStatus.objects.get(name="Under Review"))
+
+
+#the report folds the stored summary rows, an empty table divides by nothing and costs no more queries than a full one
+class AdminDashboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def report(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin-dashboard/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)                                      #only the summary rows, the view never reads the session
+        return response.context
+
+    def test_empty_table(self):
+        context = self.report()
+        self.assertEqual((context["total_claims"], context["total_flags"]), (0, 0))
+        self.assertEqual((context["paid_percentage"], context["denied_percentage"]), (0.0, 0.0))
+        self.assertIsNone(context["avg_billed"])
+        self.assertIsNone(context["avg_paid"])
+        self.assertEqual((context["status_labels"], context["insurer_labels"]), ([], []))
+
+    def test_kpis_of_a_small_table(self):
+        paid = ClaimStatus.objects.create(name="Paid")
+        denied = ClaimStatus.objects.create(name="Denied")
+        review = ClaimStatus.objects.create(name="Under Review")
+        aetna = Insurer.objects.create(name="Aetna")
+        cigna = Insurer.objects.create(name="Cigna")
+        for claim_id, status, insurer, billed, paid_amount in (
+            (1, paid, aetna, "100.00", "90.00"),
+            (2, paid, cigna, "200.00", "150.00"),
+            (3, denied, aetna, "300.00", "0.00"),
+            (4, review, aetna, "400.00", "0.00"),
+        ):
+            claim = Claim.objects.create(
+                claim_id=claim_id, patient_name=f"Patient {claim_id}", billed_amount=Decimal(billed),
+                paid_amount=Decimal(paid_amount), claim_status=status, insurer=insurer, discharge_date=date(2024, 1, 1),
+            )
+        SystemFlag.objects.create(claim=claim, message="Check payment")
+        summary.rebuild()
+
+        context = self.report()
+        self.assertEqual((context["total_claims"], context["total_flags"]), (4, 1))
+        self.assertEqual((context["paid_percentage"], context["denied_percentage"]), (50.0, 25.0))
+        self.assertEqual(context["avg_billed"], Decimal("250.00"))
+        self.assertEqual(context["avg_paid"], Decimal("60.00"))
+        self.assertEqual(context["status_labels"], ["Denied", "Paid", "Under Review"])
+        self.assertEqual(context["status_counts"], [1, 2, 1])
+        self.assertEqual((context["insurer_labels"], context["insurer_counts"]), (["Aetna", "Cigna"], [3, 1]))
+        self.assertEqual(stats.dashboard_stats(), stats.live_dashboard_stats())
+
+
+#edits and flag changes keep the report summary equal to a full recount, which rebuild_summary --verify checks
+@mock.patch("claims.mirrors.submit_many")
+class SummaryDeltaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw")
+        paid = ClaimStatus.objects.create(name="Paid")
+        aetna = Insurer.objects.create(name="Aetna")
+        cls.claim = Claim.objects.create(
+            claim_id=1, patient_name="Patient 1", billed_amount=Decimal("100.00"), paid_amount=Decimal("90.00"),
+            claim_status=paid, insurer=aetna, discharge_date=date(2024, 1, 1),
+        )
+        Claim.objects.create(
+            claim_id=2, patient_name="Patient 2", billed_amount=Decimal("200.00"), paid_amount=Decimal("0.00"),
+            claim_status=ClaimStatus.objects.create(name="Denied"), insurer=aetna, discharge_date=date(2024, 1, 2),
+        )
+        ClaimDetail.objects.create(claim=cls.claim, cpt_codes="99213", denial_reason="Late filing")
+        summary.rebuild()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assert_summary_exact(self):
+        self.assertEqual(summary.stored_groups(), summary.live_groups())
+        out = StringIO()
+        call_command("rebuild_summary", "--verify", stdout=out)
+        self.assertIn("Summary matches", out.getvalue())
+
+    def edit(self, **changes):
+        data = {
+            "patient_name": "Patient 1", "discharge_date": "2024-01-01", "status": "Paid", "insurer_name": "Aetna",
+            "billed_amount": "100.00", "paid_amount": "90.00", "cpt_mode": "overwrite", "denial_mode": "overwrite",
+            **changes,
+        }
+        response = self.client.post(f"/claim/{self.claim.pk}/edit/", data)
+        self.assertContains(response, "Claim updated successfully!")
+        return response
+
+    def test_edit_moves_the_claim_between_groups(self, submit_many):
+        self.edit(status="Denied", insurer_name="Humana", billed_amount="150.00", paid_amount="0.00")
+        groups = summary.stored_groups()
+        self.assertEqual(groups[("Denied", "Humana")], (1, Decimal("150.00"), Decimal("0.00"), 0))
+        self.assertNotIn(("Paid", "Aetna"), groups)                             #emptied groups are removed
+        self.assert_summary_exact()
+        submit_many.assert_called_once()
+
+    def test_edit_of_amounts_only(self, submit_many):
+        self.edit(paid_amount="40.00")
+        self.assertEqual(summary.stored_groups()[("Paid", "Aetna")], (1, Decimal("100.00"), Decimal("40.00"), 0))
+        self.assert_summary_exact()
+
+    def test_edit_appends_or_overwrites_the_detail(self, submit_many):
+        self.edit(cpt_codes="99214", cpt_mode="append", denial_reason="missing modifier", denial_mode="append")
+        detail = ClaimDetail.objects.get(claim=self.claim)
+        self.assertEqual((detail.cpt_codes, detail.denial_reason), ("99213,99214", "Late filing. Missing modifier"))
+
+        self.edit(cpt_codes="80053", denial_reason="duplicate")
+        detail.refresh_from_db()
+        self.assertEqual((detail.cpt_codes, detail.denial_reason), ("80053", "Duplicate"))
+        self.assertEqual(detail.row_hash, "")
+
+    def test_flags_are_counted_once(self, submit_many):
+        self.client.post(f"/claim/{self.claim.pk}/add-flag/")
+        self.client.post(f"/claim/{self.claim.pk}/add-flag/")                   #already flagged, nothing added
+        self.assertEqual(summary.stored_groups()[("Paid", "Aetna")][3], 1)
+        self.assert_summary_exact()
+
+        self.client.post(f"/claim/{self.claim.pk}/remove-flag/")
+        self.client.post(f"/claim/{self.claim.pk}/remove-flag/")
+        self.assertEqual(summary.stored_groups()[("Paid", "Aetna")][3], 0)
+        self.assert_summary_exact()
+
+    def test_flag_then_edit(self, submit_many):
+        self.client.post(f"/claim/{self.claim.pk}/add-flag/")
+        self.edit(status="Denied")
+        self.assertEqual(summary.stored_groups()[("Denied", "Aetna")][3], 1)       #the flag moved with its claim
+        self.assert_summary_exact()
+
+    def test_verify_reports_drift(self, submit_many):
+        ClaimSummary.objects.filter(status="Paid", insurer_name="Aetna").update(claim_count=5)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_summary", "--verify", stdout=out)
+        self.assertIn("Paid / Aetna: stored 5 claims", out.getvalue())
+
+        call_command("rebuild_summary", stdout=StringIO())
+        self.assert_summary_exact()
+
+
+#load_claims --bulk upserts claims and details in batches, a rerun changes nothing and a repeated id keeps its last row
+@mock.patch("claims.mirrors.compact", return_value=0)          #the data folder's journal is not touched
+class BulkLoadTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = tmp_dir.name
+        write_data_file(self.dir, "claim_list_data_a.json", claim_rows((1, 2, 3)))
+        write_data_file(self.dir, "claim_list_data_b.json", claim_rows((4, 5), status="Denied", insurer_name="Cigna"))
+        write_data_file(self.dir, "claim_detail_data.json", detail_rows((1, 2, 3, 4, 5)))
+
+    def load(self, *args):
+        out = StringIO()
+        call_command("load_claims", self.dir, "--bulk", "--batch-size", "2", *args, stdout=out)      #batches split every shard
+        return out.getvalue()
+
+    def table(self):
+        return list(Claim.objects.order_by("claim_id").values_list(
+            "pk", "claim_id", "patient_name", "paid_amount", "claim_status__name", "insurer__name",
+        ))
+
+    def test_rows_lookups_and_summary(self, compact):
+        self.assertIn("10 rows from 3 files", self.load())
+        self.assertEqual(Claim.objects.count(), 5)
+        self.assertEqual(ClaimDetail.objects.count(), 5)
+        self.assertEqual(sorted(Insurer.objects.values_list("name", flat=True)), ["Aetna", "Cigna"])
+        self.assertEqual(sorted(ClaimStatus.objects.values_list("name", flat=True)), ["Denied", "Paid"])
+        self.assertEqual(ClaimDetail.objects.get(id=4).claim.claim_id, 4)
+        self.assertEqual(summary.stored_groups()[("Denied", "Cigna")], (2, Decimal("200.00"), Decimal("100.00"), 0))
+        self.assertEqual(summary.stored_groups(), summary.live_groups())
+
+    def test_rerun_is_idempotent(self, compact):
+        self.load()
+        table = self.table()
+        groups = summary.stored_groups()
+        self.load()
+        self.assertEqual(self.table(), table)                                   #same pks, no duplicates
+        self.assertEqual((ClaimDetail.objects.count(), Insurer.objects.count(), ClaimStatus.objects.count()), (5, 2, 2))
+        self.assertEqual(summary.stored_groups(), groups)
+
+    def test_existing_claims_are_updated_in_place(self, compact):
+        self.load()
+        pk = Claim.objects.get(claim_id=2).pk
+        write_data_file(self.dir, "claim_list_data_a.json", claim_rows((1, 3)) + claim_rows((2,), paid_amount=75.0, status="Denied"))
+        self.load()
+        claim = Claim.objects.get(claim_id=2)
+        self.assertEqual((claim.pk, claim.paid_amount, claim.status), (pk, Decimal("75.00"), "Denied"))
+        self.assertEqual(summary.stored_groups(), summary.live_groups())
+
+    def test_repeated_ids_keep_the_last_row(self, compact):
+        write_data_file(self.dir, "claim_list_data_b.json", claim_rows((4,)) + claim_rows((4,), patient_name="Renamed"))
+        write_data_file(
+            self.dir, "claim_detail_data.json",
+            detail_rows((1, 2)) + [{"id": 1, "claim_id": 2, "denial_reason": "Moved", "cpt_codes": "80053"}],
+        )
+        self.load()
+        self.assertEqual(Claim.objects.get(claim_id=4).patient_name, "Renamed")
+        detail = ClaimDetail.objects.get(id=1)
+        self.assertEqual((detail.claim.claim_id, detail.denial_reason), (2, "Moved"))
+
+    #shards parsed in worker processes give the same tables as the single process bulk load
+    def test_parallel_load(self, compact):
+        self.load()
+        table = [row[1:] for row in self.table()]
+        Claim.objects.all().delete()
+
+        self.assertIn("10 rows from 3 files", self.load("--workers", "2"))
+        self.assertEqual([row[1:] for row in self.table()], table)
+        self.assertEqual(ClaimDetail.objects.count(), 5)
+        self.assertEqual(summary.stored_groups(), summary.live_groups())
+
+    #a worker's parse error stops the load and nothing it wrote is kept
+    def test_parallel_load_of_a_malformed_shard(self, compact):
+        with open(os.path.join(self.dir, "claim_list_data_b.json"), "w", encoding="utf-8") as f:
+            f.write('[{"id": 4, "patient_name": "Patient 4",')
+        with self.assertRaisesRegex(CommandError, r"Failed to parse shard .*claim_list_data_b\.json"):
+            self.load("--workers", "2")
+        self.assertEqual(Claim.objects.count(), 0)
+
+    def test_details_of_unknown_claims_are_skipped(self, compact):
+        write_data_file(self.dir, "claim_detail_data.json", detail_rows((1, 99)))
+        self.assertIn("Claim ID 99 not found. Skipping.", self.load())
+        self.assertEqual(list(ClaimDetail.objects.values_list("id", flat=True)), [1])
+
+
+#the claims table must cost the same number of queries however many rows are on the page
+class ClaimsTableQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw")
+        denied = ClaimStatus.objects.create(name="Denied")
+        aetna = Insurer.objects.create(name="Aetna")
+        for i in range(1, 21):
+            claim = Claim.objects.create(
+                claim_id=i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.00"),
+                paid_amount=Decimal("0.00"),
+                claim_status=denied,
+                insurer=aetna,
+                discharge_date=date(2024, 1, 1),
+            )
+            if i % 2:
+                SystemFlag.objects.create(claim=claim, message="flagged")
+                Note.objects.create(claim=claim, text="note", created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        fragments.invalidate()
+        self.client.force_login(self.user)
+        self.client.get("/")            #fills the facet cache so only the table queries are counted
+
+    def count_queries(self, per_page, **headers):
+        with mock.patch.object(views, "CLAIMS_PER_PAGE", per_page):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get("/", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_table_fragment_is_constant_in_page_size(self):
+        small = self.count_queries(1, HX_Request="true")
+        large = self.count_queries(20, HX_Request="true")
+        self.assertEqual(small, large)
+
+    def test_full_page_is_constant_in_page_size(self):
+        self.assertEqual(self.count_queries(1), self.count_queries(20))
+
+    def test_table_fragment_query_count(self):
+        #session, user, and the page of claims with its flag and note annotations
+        with self.assertNumQueries(3):
+            self.client.get("/", headers={"HX-Request": "true"})
+
+    def test_icons_follow_annotations(self):
+        with mock.patch.object(views, "CLAIMS_PER_PAGE", 20):
+            response = self.client.get("/", headers={"HX-Request": "true"})
+        rows = list(response.context["claims"])
+        self.assertEqual([c.has_flags for c in rows], [bool(c.claim_id % 2) for c in rows])
+        self.assertEqual([c.has_notes for c in rows], [bool(c.claim_id % 2) for c in rows])
+
+
+#cached dropdown counts follow edits in place and are recounted by every process after a bulk change
+class FacetCacheTests(ClaimFixtureTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_edits_adjust_the_cached_counts(self):
+        self.assertEqual(facets.get_facets()["statuses"], [("Denied", 1)])
+        facets.adjust({"status": ("Denied", "Paid")})
+        self.assertEqual(facets.get_facets()["statuses"], [("Paid", 1)])
+
+    def test_bulk_changes_are_seen_without_clearing_the_cache(self):
+        self.assertEqual(facets.get_facets()["insurers"], [("Aetna", 1)])
+        Claim.objects.create(
+            claim_id=8, patient_name="Patient 8", billed_amount=Decimal("100.00"), paid_amount=Decimal("0.00"),
+            claim_status=self.denied, insurer=Insurer.objects.create(name="Cigna"), discharge_date=date(2024, 1, 1),
+        )
+        with mock.patch.object(cache, "delete") as delete:        #as from load_claims in another process, this cache is untouched
+            facets.invalidate()
+        delete.assert_not_called()
+        self.assertEqual(facets.get_facets()["insurers"], [("Aetna", 1), ("Cigna", 1)])
+
+
+#records (sql, params) of every query run inside the block, before parameters are interpolated
+class QueryRecorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.wrapper.__exit__(*exc)
+
+    #queries that read from the claims table
+    def claim_queries(self):
+        return [(sql, params) for sql, params in self.queries if re.search(r'FROM "claims_claim"', sql)]
+
+#hot claims queries must be answered from an index, a regression to a full table scan or an extra sort step fails the test
+#each backend subclass turns EXPLAIN output into (step, table) pairs and says what counts as a full scan or a sort
+class QueryPlanTestsMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="planner", password="pw")
+        statuses = [ClaimStatus.objects.create(name=name) for name in ("Paid", "Denied", "Under Review")]
+        insurers = [Insurer.objects.create(name=name) for name in ("Aetna", "Cigna", "Blue Cross")]
+        for i in range(1, 61):
+            claim = Claim.objects.create(
+                claim_id=i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.00"),
+                paid_amount=Decimal("10.00"),
+                claim_status=statuses[i % 3],
+                insurer=insurers[i % 2],
+                discharge_date=date(2024, 1, 1),
+            )
+            if i % 5 == 0:
+                SystemFlag.objects.create(claim=claim, message="flagged")
+
+    def setUp(self):
+        cache.clear()
+        fragments.invalidate()
+        self.client.force_login(self.user)
+
+    #the claims page query run by home for the given GET parameters
+    def page_query(self, **params):
+        with QueryRecorder() as recorder:
+            self.client.get("/", params, headers={"HX-Request": "true"})
+        pages = [(sql, p) for sql, p in recorder.claim_queries() if "LIMIT" in sql]
+        self.assertEqual(len(pages), 1, pages)
+        return pages[0]
+
+    def assert_indexed_page(self, query):
+        plan = self.plan(*query)
+        self.assertFalse(self.full_scans(plan, "claims_claim"), plan)
+        self.assertFalse(self.sorts(plan), plan)                    #rows must come out of the index in id order
+
+    def test_insurer_filter_page(self):
+        self.assert_indexed_page(self.page_query(insurer="Cigna"))
+
+    def test_status_filter_page(self):
+        self.assert_indexed_page(self.page_query(status="Denied"))
+
+    def test_insurer_and_status_filter_page(self):
+        self.assert_indexed_page(self.page_query(insurer="Aetna", status="Paid"))
+
+    def test_next_page_seeks_past_cursor(self):
+        first = self.client.get("/", {"status": "Denied"}, headers={"HX-Request": "true"})
+        cursor = first.context["claims"].next_cursor()
+        self.assert_indexed_page(self.page_query(cursor=cursor))
+        self.assert_indexed_page(self.page_query(cursor=cursor, status="Denied"))
+
+    def test_flag_and_note_lookups_use_claim_index(self):
+        plan = self.plan(*self.page_query(status="Paid"))
+        self.assertFalse(self.full_scans(plan, "claims_systemflag"), plan)
+        self.assertFalse(self.full_scans(plan, "claims_note"), plan)
+
+    #GROUP BY over every claim reads an index in group order instead of sorting the table
+    def assert_grouped_from_index(self, run):
+        with QueryRecorder() as recorder:
+            run()
+        grouped = [q for q in recorder.claim_queries() if "GROUP BY" in q[0]]
+        self.assertTrue(grouped)
+        for query in grouped:
+            plan = self.plan(*query)
+            self.assertFalse(self.full_scans(plan, "claims_claim"), plan)
+            self.assertFalse(self.sorts(plan), plan)
+
+    def test_facet_counts_group_by_index(self):
+        self.assert_grouped_from_index(facets.build_facets)
+
+    def test_summary_rebuild_groups_by_index(self):
+        self.assert_grouped_from_index(summary.live_groups)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite query plans")
+class SQLiteQueryPlanTests(QueryPlanTestsMixin, TestCase):
+
+    #EXPLAIN QUERY PLAN detail lines, e.g. "SEARCH claims_claim USING INDEX claim_status_page_idx (claim_status_id=?)"
+    #subquery aliases such as U0 are replaced with their table names
+    def plan(self, sql, params):
+        aliases = {alias: table for table, alias in re.findall(r'"(\w+)" (U\d+)', sql)}
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            lines = [row[3] for row in cursor.fetchall()]
+        return [re.sub(r"\bU\d+\b", lambda m: aliases.get(m.group(), m.group()), line) for line in lines]
+
+    #"SCAN table" with no index reads every row of the table, "SCAN table USING INDEX" reads an index in order
+    def full_scans(self, plan, table):
+        return [line for line in plan if line == f"SCAN {table}"]
+
+    def sorts(self, plan):
+        return [line for line in plan if "TEMP B-TREE" in line]
+
+
+@skipUnless(connection.vendor == "postgresql", "Postgres query plans")
+class PostgresQueryPlanTests(QueryPlanTestsMixin, TestCase):
+
+    #plan nodes as (node type, relation), sequential scans are disabled so any usable index is chosen on the tiny test tables
+    def plan(self, sql, params):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            document = cursor.fetchone()[0]
+        if isinstance(document, str):
+            document = json.loads(document)
+
+        nodes = []
+        def walk(node):
+            nodes.append((node["Node Type"], node.get("Relation Name")))
+            for child in node.get("Plans", []):
+                walk(child)
+        walk(document[0]["Plan"])
+        return nodes
+
+    def full_scans(self, plan, table):
+        return [node for node in plan if node == ("Seq Scan", table)]
+
+    def sorts(self, plan):
+        return [node for node in plan if node[0] in ("Sort", "Incremental Sort")]
+
+
+#the profiling middleware records every view and reports repeated SQL
+class ProfilingMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="staff", password="pw", is_staff=True)
+        cls.reviewer = User.objects.create_user(username="reviewer", password="pw")
+        claim = Claim.objects.create(
+            claim_id=1,
+            patient_name="Patient 1",
+            billed_amount=Decimal("100.00"),
+            paid_amount=Decimal("0.00"),
+            claim_status=ClaimStatus.objects.create(name="Denied"),
+            insurer=Insurer.objects.create(name="Aetna"),
+            discharge_date=date(2024, 1, 1),
+        )
+        cls.claim = claim
+
+    def setUp(self):
+        profiling.store.reset()
+
+    def test_views_are_recorded_by_url_name(self):
+        self.client.force_login(self.staff)
+        self.client.get(f"/claim/{self.claim.pk}/flags/")
+        self.client.get(f"/claim/{self.claim.pk}/flags/")
+        stats = self.client.get("/profiling/stats/").json()["views"]
+        flags = stats["flag_partial"]
+        self.assertEqual(flags["requests"], 2)
+        self.assertEqual(sum(flags["histogram_ms"].values()), 2)
+        self.assertGreater(flags["mean_queries"], 0)
+        self.assertEqual(flags["suspected_n_plus_one"], 0)
+
+    def test_server_timing_header_for_staff_only(self):
+        self.client.force_login(self.staff)
+        timing = self.client.get("/", headers={"HX-Request": "true"})["Server-Timing"]       #login_required loads the user
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+$')
+        self.assertNotIn("Server-Timing", self.client.get(f"/claim/{self.claim.pk}/flags/"))           #never reads the user
+
+        self.client.force_login(self.reviewer)
+        with self.settings(DEBUG=False):
+            self.assertNotIn("Server-Timing", self.client.get("/", headers={"HX-Request": "true"}))
+
+    #the async views query through sync_to_async on another thread, those queries count too
+    async def test_async_views_count_their_queries(self):
+        await self.async_client.aforce_login(self.staff)
+        for path in ("/", f"/claim/{self.claim.pk}/panel/"):
+            with self.subTest(path=path), self.settings(DEBUG=True):        #the panel never reads the user
+                timing = (await self.async_client.get(path, headers={"HX-Request": "true"}))["Server-Timing"]
+                queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+                self.assertGreater(queries, 0)
+
+    def test_queries_outside_a_request_are_not_recorded(self):
+        self.assertIn(profiling.record_query, connection.execute_wrappers)
+        with mock.patch.object(profiling.RequestProfile, "record_query") as record:
+            Claim.objects.count()
+        record.assert_not_called()
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.force_login(self.reviewer)
+        self.assertEqual(self.client.get("/profiling/stats/").status_code, 302)
+
+    def test_repeated_sql_is_reported(self):
+        profile = profiling.RequestProfile()
+        with connection.execute_wrapper(profile.record_query):
+            for claim_id in (1, 2, 3):
+                list(Claim.objects.filter(claim_id=claim_id))
+            Claim.objects.count()
+        repeated = profile.repeated_statements(3)
+        self.assertEqual(len(repeated), 1)
+        self.assertIn("claim_id", repeated[0][0])
+        self.assertEqual(repeated[0][1], 3)
+        self.assertEqual(profile.query_count, 4)
+
+    def test_repeated_sql_is_logged_at_debug_level_and_truncated(self):
+        profile = profiling.RequestProfile()
+        profile.statements["SELECT " + "x" * 1000] = 5
+        middleware = profiling.ProfilingMiddleware(lambda request: HttpResponse())
+        with self.assertLogs("claims.profiling", "DEBUG") as logs:
+            middleware.report(RequestFactory().get("/"), HttpResponse(), profile, 0.01, None)
+        self.assertEqual([record.levelname for record in logs.records], ["DEBUG"])
+        self.assertLess(len(logs.records[0].getMessage()), profiling.LOGGED_SQL_LENGTH + 100)
+
+    def test_user_is_only_read_once_the_request_loaded_it(self):
+        request = RequestFactory().get("/")
+        request.user = SimpleLazyObject(mock.Mock(side_effect=AssertionError("the profiler loaded the user")))
+        self.assertIsNone(profiling.loaded_user(request))
+
+        request.user = SimpleLazyObject(lambda: self.staff)
+        request.user.is_staff                                               #read by the view
+        self.assertEqual(profiling.loaded_user(request), self.staff)
+        request._acached_user = self.reviewer                                #loaded by request.auser()
+        self.assertEqual(profiling.loaded_user(request), self.reviewer)
+
+
+#bulk edits change every targeted claim, keep the report summary exact and reach the mirrors in one call
+@mock.patch("claims.bulk.mirrors.submit_many")
+class BulkEditTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw")
+        denied = ClaimStatus.objects.create(name="Denied")
+        paid = ClaimStatus.objects.create(name="Paid")
+        aetna = Insurer.objects.create(name="Aetna")
+        cigna = Insurer.objects.create(name="Cigna")
+        for i in range(1, 7):
+            claim = Claim.objects.create(
+                claim_id=i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.00"),
+                paid_amount=Decimal("10.00"),
+                claim_status=denied if i <= 4 else paid,
+                insurer=aetna if i % 2 else cigna,
+                discharge_date=date(2024, 1, 1),
+            )
+            ClaimDetail.objects.create(claim=claim, cpt_codes="99213" if i != 1 else "", denial_reason="Late")
+            if i == 1:
+                SystemFlag.objects.create(claim=claim, message="flagged")
+        summary.rebuild()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, **data):
+        data.setdefault("cpt_mode", "overwrite")
+        data.setdefault("denial_mode", "overwrite")
+        return self.client.post("/claims/bulk-edit/", data)
+
+    def test_selected_claims_change_status(self, submit_many):
+        pks = list(Claim.objects.filter(claim_id__in=[1, 2]).values_list("pk", flat=True))
+        response = self.post(scope="selected", claim_ids=pks, status="paid")
+        self.assertContains(response, "Updated 2 claims.")
+        self.assertEqual(
+            dict(Claim.objects.values_list("claim_id", "claim_status__name")),
+            {1: "Paid", 2: "Paid", 3: "Denied", 4: "Denied", 5: "Paid", 6: "Paid"},
+        )
+        self.assertEqual(summary.mismatches(), [])
+        submit_many.assert_called_once()
+        self.assertEqual(sorted(claim.claim_id for claim, _ in submit_many.call_args[0][0]), [1, 2])
+
+    def test_filter_scope_appends_to_matching_claims(self, submit_many):
+        response = self.post(
+            scope="filter", filter_insurer="Aetna", filter_status="Denied",
+            cpt_codes="80053", cpt_mode="append", denial_reason="needs records", denial_mode="append",
+        )
+        self.assertContains(response, "Updated 2 claims.")
+        details = {d.claim.claim_id: (d.cpt_codes, d.denial_reason) for d in ClaimDetail.objects.select_related("claim")}
+        self.assertEqual(details[1], ("80053", "Late. Needs records"))       #empty codes are set, not appended to
+        self.assertEqual(details[3], ("99213,80053", "Late. Needs records"))
+        self.assertEqual(details[2], ("99213", "Late"))
+        self.assertEqual(ClaimDetail.objects.filter(row_hash="").count(), 6)
+
+    def test_insurer_change_moves_flags_in_summary(self, submit_many):
+        self.post(scope="filter", filter_insurer="Aetna", insurer_name="united healthcare")
+        self.assertFalse(Claim.objects.filter(insurer__name="Aetna").exists())
+        self.assertEqual(summary.mismatches(), [])
+        self.assertEqual(summary.stored_groups()[("Denied", "United Healthcare")][3], 1)
+
+    def test_nothing_to_change_is_rejected(self, submit_many):
+        pk = Claim.objects.get(claim_id=1).pk
+        response = self.post(scope="selected", claim_ids=[pk])
+        self.assertContains(response, "Enter at least one change.")
+        response = self.post(scope="selected", status="Paid")
+        self.assertContains(response, "Select at least one claim in the table.")
+        submit_many.assert_not_called()
+
+
+#the rule engine flags claims below their threshold, clears flags that no longer apply and leaves manual flags alone
+class UnderpaymentRuleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        paid = ClaimStatus.objects.create(name="Paid")
+        denied = ClaimStatus.objects.create(name="Denied")
+        aetna = Insurer.objects.create(name="Aetna")
+        cigna = Insurer.objects.create(name="Cigna")
+        rows = [
+            #claim id, status, insurer, paid per 100 billed, cpt codes
+            (1, paid, aetna, 95, "99213"),
+            (2, paid, aetna, 80, "99213"),
+            (3, paid, cigna, 80, "99213"),
+            (4, paid, cigna, 92, "99213, 80053"),
+            (5, denied, aetna, 0, "99213"),
+        ]
+        for claim_id, status, insurer, paid_amount, codes in rows:
+            claim = Claim.objects.create(
+                claim_id=claim_id,
+                patient_name=f"Patient {claim_id}",
+                billed_amount=Decimal("100.00"),
+                paid_amount=Decimal(paid_amount),
+                claim_status=status,
+                insurer=insurer,
+                discharge_date=date(2024, 1, 1),
+            )
+            ClaimDetail.objects.create(claim=claim, cpt_codes=codes, denial_reason="N/A")
+        SystemFlag.objects.create(claim=Claim.objects.get(claim_id=5), message=SystemFlag.MANUAL_MESSAGE)
+        summary.rebuild()
+
+    def flagged(self):
+        return sorted(SystemFlag.objects.filter(source=SystemFlag.RULE).values_list("claim__claim_id", flat=True))
+
+    def test_default_threshold(self):
+        result = underpayment.flag_underpayments(underpayment.Rules(min_ratio=0.85), batch_size=2)   #several keyset batches
+        self.assertEqual((result.checked, result.flagged, result.created, result.deleted), (4, 2, 2, 0))
+        self.assertEqual(self.flagged(), [2, 3])
+        self.assertEqual(
+            SystemFlag.objects.get(claim__claim_id=2, source=SystemFlag.RULE).message,
+            "Paid 80.0% of billed, below the 85% threshold for all insurers - review recommended.",
+        )
+        self.assertEqual(summary.mismatches(), [])
+
+    def test_insurer_and_cpt_thresholds(self):
+        rules = underpayment.Rules(min_ratio=0.85, insurer_ratios={"Cigna": 0.75}, cpt_ratios={"80053": 0.95})
+        underpayment.flag_underpayments(rules)
+        self.assertEqual(self.flagged(), [2, 4])
+        self.assertIn("threshold for CPT 80053", SystemFlag.objects.get(claim__claim_id=4, source=SystemFlag.RULE).message)
+
+    def test_rerun_clears_only_stale_rule_flags(self):
+        underpayment.flag_underpayments(underpayment.Rules(min_ratio=0.85))
+        again = underpayment.flag_underpayments(underpayment.Rules(min_ratio=0.85))
+        self.assertEqual((again.created, again.deleted), (0, 0))
+
+        lower = underpayment.flag_underpayments(underpayment.Rules(min_ratio=0.5))
+        self.assertEqual((lower.flagged, lower.created, lower.deleted), (0, 0, 2))
+        self.assertEqual(self.flagged(), [])
+        self.assertTrue(SystemFlag.objects.filter(source=SystemFlag.MANUAL, claim__claim_id=5).exists())
+        self.assertEqual(summary.mismatches(), [])
+
+    def test_dry_run_writes_nothing(self):
+        result = underpayment.flag_underpayments(underpayment.Rules(min_ratio=0.85), dry_run=True)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(self.flagged(), [])
+
+    def test_unknown_rule_setting_is_rejected(self):
+        with self.assertRaises(ValueError):
+            underpayment.Rules.from_dict({"min_ratio": 0.8, "ratio": 0.9})
+
+
+#exports stream every claim matching the table filters with its first detail
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reviewer", password="pw")
+        denied = ClaimStatus.objects.create(name="Denied")
+        paid = ClaimStatus.objects.create(name="Paid")
+        aetna = Insurer.objects.create(name="Aetna")
+        for i in range(1, 6):
+            claim = Claim.objects.create(
+                claim_id=i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.50"),
+                paid_amount=Decimal("0.00"),
+                claim_status=denied if i % 2 else paid,
+                insurer=aetna,
+                discharge_date=date(2024, 1, i),
+            )
+            if i != 5:
+                ClaimDetail.objects.create(claim=claim, cpt_codes=f"9921{i}", denial_reason="Late")
+        ClaimDetail.objects.create(claim=Claim.objects.get(claim_id=1), cpt_codes="00000", denial_reason="Second detail")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def download(self, **params):
+        response = self.client.get("/claims/export/", params)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_follows_filters(self):
+        lines = self.download(format="csv", status="Denied").splitlines()
+        self.assertEqual(lines[0], "|".join(export.COLUMNS))
+        self.assertEqual(lines[1], "1|Patient 1|100.50|0.00|Denied|Aetna|2024-01-01|Late|99211")
+        self.assertEqual([line.split("|")[0] for line in lines[1:]], ["1", "3", "5"])
+        self.assertTrue(lines[3].endswith("|Denied|Aetna|2024-01-05||"))      #claim without a detail
+
+    def test_json_is_an_array_of_claims(self):
+        items = json.loads(self.download(format="json", q="2"))
+        self.assertEqual(items, [{
+            "id": 2, "patient_name": "Patient 2", "billed_amount": 100.5, "paid_amount": 0.0, "status": "Paid",
+            "insurer_name": "Aetna", "discharge_date": "2024-01-02", "denial_reason": "Late", "cpt_codes": "99212",
+        }])
+
+    def test_rows_are_read_in_chunks(self):
+        with CaptureQueriesContext(connection) as ctx:
+            list(export.export_rows(Q(), chunk_size=2))
+        self.assertEqual(len(ctx.captured_queries), 1)       #one query, fetched from its cursor in chunks
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.client.get("/claims/export/", {"format": "xml"}).status_code, 400)
+
+
+#benchmark_claims prints a JSON report and nothing else, so its output can be piped into other tools
+@mock.patch("claims.mirrors.sync_worker", mirrors.MirrorSyncWorker())      #no flush thread left behind by the timed edits
+class BenchmarkClaimsTests(TestCase):
+
+    def test_stdout_is_the_json_report(self):
+        from claims.management.commands.benchmark_claims import Command
+
+        #runs the benchmarks in the test database instead of creating one of its own
+        def run_in_test_database(command, tmp_dir, data_dir, options):
+            return command.run_benchmarks(data_dir, options)
+
+        out = StringIO()
+        with mock.patch.object(Command, "run_in_test_database", run_in_test_database), redirect_stdout(out):
+            call_command("benchmark_claims", "--rows", "20", "--repeat", "2")      #views print to sys.stdout, not to the command's stdout
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["rows"], 20)
+        self.assertEqual(report["results"]["edit_claim"]["status"], 200)
+        self.assertEqual(report["results"]["edit_claim"]["samples"], 2)
+
+
+#dump_claims writes the tables in the data file layout, including claims that were never in the files
+class DumpTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        status = ClaimStatus.objects.create(name="Paid")
+        insurer = Insurer.objects.create(name="Aetna")
+        for i in (2, 1):
+            claim = Claim.objects.create(
+                claim_id=30000 + i,
+                patient_name=f"Patient {i}",
+                billed_amount=Decimal("100.50"),
+                paid_amount=Decimal("90"),
+                claim_status=status,
+                insurer=insurer,
+                discharge_date=date(2024, 1, i),
+            )
+            ClaimDetail.objects.create(claim=claim, cpt_codes="99213,80053", denial_reason=None)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.out_dir = tmp.name
+
+    def read(self, name, opener=open):
+        with opener(os.path.join(self.out_dir, name), "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def test_json_and_csv_snapshot(self):
+        counts, paths = dump.dump(self.out_dir, chunk_size=1)
+        self.assertEqual(counts, {"claims": 2, "details": 2})
+        self.assertEqual(len(paths), 4)
+
+        claims = json.loads(self.read("claim_list_data.json"))
+        self.assertEqual([c["id"] for c in claims], [30001, 30002])          #claim id order
+        self.assertEqual(claims[0], {
+            "id": 30001, "patient_name": "Patient 1", "billed_amount": 100.5, "paid_amount": 90.0,
+            "status": "Paid", "insurer_name": "Aetna", "discharge_date": "2024-01-01",
+        })
+        self.assertEqual(
+            self.read("claim_detail_data.csv").splitlines()[:2],
+            ["id|claim_id|denial_reason|cpt_codes", f"{ClaimDetail.objects.order_by('id')[0].id}|30002||99213,80053"],
+        )
+        self.assertEqual(self.read("claim_list_data.csv").splitlines()[1], "30001|Patient 1|100.50|90.00|Paid|Aetna|2024-01-01")
+        self.assertEqual(os.stat(paths[0]).st_mode & 0o777, 0o644)
+
+    def test_gzip_single_format(self):
+        _, paths = dump.dump(self.out_dir, formats=("csv",), compress=True)
+        self.assertEqual(sorted(os.path.basename(p) for p in paths), ["claim_detail_data.csv.gz", "claim_list_data.csv.gz"])
+        self.assertEqual(self.read("claim_list_data.csv.gz", gzip.open).count("\n"), 3)
+        self.assertEqual(sorted(os.listdir(self.out_dir)), ["claim_detail_data.csv.gz", "claim_list_data.csv.gz"])   #no temporary files left
+
+
+#the view button's combined panel renders all four fragments from one request
+class ClaimPanelTests(ClaimFixtureTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(3):
+            Note.objects.create(claim=cls.claim, text=f"Note {i}", created_by=cls.user)
+        SystemFlag.objects.create(claim=cls.claim, message="Check payment")
+
+    def setUp(self):
+        fragments.invalidate()
+        self.client.force_login(self.user)
+
+    def test_renders_all_panels(self):
+        content = self.client.get(f"/claim/{self.claim.pk}/panel/").content.decode()
+        self.assertIn("Claim Details - 7", content)
+        self.assertIn("Late filing", content)
+        self.assertEqual(content.count("Ada Lovelace"), 3)
+        self.assertIn("Check payment", content)
+        self.assertIn("Remove Flag", content)
+        for panel in ("notes-panel", "flag-panel", "quick-actions-panel"):
+            self.assertIn(f'<div id="{panel}" hx-swap-oob="innerHTML">', content)
+
+    def test_query_count_does_not_grow_with_notes(self):
+        #ETag version, claim with its lookups, details, notes with their authors, flags
+        with self.assertNumQueries(5):
+            self.client.get(f"/claim/{self.claim.pk}/panel/")
+
+    def test_unknown_claim(self):
+        self.assertEqual(self.client.get("/claim/999999/panel/").status_code, 404)
+
+
+
+#the claim as the next load after clear_table writes it, with the same pk since the ids were reset and the load's version
+def reload_claim(claim, **changes):
+    values = {field.attname: getattr(claim, field.attname) for field in Claim._meta.concrete_fields}
+    values.update(changes, version=fragments.load_version())
+    return Claim.objects.create(**values)
+
+
+#rendered table rows and detail panels are reused until the claim's version changes
+class FragmentCacheTests(ClaimFixtureTestCase):
+
+    def setUp(self):
+        fragments.invalidate()
+        self.client.force_login(self.user)
+
+    def table(self):
+        return self.client.get("/", headers={"HX-Request": "true"}).content.decode()
+
+    def version(self):
+        return Claim.objects.get(pk=self.claim.pk).version
+
+    def test_rows_are_reused_until_the_version_changes(self):
+        self.table()
+        Claim.objects.filter(pk=self.claim.pk).update(patient_name="Renamed")     #written behind the cache's back
+        self.assertIn("Patient 7", self.table())
+
+        fragments.bump([self.claim.pk])
+        self.assertIn("Renamed", self.table())
+
+    def test_flags_and_notes_bump_the_version(self):
+        self.assertNotIn("M3 3v1.5", self.table())                               #flag icon
+        self.client.post(f"/claim/{self.claim.pk}/add-flag/")
+        self.assertEqual(self.version(), 2)
+        self.assertIn("M3 3v1.5", self.table())
+
+        self.client.post(f"/claim/{self.claim.pk}/add-note/", {"text": "Called insurer"})
+        self.client.post(f"/claim/{self.claim.pk}/remove-flag/")
+        self.assertEqual(self.version(), 4)
+        self.assertNotIn("M3 3v1.5", self.table())
+
+    def test_detail_edits_render_the_panel_again(self):
+        self.assertIn("Late filing", self.client.get(f"/claim/{self.claim.pk}/details/").content.decode())
+        with mock.patch("claims.mirrors.submit_many"):
+            bulk.bulk_edit([self.claim.pk], denial_reason="Duplicate claim")
+        self.assertIn("Duplicate claim", self.client.get(f"/claim/{self.claim.pk}/details/").content.decode())
+
+    def test_edit_leaves_the_saved_version_on_the_claim(self):
+        data = {
+            "patient_name": "Patient 7", "discharge_date": "2024-01-01", "status": "Denied", "insurer_name": "Aetna",
+            "billed_amount": "100.00", "paid_amount": "20.00", "cpt_mode": "overwrite", "denial_mode": "overwrite",
+        }
+        with mock.patch("claims.mirrors.submit_many"):
+            response = self.client.post(f"/claim/{self.claim.pk}/edit/", data)
+        self.assertEqual(response.context["claim"].version, 2)                 #a number, not the F() expression of the UPDATE
+        self.assertEqual(self.version(), 2)
+
+    #the original load path stamps the claims of the loaded details in one batched UPDATE, not one per detail
+    @mock.patch("claims.mirrors.compact", return_value=0)
+    def test_detail_load_stamps_claims_in_one_update(self, compact):
+        with tempfile.TemporaryDirectory() as directory:
+            write_data_file(directory, "claim_list_data.json", claim_rows((8, 9)))
+            write_data_file(directory, "claim_detail_data.json", detail_rows((7, 8, 9)))
+            with CaptureQueriesContext(connection) as queries:
+                call_command("load_claims", directory, stdout=StringIO())
+
+        stamps = [query["sql"] for query in queries if re.match(r'UPDATE "claims_claim" SET "version"', query["sql"])]
+        self.assertEqual(len(stamps), 1)
+        self.assertEqual(self.version(), fragments.load_version() - 1)          #claim 7 was only in the detail file
+
+    def test_load_version_is_above_every_claim(self):
+        fragments.bump([self.claim.pk])
+        self.assertEqual(fragments.load_version(), 3)
+
+    def test_cleared_and_reloaded_claims_are_rendered_again(self):
+        self.assertIn("Patient 7", self.table())
+        call_command("clear_table", "claims.Claim", stdout=StringIO())      #another process, this one's cache is not cleared
+        reload_claim(self.claim, patient_name="Patient 8")
+        self.assertIn("Patient 8", self.table())
+
+    def test_cleared_details_render_the_panel_again(self):
+        self.assertIn("Late filing", self.client.get(f"/claim/{self.claim.pk}/details/").content.decode())
+        call_command("clear_table", "claims.ClaimDetail", stdout=StringIO())
+        self.assertNotIn("Late filing", self.client.get(f"/claim/{self.claim.pk}/details/").content.decode())
+
+    def test_file_cache_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_cache = fragments.LRUFileBasedCache(directory, {"OPTIONS": {"MAX_ENTRIES": 3}})
+            for age, key in enumerate("abc"):
+                file_cache.set(key, key)
+                os.utime(file_cache._key_to_file(key), (1000 + age, 1000 + age))
+            self.assertEqual(file_cache.get("a"), "a")                          #now the most recently used
+            file_cache.set("d", "d")                                           #full, the oldest third is culled first
+            self.assertIsNone(file_cache.get("b"))
+            self.assertEqual([file_cache.get(key) for key in "acd"], ["a", "c", "d"])
+
+
+#unchanged table pages and claim partials are answered with an empty 304
+class ConditionalGetTests(ClaimFixtureTestCase):
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    #without a configured salt every worker of a release derives the same one, a new SECRET_KEY or release changes it
+    def test_default_salt_is_the_same_in_every_worker(self):
+        self.addCleanup(etags.release_salt.cache_clear)
+        with self.settings(CLAIM_ETAG_SALT=None):
+            etag = etags.make_etag("panel", 1, 1)
+            etags.release_salt.cache_clear()                                   #a second worker process
+            self.assertEqual(etags.make_etag("panel", 1, 1), etag)
+
+            etags.release_salt.cache_clear()
+            with self.settings(SECRET_KEY="another key"):
+                self.assertNotEqual(etags.make_etag("panel", 1, 1), etag)
+
+    def test_claim_partial_revalidates_until_the_claim_changes(self):
+        url = f"/claim/{self.claim.pk}/flags/"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("HX-Request", response["Vary"])
+
+        not_modified = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(not_modified["ETag"], etag)
+
+        self.client.post(f"/claim/{self.claim.pk}/add-flag/")
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_partials_of_one_claim_have_different_etags(self):
+        etags = {self.client.get(f"/claim/{self.claim.pk}/{name}/")["ETag"] for name in ("details", "notes", "flags", "actions")}
+        self.assertEqual(len(etags), 4)
+
+    def test_unknown_claim(self):
+        self.assertEqual(self.client.get("/claim/999999/details/").status_code, 404)
+
+    def test_table_page_revalidates_until_a_row_changes(self):
+        headers = {"HX-Request": "true"}
+        etag = self.client.get("/", {"status": "Denied"}, headers=headers)["ETag"]
+        with self.assertNumQueries(3):          #session, user, the page rows, nothing is rendered
+            response = self.client.get("/", {"status": "Denied"}, headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get("/", {"status": "Paid"}, headers=headers)["ETag"], etag)
+
+        fragments.bump([self.claim.pk])
+        self.assertEqual(self.client.get("/", {"status": "Denied"}, headers={**headers, "If-None-Match": etag}).status_code, 200)
+
+    def test_cleared_and_reloaded_claims_are_sent_again(self):
+        headers = {"HX-Request": "true"}
+        table_etag = self.client.get("/", headers=headers)["ETag"]
+        flags_etag = self.client.get(f"/claim/{self.claim.pk}/flags/")["ETag"]
+        call_command("clear_table", "claims.Claim", stdout=StringIO())
+        reload_claim(self.claim, patient_name="Patient 8")
+
+        response = self.client.get("/", headers={**headers, "If-None-Match": table_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Patient 8")
+        self.assertEqual(self.client.get(f"/claim/{self.claim.pk}/flags/", headers={"If-None-Match": flags_etag}).status_code, 200)
+
+    def test_full_page_is_not_revalidated(self):
+        response = self.client.get("/")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertIn("HX-Request", response["Vary"])
+
+
+#the read-only views run through the async middleware chain as they would under ASGI, without querying from a template
+class AsyncViewTests(ClaimFixtureTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Note.objects.create(claim=cls.claim, text="Called insurer", created_by=cls.user)
+        SystemFlag.objects.create(claim=cls.claim, message="Check payment")
+
+    def setUp(self):
+        cache.clear()
+        fragments.invalidate()
+
+    async def test_home_and_partials(self):
+        await self.async_client.aforce_login(self.user)
+        expected = {
+            "/": "Welcome, Ada Lovelace",
+            f"/claim/{self.claim.pk}/panel/": "Remove Flag",
+            f"/claim/{self.claim.pk}/details/": "Late filing",
+            f"/claim/{self.claim.pk}/notes/": "Called insurer",
+            f"/claim/{self.claim.pk}/flags/": "Check payment",
+            f"/claim/{self.claim.pk}/actions/": "Remove Flag",
+        }
+        for url, text in expected.items():
+            response = await self.async_client.get(url)
+            self.assertContains(response, text)
+
+        response = await self.async_client.get("/", {"status": "Denied"}, headers={"HX-Request": "true"})
+        self.assertContains(response, "Patient 7")
+        self.assertEqual((await self.async_client.get("/claim/999999/flags/")).status_code, 404)
+
+    async def test_search_on_a_cold_process(self):
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(search, "_fts_available", None):            #the FTS check has not run in this process yet
+            response = await self.async_client.get("/", {"q": "patient"}, headers={"HX-Request": "true"})
+        self.assertContains(response, "Patient 7")
+
+    async def test_offset_pages(self):
+        await self.async_client.aforce_login(self.user)
+        with self.settings(CLAIMS_PAGINATION="offset"):
+            response = await self.async_client.get("/", {"page": 1}, headers={"HX-Request": "true"})
+        self.assertContains(response, "Patient 7")
+
+
+#the tuned profile's connection pragmas and the bulk-load pragmas of load_claims, on a database file since WAL needs one
+@skipUnless(connection.vendor == "sqlite", "SQLite tuning")
+class SQLiteTuningTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        database = sqlite.profile_settings(connection.settings_dict, os.path.join(tmp_dir.name, "db.sqlite3"), tuned=True)
+        self.tuned = SQLiteDatabaseWrapper(database, alias="tuned")
+        self.addCleanup(self.tuned.close)
+
+    def test_profiles(self):
+        default = sqlite.profile_settings(connection.settings_dict, "db.sqlite3", tuned=False)
+        self.assertEqual((default["OPTIONS"], default["CONN_MAX_AGE"]), ({}, 0))
+        self.assertEqual(self.tuned.settings_dict["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertGreater(self.tuned.settings_dict["CONN_MAX_AGE"], 0)
+
+    def test_connection_pragmas(self):
+        self.assertEqual(sqlite.read_pragma("journal_mode", self.tuned), "wal")
+        self.assertEqual(sqlite.read_pragma("synchronous", self.tuned), 1)     #NORMAL
+        self.assertEqual(sqlite.read_pragma("busy_timeout", self.tuned), 5000)
+        self.assertEqual(sqlite.read_pragma("cache_size", self.tuned), -64 * 1024)
+
+    def test_bulk_load_restores_pragmas(self):
+        with self.settings(CLAIM_SQLITE_TUNING=True):
+            with sqlite.bulk_load(self.tuned):
+                self.assertEqual(sqlite.read_pragma("synchronous", self.tuned), 0)
+                self.assertEqual(sqlite.read_pragma("cache_size", self.tuned), -256 * 1024)
+        self.assertEqual(sqlite.read_pragma("synchronous", self.tuned), 1)
+        self.assertEqual(sqlite.read_pragma("cache_size", self.tuned), -64 * 1024)
+
+    def test_bulk_load_off_or_inside_transaction(self):
+        with self.settings(CLAIM_SQLITE_TUNING=False), sqlite.bulk_load(self.tuned):
+            self.assertEqual(sqlite.read_pragma("synchronous", self.tuned), 1)
+        level = sqlite.read_pragma("synchronous")
+        with self.settings(CLAIM_SQLITE_TUNING=True), sqlite.bulk_load():     #inside the test case's transaction
+            self.assertEqual(sqlite.read_pragma("synchronous"), level)
+
+
+#a parallel load forks its parse workers first and applies the bulk-load pragmas to the connection it writes with
+#outside a test case transaction, bulk_load does nothing inside one
+@skipUnless(connection.vendor == "sqlite", "SQLite tuning")
+@mock.patch("claims.mirrors.compact", return_value=0)
+class SQLiteBulkLoadTests(TransactionTestCase):
+
+    def test_parallel_load_writes_with_the_bulk_load_pragmas(self, compact):
+        levels = []
+        write_claims = ingest.write_claims
+
+        def recording_write_claims(*args):
+            levels.append(sqlite.read_pragma("synchronous"))
+            return write_claims(*args)
+
+        #closing an in-memory test database is a no-op, a real close reopens with the connection's own pragmas
+        def close_all():
+            sqlite.write_pragmas({"synchronous": "FULL"})
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_data_file(directory, "claim_list_data.json", claim_rows((1, 2, 3)))
+            write_data_file(directory, "claim_detail_data.json", detail_rows((1, 2, 3)))
+            with self.settings(CLAIM_SQLITE_TUNING=True), \
+                    mock.patch("claims.ingest.connections.close_all", close_all), \
+                    mock.patch("claims.ingest.write_claims", recording_write_claims):
+                call_command("load_claims", directory, "--workers", "2", stdout=StringIO())
+
+        self.assertEqual(levels, [0])                                           #OFF while writing
+        self.assertEqual(Claim.objects.count(), 3)
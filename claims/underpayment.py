@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from claims import fragments, summary
+from claims.models import Claim, ClaimDetail, ClaimStatus, Insurer, SystemFlag
+
+#underpayment rules evaluated over every claim, flagged claims get a SystemFlag with source "rule"
+#claims are read in keyset batches as plain columns (id, status id, insurer id, billed, paid) and checked in python,
+#then the rule flags are brought in line with the result: missing ones bulk created, stale ones deleted in bulk
+#manual flags (the flag button) are never touched
+
+#claims read per query
+BATCH_SIZE = 50000
+
+#flags created or deleted per query
+WRITE_BATCH_SIZE = 1000
+
+#message of a rule flag, e.g. "Paid 62.4% of billed, below the 85% threshold for Aetna - review recommended."
+MESSAGE = "Paid {ratio:.1%} of billed, below the {threshold:.0%} threshold for {rule} - review recommended."
+MESSAGE_LENGTH = SystemFlag._meta.get_field('message').max_length
+
+#paid/billed thresholds, see CLAIM_UNDERPAYMENT_RULES in settings
+@dataclass(frozen=True)
+class Rules:
+    statuses: tuple = ('Paid',)             #only claims with these statuses are checked
+    min_ratio: float = 0.85                 #default threshold
+    insurer_ratios: dict = field(default_factory=dict)     #insurer name -> threshold, replaces the default
+    cpt_ratios: dict = field(default_factory=dict)         #CPT code -> threshold, the highest of a claim's codes applies if above the insurer's
+
+    @classmethod
+    def from_dict(cls, values):
+        unknown = set(values) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError(f"Unknown underpayment rule settings: {', '.join(sorted(unknown))}")
+        return cls(**{key: tuple(value) if key == 'statuses' else value for key, value in values.items()})
+
+    @classmethod
+    def from_settings(cls):
+        return cls.from_dict(getattr(settings, 'CLAIM_UNDERPAYMENT_RULES', {}))
+
+#result of a run
+@dataclass
+class ScanResult:
+    checked: int = 0            #claims whose ratio was evaluated
+    flagged: int = 0            #claims below their threshold
+    created: int = 0            #rule flags added
+    deleted: int = 0            #rule flags removed, the claim is no longer below its threshold or its message changed
+
+#thresholds with the name of the rule they come from
+#insurer thresholds by insurer id, CPT thresholds by code, only those above the claim's insurer threshold can apply
+def compiled_thresholds(rules, insurers):
+    default = (float(rules.min_ratio), 'all insurers')
+    by_insurer = {
+        insurer_id: (float(rules.insurer_ratios[name]), name) if name in rules.insurer_ratios else default
+        for insurer_id, name in insurers.items()
+    }
+    by_code = {code: (float(ratio), f'CPT {code}') for code, ratio in rules.cpt_ratios.items()}
+    return by_insurer, by_code
+
+#CPT code list of the first detail of every claim with a pk in [low, high], as {claim pk: "code,code"}
+def codes_between(low, high):
+    return dict(
+        ClaimDetail.objects.filter(claim_id__gte=low, claim_id__lte=high)
+        .order_by('-id')                    #first detail wins, same one edit_claim edits
+        .values_list('claim_id', 'cpt_codes')
+    )
+
+#{claim pk: (message, status_id, insurer_id)} for every claim below its threshold
+#amounts are read as floats, Decimal conversion would cost more than the check itself and a ratio does not need exact cents
+def evaluate(rules, result, batch_size=BATCH_SIZE):
+    by_insurer, by_code = compiled_thresholds(rules, dict(Insurer.objects.values_list('id', 'name')))
+    status_ids = list(ClaimStatus.objects.filter(name__in=rules.statuses).values_list('id', flat=True))
+    flagged = {}
+    if not status_ids:
+        return flagged
+
+    last_pk = 0
+    while True:
+        batch = list(
+            Claim.objects.filter(pk__gt=last_pk, claim_status_id__in=status_ids)
+            .order_by('pk')
+            .annotate(billed=Cast('billed_amount', FloatField()), paid=Cast('paid_amount', FloatField()))
+            .values_list('pk', 'claim_status_id', 'insurer_id', 'billed', 'paid')[:batch_size]
+        )
+        if not batch:
+            return flagged
+        last_pk = batch[-1][0]
+        codes = codes_between(batch[0][0], last_pk) if by_code else {}
+
+        for pk, status_id, insurer_id, billed, paid in batch:
+            if billed <= 0:
+                continue
+            result.checked += 1
+            threshold, rule = by_insurer[insurer_id]
+            cpt_codes = codes.get(pk)
+            if cpt_codes:
+                for code in cpt_codes.replace(' ', '').split(','):
+                    if code in by_code and by_code[code][0] > threshold:
+                        threshold, rule = by_code[code]
+            if paid < billed * threshold:
+                message = MESSAGE.format(ratio=paid / billed, threshold=threshold, rule=rule)[:MESSAGE_LENGTH]
+                flagged[pk] = (message, status_id, insurer_id)
+
+#evaluates the rules over every claim and brings the rule flags in line, returns a ScanResult
+#with dry_run nothing is written
+def flag_underpayments(rules=None, dry_run=False, batch_size=BATCH_SIZE):
+    rules = rules or Rules.from_settings()
+    result = ScanResult()
+    flagged = evaluate(rules, result, batch_size)
+    result.flagged = len(flagged)
+
+    #a rule flag is kept only if its claim is still flagged with the same message, so a changed ratio or threshold replaces it
+    kept = set()
+    stale = []              #(flag id, claim pk, status id, insurer id)
+    rule_flags = SystemFlag.objects.filter(source=SystemFlag.RULE).values_list(
+        'id', 'claim_id', 'message', 'claim__claim_status_id', 'claim__insurer_id',
+    )
+    for flag_id, claim_pk, message, status_id, insurer_id in rule_flags:
+        if claim_pk in flagged and flagged[claim_pk][0] == message and claim_pk not in kept:
+            kept.add(claim_pk)
+        else:
+            stale.append((flag_id, claim_pk, status_id, insurer_id))
+    missing = [claim_pk for claim_pk in flagged if claim_pk not in kept]
+    result.created = len(missing)
+    result.deleted = len(stale)
+    if dry_run:
+        return result
+
+    #report flag counts move by group, the group names come from the lookup tables
+    statuses = dict(ClaimStatus.objects.values_list('id', 'name'))
+    insurers = dict(Insurer.objects.values_list('id', 'name'))
+    delta = summary.SummaryDelta()
+    with transaction.atomic():
+        for start in range(0, len(stale), WRITE_BATCH_SIZE):
+            chunk = stale[start:start + WRITE_BATCH_SIZE]
+            SystemFlag.objects.filter(id__in=[flag_id for flag_id, _, _, _ in chunk]).delete()
+            for _, _, status_id, insurer_id in chunk:
+                delta.add_flags(statuses[status_id], insurers[insurer_id], -1)
+
+        SystemFlag.objects.bulk_create(
+            [SystemFlag(claim_id=claim_pk, message=flagged[claim_pk][0], source=SystemFlag.RULE) for claim_pk in missing],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        for claim_pk in missing:
+            _, status_id, insurer_id = flagged[claim_pk]
+            delta.add_flags(statuses[status_id], insurers[insurer_id], 1)
+        delta.apply()
+        fragments.bump({claim_pk for _, claim_pk, _, _ in stale} | set(missing))     #flag icons of the table rows
+    return result
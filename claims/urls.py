@@ -4,6 +4,7 @@ from django.contrib.auth import views as auth_views #used for log in/out
 
 urlpatterns = [
     path("", views.home, name="home"),                                                                      # "" means this URL pattern matches the root of wherever this app is mounted -also used as table partial path-
+    path("claim/<int:pk>/panel/", views.claim_panel, name="claim_panel"),                                   #called by the view button, detail, notes, flags and actions panels in one response
     path("claim/<int:pk>/details/", views.claim_detail, name="claim_detail_partial"),                       #called by the view button for claim detail dashboard
     path('claim/<int:pk>/add-note/', views.add_note, name='add_note'),                                      #called by add note button to request POST method (adds to Note DB)
     path("claim/<int:pk>/notes/", views.claim_notes_partial, name="claim_notes_partial"),                   #called when view is pressed to show claim notes for claim 
@@ -12,8 +13,12 @@ urlpatterns = [
     path("claim/<int:pk>/flags/", views.flag_partial, name="flag_partial"),                                 #called when view button is pressed to render flag panel
     path('claim/<int:pk>/actions/', views.quick_actions_partial, name='quick_actions_partial'),             #called when view is clicked for quick actions to receive claim id 
     path('claim/<int:pk>/edit/', views.edit_claim, name='edit_claim'),                                      #called when a claim edit is saved
+    path('claims/export/', views.export_claims, name='export_claims'),                                      #called by the export links to download the filtered claims
+    path('claims/bulk-edit/', views.bulk_edit, name='bulk_edit'),                                           #called by bulk edit button to load the form, and to apply it to many claims
     path("login/", auth_views.LoginView.as_view(template_name="registration/login.html"), name="login"),    #called upon loading default view due to @login_required
     path("logout/", auth_views.LogoutView.as_view(next_page="login"), name="logout"),                       #called by logout button
     path("signup/", views.signup_view, name="signup"),                                                      #called by signup button in login page
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),                                #called by generate report button
+    path('mirror-sync/status/', views.mirror_sync_status, name='mirror_sync_status'),                      #staff only json status of the background file sync
+    path('profiling/stats/', views.profiling_stats, name='profiling_stats'),                              #staff only json per-view latency and query stats
 ]
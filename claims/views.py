@@ -1,77 +1,110 @@
 from django.shortcuts import render, get_object_or_404
-from claims.models import Claim,SystemFlag  #tables
-from claims.forms import NoteForm, EditClaimForm   #form template for claim notes, and for file reupload
+from claims.models import Claim,SystemFlag,Note  #tables
+from claims.forms import NoteForm, EditClaimForm, BulkEditForm   #form template for claim notes, and for file reupload
 from django.core.paginator import Paginator #split table into pages
-from django.db.models import Q, Count, Avg  # queries and math 
+from claims.pagination import KeysetPaginator #split table into pages by cursor
+from django.conf import settings #pagination mode and file sync settings
+from django.db.models import Exists, OuterRef, Prefetch  # queries
 from django.contrib.auth.decorators import login_required #make users log in to use the system
+from django.contrib.admin.views.decorators import staff_member_required #staff only views
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, Http404 #json responses for status endpoints, streamed exports
+from asgiref.sync import sync_to_async  #sync calls from the async views
+from django.utils.cache import patch_vary_headers  #full page and table partial share a URL
 from django.contrib.auth.models import User #built in user model, only using username and password fields
 from django.contrib import messages #allows for messages from views to templates
 from django.contrib.auth import login #attaches user to session, allows for request.user and instant login
-import json #writing to json files
-import csv  #writing to csv files
-from pathlib import Path    #used for file path
-from django.conf import settings    #used for absolute file path
+from claims import mirrors  #write-back of edits to the json and csv files
+from claims.search import claim_filters  #indexed search over patient name, status and insurer plus the dropdown filters
+from claims import facets as claim_facets  #cached dropdown values with claim counts
+from claims.stats import dashboard_stats  #report KPIs
+from claims import summary as claim_summary  #pre-aggregated report rows
+from claims import profiling  #per-view latency and query stats
+from claims.bulk import bulk_edit as apply_bulk_edit  #batched edits of many claims
+from claims import export  #streamed csv/json downloads
+from claims import fragments  #claim versions that key the cached table rows and detail panels
+from claims import etags  #conditional GET of the table and claim partials
+
+#rows shown per table page
+CLAIMS_PER_PAGE = 5
 
 #default view, renders the table and the pagination controls
+#async like the claim partials below, every row is read with the async ORM before rendering since templates cannot query from async code
 @login_required     #forces log in 
-def home(request):
+async def home(request):
     search_query = request.GET.get("q", "")
     page_number = request.GET.get("page", 1)
-    claims_list = Claim.objects.all().order_by("id").prefetch_related('details','flags', 'notes')  # Order for consistency and fetches the associated details from ClaimDetails and Notes
+    claims_list = Claim.objects.all().order_by("id").annotate(   # Order for consistency
+        has_flags=Exists(SystemFlag.objects.filter(claim=OuterRef("pk"))),  #flag and note icons come from the same query as the rows, no query per row
+        has_notes=Exists(Note.objects.filter(claim=OuterRef("pk"))),
+    )
     selected_insurer = request.GET.get("insurer", "")
     selected_status = request.GET.get("status", "")
 
-    filters = Q()  # start empty
+    filters = await sync_to_async(claim_filters)(search_query, selected_insurer, selected_status)   #search, insurer and status filters, in a thread since a search queries the database (the FTS table check, the lookup ids without FTS)
 
-    #search by text fields 
-    if search_query:
-        text_filters = (
-            Q(patient_name__icontains=search_query) |
-            Q(status__icontains=search_query) |
-            Q(insurer_name__icontains=search_query)
-        )
-        #search by exact digit claim id 
-        if search_query.isdigit():
-            text_filters |= Q(claim_id=int(search_query))
-        filters &= text_filters
-
-    # filter by selected insurer 
-    if selected_insurer:
-        filters &= Q(insurer_name=selected_insurer)
-
-    # filter by selected status 
-    if selected_status:
-        filters &= Q(status=selected_status)
-        
     #applies combined filters
     claims_list = claims_list.filter(filters)
 
-    paginator = Paginator(claims_list, 5)  # 5 rows per page
-    page_obj = paginator.get_page(page_number) #gets contents of page 
-
-    insurers = Claim.objects.values_list('insurer_name', flat=True).distinct()  #only stores a single instance of each different insurance name or status for dropdown menu
-    statuses = Claim.objects.values_list('status', flat=True).distinct()
+    #cursor pagination seeks straight to the page with WHERE id > last id, no COUNT(*) or OFFSET
+    if settings.CLAIMS_PAGINATION == "keyset":
+        paginator = KeysetPaginator(claims_list, CLAIMS_PER_PAGE, ordering=["id"])
+        page_obj = await paginator.aget_page(request.GET.get("cursor", ""))
+    else:
+        paginator = Paginator(claims_list, CLAIMS_PER_PAGE)
+        page_obj = await sync_to_async(paginator.get_page)(page_number) #gets contents of page, COUNT(*) has no async form in Paginator
+        page_obj.object_list = [claim async for claim in page_obj.object_list]
 
+    #a table refresh the browser already has is answered with a 304 before anything is rendered
+    if request.headers.get("HX-Request"):
+        etag = etags.table_etag(request, page_obj)
+        not_modified = etags.table_not_modified(request, etag)
+        if not_modified:
+            return not_modified
 
     #information passed to the partial
     context = {
         "claims": page_obj,
         "q": search_query,
-        "insurers": insurers,
-        "statuses": statuses,
         "selected_insurer": selected_insurer,
         "selected_status": selected_status,
+        "cursor_mode": settings.CLAIMS_PAGINATION == "keyset",
     }
 
     if request.headers.get("HX-Request"):  
         # If request comes from HTMX, return only the table body
-        return render(request, "claims/claims_table_body.html", context) #avoids rerendering the search and filter, and detail notes/annotations and quick actions back to claim.0
+        response = render(request, "claims/claims_table_body.html", context) #avoids rerendering the search and filter, and detail notes/annotations and quick actions back to claim.0
+        return etags.revalidate(response, etag)
+
+    facets = await claim_facets.aget_facets()     #cached (value, claim count) pairs for the dropdown menus, only rebuilt when claims change
+    context["insurers"] = facets["insurers"]      #only the full page has the dropdowns
+    context["statuses"] = facets["statuses"]
+
+    request.user = await request.auser()        #the user login_required loaded, request.user would query it again
+    response = await sync_to_async(render)(request, "claims/base.html", context) # returns full page upon initial load, in a thread since its template still queries
+    patch_vary_headers(response, etags.VARY)    #never served from the browser cache in place of the partial
+    return response
 
-    return render(request, "claims/base.html", context) # returns full page upon initial load
+#notes with their authors, the author names are shown without a query per note
+NOTES_WITH_AUTHORS = Prefetch("notes", queryset=Note.objects.select_related("created_by"))
+
+#get_object_or_404 for the async claim partials, the relations their templates read are prefetched with the claim
+async def aget_claim(pk, *related):
+    try:
+        return await Claim.objects.prefetch_related(*related).aget(pk=pk)
+    except Claim.DoesNotExist:
+        raise Http404("No Claim matches the given query.")
+
+#renders the detail, notes, flag and quick action panels of a claim in one response, the last three as out of band swaps
+#replaces four requests per click with one, the related rows come from one query per relation
+@etags.claim_partial       #304 while the claim's version is unchanged
+async def claim_panel(request, pk):
+    claim = await aget_claim(pk, "details", NOTES_WITH_AUTHORS, "flags")
+    return render(request, "claims/claim_panel.html", {"claim": claim, "flags": claim.flags.all()})
 
 #renders claim detail partial file and passes associated claim
-def claim_detail(request, pk):
-    claim = get_object_or_404(Claim, pk=pk)
+@etags.claim_partial
+async def claim_detail(request, pk):
+    claim = await aget_claim(pk, "details")
     return render(request, "claims/claim_detail_partial.html", {"claim": claim})
 
 #POST method for notes
@@ -85,12 +118,14 @@ def add_note(request, pk):
             note.claim = claim              #links note with associating claim through fk
             note.created_by = request.user  #links to logged in user throguh django middleware
             note.save()                     #saves
+            fragments.bump([claim.pk])      #the row's note icon changes
     # Return updated notes partial
     return render(request, "claims/notes_partial.html", {"claim": claim})
 
 #renders notes panel
-def claim_notes_partial(request, pk):
-    claim = get_object_or_404(Claim, pk=pk)
+@etags.claim_partial
+async def claim_notes_partial(request, pk):
+    claim = await aget_claim(pk, NOTES_WITH_AUTHORS)
     notes = claim.notes.all()             #retrieves all notes associated with claim pk
     #Return updated notes partial
     return render(request, "claims/notes_partial.html", {"claim": claim, "notes": notes})
@@ -103,8 +138,10 @@ def add_flag(request, pk):
     if not claim.flags.exists():
         SystemFlag.objects.create(
             claim=claim,
-            message="Potential underpayment detected - review recommended."  # must match model field "message"
+            message=SystemFlag.MANUAL_MESSAGE  # must match model field "message"
         )
+        claim_summary.record_flags(claim, 1)    #report flag totals
+        fragments.bump([claim.pk])              #the row's flag icon changes
 
     # Return updated flag panel for HTMX
     flags = claim.flags.all() 
@@ -113,19 +150,24 @@ def add_flag(request, pk):
 #removes flag from claim
 def remove_flag(request, pk):
     claim = get_object_or_404(Claim, pk=pk)
-    claim.flags.all().delete()  # remove all flags for this claim
+    removed, _ = claim.flags.all().delete()  # remove all flags for this claim
+    claim_summary.record_flags(claim, -removed)
+    if removed:
+        fragments.bump([claim.pk])
     flags = claim.flags.all()
     return render(request, "claims/flag_partial.html", {"claim": claim, "flags": flags})
 
 #renders the flag panel 
-def flag_partial(request, pk):
-    claim = get_object_or_404(Claim, pk=pk)
+@etags.claim_partial
+async def flag_partial(request, pk):
+    claim = await aget_claim(pk, "flags")
     flags = claim.flags.all()
     return render(request, "claims/flag_partial.html", {"claim": claim, "flags": flags})
 
 #renders the quick actions panel
-def quick_actions_partial(request, pk):
-    claim = get_object_or_404(Claim, pk=pk)
+@etags.claim_partial
+async def quick_actions_partial(request, pk):
+    claim = await aget_claim(pk, "flags")     #the flag button checks claim.flags.exists
     return render(request, "claims/actions_partial.html", {"claim": claim})
 
 #renders the signup view page, logic for adding a user
@@ -158,205 +200,10 @@ def signup_view(request):
 
 #admin dashboard
 def admin_dashboard(request):
-    #loads all claims
-    claims = Claim.objects.all()
-    total_claims = claims.count()   #counts number of claims
-    paid_claims = claims.filter(status='Paid').count()     #counts number of Paid status claims
-    denied_claims = claims.filter(status='Denied').count() #coutns number of Denied status claims
-
-    #loads all flags
-    flags = SystemFlag.objects.all()
-    total_flags =  flags.count()    #counts number of flags
-
-    # Percentages of paid and denied claims
-    paid_percentage = round((paid_claims / total_claims) * 100, 1) 
-    denied_percentage = round((denied_claims / total_claims) * 100, 1) 
-
-    # Averages
-    avg_billed = claims.aggregate(avg_billed=Avg('billed_amount'))['avg_billed'] #returns dict, value is in avg_billed
-    avg_paid = claims.aggregate(avg_paid=Avg('paid_amount'))['avg_paid']
-
-    # Claims by status
-    status_data = claims.values('status').annotate(count=Count('id'))
-    status_labels = [s['status'] for s in status_data]      #stores different status labels
-    status_counts = [s['count'] for s in status_data]       #stores count for each different status
-
-    # Claims by insurer
-    insurer_data = claims.values('insurer_name').annotate(count=Count('id'))
-    insurer_labels = [i['insurer_name'] for i in insurer_data]  #stores different insurer names
-    insurer_counts = [i['count'] for i in insurer_data]         #stores count for each insurer
-
-    context = {
-        'total_claims': total_claims,
-        'paid_percentage': paid_percentage,
-        'denied_percentage': denied_percentage,
-        'avg_billed': avg_billed,
-        'avg_paid': avg_paid,
-        'total_flags': total_flags,
-        'status_labels': status_labels,
-        'status_counts': status_counts,
-        'insurer_labels': insurer_labels,
-        'insurer_counts': insurer_counts,
-    }
+    stats = dashboard_stats()      #every KPI from the pre-aggregated summary rows, safe on an empty table
 
     #renders the admin dashboard with the corresponding values 
-    return render(request, 'claims/admin_dashboard.html', context)
-
-#absolute file paths for each file
-CLAIM_LIST_JSON = Path(settings.BASE_DIR) / "data" / "claim_list_data.json"
-CLAIM_DETAIL_JSON = Path(settings.BASE_DIR) / "data" / "claim_detail_data.json"
-CLAIM_LIST_CSV = Path(settings.BASE_DIR) / "data" / "claim_list_data.csv"
-CLAIM_DETAIL_CSV = Path(settings.BASE_DIR) / "data" / "claim_detail_data.csv"
-
-#write to claim_list_data files
-def save_claim_list(claim):
-    
-    original_id = claim.claim_id  # not Django PK, actual claim id
-
-    #JSON update
-    try:
-        with open(CLAIM_LIST_JSON, "r", encoding="utf-8") as f:             #open the file in read mode
-            data = json.load(f)
-    except FileNotFoundError:
-        data = None
-    
-    if data is not None:                                                    #will only write if the file exists
-        #bool check for update status 
-        updated = False
-        for item in data:
-            if item.get("id") == original_id:                               #if id matches the claim id being edited, the attributes are updated with respective typecasting
-                item.update({
-                    "patient_name": str(claim.patient_name),
-                    "billed_amount": float(claim.billed_amount),
-                    "paid_amount": float(claim.paid_amount),
-                    "insurer_name": str(claim.insurer_name),
-                    "status": str(claim.status),
-                    "discharge_date": str(claim.discharge_date),
-                })
-                updated = True  #set bool to true
-                break
-
-        #error case
-        if not updated:
-            print(f"Claim id={original_id} not found in JSON!")
-
-        else:
-            with open(CLAIM_LIST_JSON, "w", encoding="utf-8") as f:             #open file in write mode and overwrite with updated values
-                json.dump(data, f, indent=2)
-
-            #output message 
-            print(f"JSON saved to: {CLAIM_LIST_JSON}")
-
-    #CSV update
-    try:
-        with open(CLAIM_LIST_CSV, "r", encoding="utf-8", newline="") as f:
-            reader = csv.DictReader(f, delimiter="|")               # the csv files use pipe delimiter
-            rows = list(reader)
-            fieldnames = reader.fieldnames
-    except FileNotFoundError:
-        rows = None
-
-    if rows is not None:                                             #will only write if the file exists
-        #bool
-        updated = False
-        for row in rows:
-            if int(row["id"]) == original_id:                        #if id matches the claim id being edited, the attributes are updated, all strings 
-                row.update({
-                    "patient_name": str(claim.patient_name),
-                    "billed_amount": str(claim.billed_amount),
-                    "paid_amount": str(claim.paid_amount),
-                    "insurer_name": str(claim.insurer_name),
-                    "status": str(claim.status),
-                    "discharge_date": str(claim.discharge_date),
-                })
-                updated = True #update bool
-                break
-
-        #error case
-        if not updated:
-            print(f"Claim id={original_id} not found in CSV!")
-
-        else:
-            with open(CLAIM_LIST_CSV, "w", encoding="utf-8", newline="") as f:      #rewrite the file 
-                writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter="|")
-                writer.writeheader()
-                writer.writerows(rows)
-
-            #output message 
-            print(f"CSV saved to: {CLAIM_LIST_CSV}")
-
-
-#write to claim_detail_data files 
-def save_claim_detail(claim_detail):
-   
-   #if no claim details, it ends the function call
-    if not claim_detail:
-        return
-
-    original_id = claim_detail.claim.claim_id   # original id storing 
-
-    #JSON update
-    try:
-        with open(CLAIM_DETAIL_JSON, "r", encoding="utf-8") as f:       #open file in read mode and load to data
-            data = json.load(f)
-    except FileNotFoundError:
-        data = None
-    
-    if data is not None:                                                #will only write if the file exists
-        #bool variable
-        updated = False
-        for item in data:                                                   #if there is a id match, update the denial and cpt, both strings
-            if item.get("claim_id") == original_id:
-                item.update({
-                    "denial_reason": str(claim_detail.denial_reason),
-                    "cpt_codes": str(claim_detail.cpt_codes),
-                })
-                updated = True  #update bool
-                break
-
-        #error case 
-        if not updated:
-            print(f"Claim_detail claim_id={original_id} not found in JSON!")
-
-        else:
-            with open(CLAIM_DETAIL_JSON, "w", encoding="utf-8") as f:           #open file in write mode and overwrite 
-                json.dump(data, f, indent=2)
-
-            #output message 
-            print(f"JSON saved to: {CLAIM_DETAIL_JSON}")
-
-    #CSV update
-    try:
-        with open(CLAIM_DETAIL_CSV, "r", encoding="utf-8", newline="") as f:    #open file in read mode
-            reader = csv.DictReader(f, delimiter="|")                           #use pipe delimiters 
-            rows = list(reader)
-            fieldnames = reader.fieldnames
-    except FileNotFoundError:
-        rows = None
-    
-    if rows is not None:                                                         #will only write if the file exists
-        #bool variable
-        updated = False
-        for row in rows:
-            if int(row["claim_id"]) == original_id:                              #if there is a id match, update the denial and cpt, both strings
-                row.update({
-                    "denial_reason": str(claim_detail.denial_reason),
-                    "cpt_codes": str(claim_detail.cpt_codes),
-                })
-                updated = True      #set bool to true
-                break
-
-        #error case
-        if not updated:
-            print(f"Claim_detail claim_id={original_id} not found in CSV!")
-
-        else:
-            with open(CLAIM_DETAIL_CSV, "w", encoding="utf-8", newline="") as f:      #open in write mode and overwrite data
-                writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter="|")
-                writer.writeheader()
-                writer.writerows(rows)
-            #output message 
-            print(f"CSV saved to: {CLAIM_DETAIL_CSV}")
+    return render(request, 'claims/admin_dashboard.html', stats.as_context())
 
 #edit claim function
 def edit_claim(request, pk):
@@ -365,16 +212,22 @@ def edit_claim(request, pk):
 
     #if the form was submitted
     if request.method == "POST":
+        old_facets = {"status": claim.status, "insurer_name": claim.insurer_name}  #is_valid copies the posted values onto the claim
+        before = claim_summary.snapshot(claim)                  #report group and amounts before the edit
         form = EditClaimForm(request.POST, instance=claim)
         if form.is_valid():                                     #check validity and save 
+            claim.row_hash = ""                                 #no longer matches the loaded file row, a delta load will rewrite it
+            claim.version = fragments.NEXT_VERSION              #incremented by the UPDATE itself, a concurrent bump is never overwritten
             form.save()                                         #updates the Claim model
+            claim.refresh_from_db(fields=["version"])           #the saved number instead of the expression, for the render and the mirrors
+            claim_facets.adjust({field: (old, getattr(claim, field)) for field, old in old_facets.items()})   #keep dropdown counts current
+            claim_summary.record_edit(before, claim)            #keep report totals current
             
             if claim_detail:
                 cpt_codes = form.cleaned_data.get("cpt_codes")                  #get cpt and denial reason attribute values from form
                 denial_reason = form.cleaned_data.get("denial_reason")
                 cpt_mode = form.cleaned_data.get("cpt_mode", "overwrite")       #retrieves mode, sets overwrite as default
                 denial_mode = form.cleaned_data.get("denial_mode", "overwrite") 
-                print(denial_mode)
 
                 if cpt_codes:                                                   #if cpt codes are being appended, seperate them with a comma
                     if cpt_mode == "Append":                                    #using "Append" since the clean form function capitalizes it 
@@ -394,11 +247,11 @@ def edit_claim(request, pk):
                     else:
                         claim_detail.denial_reason = denial_reason              #overwrite option
 
+                claim_detail.row_hash = ""
                 claim_detail.save()                                             #update ClaimDetails model 
 
-            # Write to files
-            save_claim_list(claim)
-            save_claim_detail(claim_detail)
+            # Write to files, handed to the background mirror sync so the response does not wait for the file writes
+            mirrors.submit(claim, claim_detail)
 
             # Return the form again with success message
             context = {"form": form, "claim": claim, "success": "Claim updated successfully!"}
@@ -410,4 +263,63 @@ def edit_claim(request, pk):
         form = EditClaimForm(instance=claim) #populated form with both claim and claim details
         
     #render the prepopulated form 
-    return render(request, "claims/edit_claim.html", {"form": form, "claim": claim})
\ No newline at end of file
+    return render(request, "claims/edit_claim.html", {"form": form, "claim": claim})
+
+#downloads every claim matching the table's search and filters as pipe delimited CSV or JSON, streamed as it is read
+@login_required
+def export_claims(request):
+    file_format = request.GET.get("format", "csv")
+    if file_format not in export.CONTENT_TYPES:
+        return HttpResponseBadRequest("format must be csv or json")
+
+    filters = claim_filters(request.GET.get("q", ""), request.GET.get("insurer", ""), request.GET.get("status", ""))
+    response = StreamingHttpResponse(export.export_chunks(filters, file_format), content_type=export.CONTENT_TYPES[file_format])
+    response["Content-Disposition"] = f'attachment; filename="claims.{file_format}"'
+    return response
+
+#bulk edit form, applies one status/insurer/CPT/denial change to the checked claims or to every claim matching the table filters
+@login_required
+def bulk_edit(request):
+    if request.method == "POST":
+        form = BulkEditForm(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            if data["scope"] == "filter":
+                filters = claim_filters(data["filter_q"], data["filter_insurer"], data["filter_status"])
+                claim_pks = list(Claim.objects.filter(filters).values_list("pk", flat=True))
+            else:
+                claim_pks = data["claim_ids"]
+
+            updated = apply_bulk_edit(
+                claim_pks,
+                status=data["status"],
+                insurer_name=data["insurer_name"],
+                cpt_codes=data["cpt_codes"],
+                cpt_append=data["cpt_mode"] == "Append",          #"Append" since the clean form function capitalizes it
+                denial_reason=data["denial_reason"],
+                denial_append=data["denial_mode"] == "Append",
+            )
+            form = BulkEditForm(initial={key: data[key] for key in ("scope", "filter_q", "filter_insurer", "filter_status")})
+            context = {"form": form, "success": f"Updated {updated} claim{'s' if updated != 1 else ''}."}
+            return render(request, "claims/bulk_edit.html", context)
+    else:
+        form = BulkEditForm(initial={                       #the table's current search and filters
+            "filter_q": request.GET.get("q", ""),
+            "filter_insurer": request.GET.get("insurer", ""),
+            "filter_status": request.GET.get("status", ""),
+        })
+
+    return render(request, "claims/bulk_edit.html", {"form": form})
+
+#queue depth and flush lag of the background file sync for this server process, staff only
+@staff_member_required
+def mirror_sync_status(request):
+    return JsonResponse(mirrors.sync_worker.stats())
+
+#per-view latency, query and template timings collected by the profiling middleware for this server process, staff only
+#POST clears them
+@staff_member_required
+def profiling_stats(request):
+    if request.method == "POST":
+        profiling.store.reset()
+    return JsonResponse(profiling.store.stats())
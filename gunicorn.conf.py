@@ -0,0 +1,35 @@
+# Gunicorn settings for both serving profiles, picked with the CLAIM_SERVER environment variable.
+# "wsgi" runs gunicorn's sync workers, one request per worker at a time.
+# "asgi" runs uvicorn workers: the async claim views await the database, so a worker keeps serving other
+# requests while one waits on a query. It is opt-in: the export is buffered whole before it is sent, since its
+# generator is sync, and the sync write views share one thread per worker. Compare both with `python manage.py benchmark_serving`.
+# The bind address and worker count come from gunicorn's own PORT and WEB_CONCURRENCY handling.
+import os
+
+CLAIM_SERVER = os.environ.get("CLAIM_SERVER", "wsgi")
+
+if CLAIM_SERVER == "asgi":
+    wsgi_app = "myproject.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "myproject.wsgi:application"
+
+
+# benchmark_serving --query-delay-ms sets CLAIM_QUERY_DELAY_MS to add that much latency to every query,
+# standing in for a database on another host; never set it in a deployment
+def post_worker_init(worker):
+    delay = float(os.environ.get("CLAIM_QUERY_DELAY_MS", 0)) / 1000
+    if not delay:
+        return
+
+    import time
+    from django.db.backends.signals import connection_created
+
+    def delayed(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def add_delay(sender, connection, **kwargs):
+        connection.execute_wrappers.append(delayed)
+
+    connection_created.connect(add_delay, weak=False)
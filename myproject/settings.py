@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'claims.profiling.ProfilingMiddleware', #first so it times the whole request, see CLAIM_PROFILING
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +59,7 @@ ROOT_URLCONF = 'myproject.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'claims.profiling.TimedDjangoTemplates',  #Django templates that report render time to the profiler
         'DIRS': [BASE_DIR / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -78,6 +79,26 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 
+# Opt-in SQLite tuning for local and small deployments, turned on with CLAIM_SQLITE_TUNING=on.
+# WAL lets the table keep reading while a claim is being edited, IMMEDIATE transactions take the write lock
+# when they begin so concurrent editors queue on busy_timeout instead of failing with "database is locked",
+# and each server thread keeps its connection for CLAIM_SQLITE_CONN_MAX_AGE seconds instead of opening one per request.
+# load_claims adds the bulk-load pragmas of claims.sqlite on top. Compare with `python manage.py benchmark_sqlite`.
+CLAIM_SQLITE_TUNING = os.environ.get("CLAIM_SQLITE_TUNING", "off") == "on"
+CLAIM_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",            # with WAL a crash cannot corrupt the file, a power loss can drop the last commits
+    "mmap_size": 256 * 1024 * 1024,     # bytes of the file read through memory mapping
+    "cache_size": -64 * 1024,           # negative is KiB, 64 MiB of page cache per connection
+    "busy_timeout": 5000,               # milliseconds a writer waits for the lock
+    "temp_store": "MEMORY",
+}
+CLAIM_SQLITE_OPTIONS = {
+    "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in CLAIM_SQLITE_PRAGMAS.items()),
+    "transaction_mode": "IMMEDIATE",
+}
+CLAIM_SQLITE_CONN_MAX_AGE = 600
+
 if os.getenv("RENDER"):  # Render sets this env var automatically
     DATABASES = {
         "default": dj_database_url.config(conn_max_age=600, ssl_require=True)
@@ -89,6 +110,12 @@ else:
             "NAME": BASE_DIR / "db.sqlite3",
         }
     }
+    if CLAIM_SQLITE_TUNING:
+        DATABASES["default"].update(
+            OPTIONS=CLAIM_SQLITE_OPTIONS,
+            CONN_MAX_AGE=CLAIM_SQLITE_CONN_MAX_AGE,
+            CONN_HEALTH_CHECKS=True,        # a kept connection is checked before a request reuses it
+        )
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -137,12 +164,83 @@ LOGIN_URL = "login"
 # After successful login, redirect them to default view
 LOGIN_REDIRECT_URL = "/"
 
+# Claims table pagination, "keyset" pages by cursor tokens, "offset" uses page numbers
+CLAIMS_PAGINATION = os.environ.get("CLAIMS_PAGINATION", "keyset")
+
+# Seconds the cached insurer/status dropdown values may be reused before they are recounted
+CLAIM_FACETS_TIMEOUT = 300
+
+# Mixed into the ETags of the table and claim partials so a new release never answers with a 304 for HTML it changed.
+# Render sets RENDER_GIT_COMMIT, elsewhere claims.etags hashes SECRET_KEY with the app's code and templates,
+# which every server worker of the same release agrees on
+CLAIM_ETAG_SALT = os.environ.get("CLAIM_ETAG_SALT") or os.environ.get("RENDER_GIT_COMMIT") or None
+
+# Rendered claim rows and detail panels, keyed on Claim.version so an edit, note, flag or load is never served stale.
+# "locmem" keeps them in each server process, "file" in CLAIM_FRAGMENT_CACHE_DIR shared by every process on the host,
+# "redis" in the server at CLAIM_FRAGMENT_REDIS_URL (needs the redis package, run it with maxmemory-policy allkeys-lru),
+# "off" renders every time. The least recently used fragments are evicted past CLAIM_FRAGMENT_CACHE_ENTRIES.
+CLAIM_FRAGMENT_CACHE = os.environ.get("CLAIM_FRAGMENT_CACHE", "locmem")
+CLAIM_FRAGMENT_CACHE_ENTRIES = 10000
+CLAIM_FRAGMENT_CACHE_DIR = BASE_DIR / "data" / "fragment_cache"
+CLAIM_FRAGMENT_REDIS_URL = os.environ.get("CLAIM_FRAGMENT_REDIS_URL", "redis://127.0.0.1:6379/1")
+
+FRAGMENT_CACHES = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",     #already least recently used first
+        "LOCATION": "claim-fragments",
+        "OPTIONS": {"MAX_ENTRIES": CLAIM_FRAGMENT_CACHE_ENTRIES},
+    },
+    "file": {
+        "BACKEND": "claims.fragments.LRUFileBasedCache",
+        "LOCATION": CLAIM_FRAGMENT_CACHE_DIR,
+        "OPTIONS": {"MAX_ENTRIES": CLAIM_FRAGMENT_CACHE_ENTRIES},
+    },
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CLAIM_FRAGMENT_REDIS_URL,
+        "KEY_PREFIX": "claims",                                         #size is bounded by the server's maxmemory
+    },
+    "off": {
+        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+    },
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "fragments": FRAGMENT_CACHES[CLAIM_FRAGMENT_CACHE],
+}
+
 # Absolute path definitions
 CLAIM_LIST_JSON = Path(settings.BASE_DIR) / "data" / "claim_list_data.json"
 CLAIM_DETAIL_JSON = Path(settings.BASE_DIR) / "data" / "claim_detail_data.json"
 CLAIM_LIST_CSV = Path(settings.BASE_DIR) / "data" / "claim_list_data.csv"
 CLAIM_DETAIL_CSV = Path(settings.BASE_DIR) / "data" / "claim_detail_data.csv"
 
+# Edits are appended to this journal and compacted into the files above once it reaches the size below (bytes)
+CLAIM_MIRROR_JOURNAL = Path(settings.BASE_DIR) / "data" / "mirror_journal.jsonl"
+CLAIM_MIRROR_COMPACT_BYTES = 64 * 1024
+
+# "thread" hands edits to a background worker that flushes them every CLAIM_MIRROR_FLUSH_INTERVAL seconds,
+# "inline" appends them to the journal during the request
+CLAIM_MIRROR_SYNC = os.environ.get("CLAIM_MIRROR_SYNC", "thread")
+CLAIM_MIRROR_FLUSH_INTERVAL = 2.0
+
+# Per-view latency, query and template timings collected by claims.profiling.ProfilingMiddleware,
+# a request running the same SQL CLAIM_PROFILING_REPEAT_LIMIT or more times is reported as a suspected N+1
+CLAIM_PROFILING = os.environ.get("CLAIM_PROFILING", "on") != "off"
+CLAIM_PROFILING_REPEAT_LIMIT = 3
+
+# Underpayment rules of the flag_underpayments command, claims with one of the statuses are flagged when
+# paid / billed is below min_ratio, or below their insurer's ratio, or below the highest ratio of their CPT codes
+CLAIM_UNDERPAYMENT_RULES = {
+    "statuses": ["Paid"],
+    "min_ratio": 0.85,
+    "insurer_ratios": {},        # e.g. {"Aetna": 0.9}
+    "cpt_ratios": {},            # e.g. {"99213": 0.95}
+}
+
 # Expire the session when the browser closes to make user log back in
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 